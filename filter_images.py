@@ -3,16 +3,29 @@
 
 import os
 import sys
+import json
+import time
+import glob
 import shutil
+import argparse
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 import cv2
 import easyocr # EasyOCR 임포트
 import numpy as np
 
+from preprocesing.illustration_catalog import write_filtered_manifest
+import preprocesing.config_file as cfg
+
 # --- 사용자 설정 영역 시작 ---
 
-SRC_DIR = r"/home/liont/artificial_manga_panel_dataset/datasets/image_dataset/db_illustrations_bw"
-DST_DIR = r"/home/liont/artificial_manga_panel_dataset/datasets/image_dataset/filtered_illustrations_bw"
-DEBUG_DIR = r"/home/liont/artificial_manga_panel_dataset/datasets/image_dataset/debug_images"
+# 저장소 루트 기준 기본 경로, 명령줄 옵션으로 바꿀 수 있음
+SRC_DIR = "datasets/image_dataset/db_illustrations_bw"
+DST_DIR = "datasets/image_dataset/filtered_illustrations_bw"
+DEBUG_DIR = "datasets/image_dataset/debug_images"
+# 이미지별 판정(경로, 판정, 전략, 신뢰도)을 워커 프로세스마다 JSON lines로 기록. 다시 실행하면 이어서 진행
+DECISION_LOG_DIR = "datasets/image_dataset/filter_decisions"
 ENABLE_DEBUG = False
 
 EASYOCR_LANGUAGES = ['ja', 'en']
@@ -49,11 +62,37 @@ STRATEGIES_TO_TRY = [
     ("preprocess_moderate_scale_sharp", "ocr_cautious_but_more_permissive_v3")
 ]
 
-RENAME_SEQUENTIAL = True
+# 병렬로 처리해도 이름이 바뀌지 않도록 기본은 원래 파일 이름 유지.
+# 켜면 모든 판정이 끝난 뒤 저장할 파일을 이름순으로 1, 2, ... 으로 저장
+RENAME_SEQUENTIAL = False
 OUTPUT_EXTENSION = "jpg"
+# 저장할 이미지를 만드는 방법
+# "copy": 복사, "hardlink"/"symlink": 링크 (디스크 추가 사용 없음, 실패하면 복사),
+# "manifest": 파일은 그대로 두고 main.py가 읽는 목록 파일(cfg.filtered_manifest_path)만 씀
+OUTPUT_MODE = "copy"
+OUTPUT_MODES = ("copy", "hardlink", "symlink", "manifest")
 MAX_FILES_TO_PROCESS = 0
 MIN_CONF_DEBUG_DRAW_FOR_TEXT_FOCUS = 0.30
 
+# OCR 전 사전 검사: 확실히 텍스트가 없는 이미지는 OCR 없이 바로 저장하고
+# 애매한 이미지만 OCR로 보냄. 엣지 밀도 → 글자 같은 연결 요소 → MSER 순으로 검사
+# 사전 검사가 놓친 텍스트 이미지는 그대로 저장되므로 기본은 꺼짐.
+# 아래 기준값은 보정되지 않았으니 --calibrate 로 놓친 비율을 확인하고 조정한 뒤 --prescreen 으로 켤 것
+PRESCREEN_ENABLED = False
+PRESCREEN_THRESHOLDS = {
+    "max_side": 512,                    # 이 크기로 줄여서 계산
+    "max_edge_density": 0.02,           # 엣지 비율이 이 이하면 텍스트 없음
+    "max_text_components": 6,           # 글자 같은 연결 요소가 이 이하이고
+    "max_mser_regions": 10,             # 글자 크기 MSER 영역도 이 이하면 텍스트 없음
+    "char_height_range": (0.01, 0.08),  # 이미지 높이 대비 글자 높이
+    "char_aspect_range": (0.15, 2.5),   # 글자 너비/높이
+    "char_fill_range": (0.1, 0.8),      # 글자 박스 중 획이 차지하는 비율
+}
+# 워커에 한 번에 보내는 파일 수. 끝난 워커가 다음 묶음을 받아 가므로 작을수록 고르게 나뉨
+FILTER_CHUNK_SIZE = 16
+# 0보다 크면 필터링 대신 이 수만큼 표본을 뽑아 사전 검사와 전체 OCR의 일치율을 보고
+CALIBRATE_PRESCREEN_SAMPLE = 0
+
 # --- 사용자 설정 영역 끝 ---
 
 def has_text_easyocr(ocr_results, min_confidence, min_chars_per_box, min_valid_boxes):
@@ -70,7 +109,8 @@ def has_text_easyocr(ocr_results, min_confidence, min_chars_per_box, min_valid_b
     return False, ""
 
 def preprocess_image_for_easyocr(img_gray: np.ndarray, scale_factor, gaussian_blur_ksize) -> np.ndarray:
-    processed_img = img_gray.copy()
+    # cv2 함수들은 새 배열을 반환하므로 원본을 복사할 필요 없음
+    processed_img = img_gray
     if gaussian_blur_ksize > 0:
         ksize = gaussian_blur_ksize if gaussian_blur_ksize % 2 != 0 else gaussian_blur_ksize + 1
         processed_img = cv2.GaussianBlur(processed_img, (ksize, ksize), 0)
@@ -80,6 +120,182 @@ def preprocess_image_for_easyocr(img_gray: np.ndarray, scale_factor, gaussian_bl
                                    interpolation=cv2.INTER_CUBIC if scale_factor > 1.0 else cv2.INTER_AREA)
     return processed_img
 
+class ImagePyramid:
+    """
+    한 번 디코딩한 흑백 이미지와, 전략들이 공유하는 전처리(배율/블러) 사본들.
+    사본은 처음 요청될 때만 만들어짐
+    """
+    def __init__(self, img_gray: np.ndarray):
+        self.base = img_gray
+        self.levels = {}
+
+    def get(self, scale_factor, gaussian_blur_ksize) -> np.ndarray:
+        key = (scale_factor, gaussian_blur_ksize)
+        if key not in self.levels:
+            self.levels[key] = preprocess_image_for_easyocr(self.base, scale_factor, gaussian_blur_ksize)
+        return self.levels[key]
+
+def new_strategy_stats():
+    return {f"{prep}/{crit}": {"attempts": 0, "hits": 0, "seconds": 0.0}
+            for prep, crit in STRATEGIES_TO_TRY}
+
+def detect_text_easyocr(reader, img_gray, fname="", strategy_stats=None):
+    """
+    STRATEGIES_TO_TRY 순서대로 텍스트를 찾음. 이미지는 한 번만 디코딩된 것을 쓰고,
+    같은 전처리 프로파일의 OCR 결과는 기준만 다른 전략들끼리 재사용함.
+    반환: (텍스트 여부, 감지 내용, 감지한 전략, 마지막 전처리 이미지, 마지막 OCR 결과, 마지막 OCR 기준)
+    """
+    pyramid = ImagePyramid(img_gray)
+    ocr_results_by_profile = {}
+    processed_img, ocr_results, last_ocr_criteria_params = None, None, None
+
+    for prep_profile_name, ocr_criteria_name in STRATEGIES_TO_TRY:
+        prep_params = PREPROCESSING_PROFILES.get(prep_profile_name)
+        ocr_criteria_params = OCR_CRITERIA_EASYOCR.get(ocr_criteria_name)
+        last_ocr_criteria_params = ocr_criteria_params # 현재 사용된 기준 저장
+        if not prep_params or not ocr_criteria_params:
+            print(f"[경고] 프로파일 없음: {prep_profile_name} 또는 {ocr_criteria_name} ({fname})")
+            continue
+
+        strategy_name = f"{prep_profile_name}/{ocr_criteria_name}"
+        started = time.perf_counter()
+        processed_img = pyramid.get(prep_params["scale_factor"], prep_params["gaussian_blur_ksize"])
+        try:
+            if prep_profile_name not in ocr_results_by_profile:
+                ocr_results_by_profile[prep_profile_name] = reader.readtext(processed_img)
+            ocr_results = ocr_results_by_profile[prep_profile_name]
+        except Exception as e:
+            print(f"[오류] EasyOCR ({fname}, 전략: {strategy_name}): {e}")
+            ocr_results = []
+            continue
+        finally:
+            if strategy_stats is not None:
+                stats = strategy_stats.setdefault(strategy_name, {"attempts": 0, "hits": 0, "seconds": 0.0})
+                stats["attempts"] += 1
+                stats["seconds"] += time.perf_counter() - started
+
+        contains_text, snippet = has_text_easyocr(ocr_results, **ocr_criteria_params)
+        if contains_text:
+            if strategy_stats is not None:
+                strategy_stats[strategy_name]["hits"] += 1
+            return True, snippet, strategy_name, processed_img, ocr_results, last_ocr_criteria_params
+
+    return False, "", "N/A", processed_img, ocr_results, last_ocr_criteria_params
+
+def print_strategy_stats(strategy_stats):
+    print("\n전략별 통계 (시도, 감지, 감지율, 총 시간, 시도당 시간):")
+    for strategy_name, stats in strategy_stats.items():
+        attempts = stats["attempts"]
+        hit_rate = stats["hits"] / attempts if attempts else 0.0
+        per_attempt_ms = 1000 * stats["seconds"] / attempts if attempts else 0.0
+        print(f"  {strategy_name}: {attempts}회, {stats['hits']}건, {hit_rate:.1%}, "
+              f"{stats['seconds']:.1f}s, {per_attempt_ms:.0f}ms")
+
+def count_char_like(heights, widths, areas, img_height, thresholds):
+    rel_heights = heights / img_height
+    aspects = widths / np.maximum(heights, 1)
+    fills = areas / np.maximum(widths * heights, 1)
+    (min_h, max_h), (min_a, max_a), (min_f, max_f) = (
+        thresholds["char_height_range"], thresholds["char_aspect_range"], thresholds["char_fill_range"])
+    return int(np.count_nonzero((rel_heights >= min_h) & (rel_heights <= max_h) &
+                                (aspects >= min_a) & (aspects <= max_a) &
+                                (fills >= min_f) & (fills <= max_f)))
+
+def prescreen_text_likelihood(img_gray, thresholds=None, all_features=False):
+    """
+    OCR보다 훨씬 싼 단계적 검사. 앞 단계에서 텍스트가 없다고 확실하면 바로 멈춤.
+    반환: ("no_text" 또는 "ambiguous", 계산된 특징들)
+    all_features가 True면 보정용으로 모든 특징을 계산함
+    """
+    thresholds = thresholds or PRESCREEN_THRESHOLDS
+    h, w = img_gray.shape
+    scale = min(1.0, thresholds["max_side"] / max(h, w))
+    small = cv2.resize(img_gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                       interpolation=cv2.INTER_AREA) if scale < 1.0 else img_gray
+    small_h = small.shape[0]
+    features = {}
+
+    # 1단계: 엣지 밀도. 평평한 이미지는 글자가 있을 수 없음
+    edges = cv2.Canny(small, 100, 200)
+    features["edge_density"] = float(np.count_nonzero(edges)) / edges.size
+    if features["edge_density"] <= thresholds["max_edge_density"] and not all_features:
+        return "no_text", features
+
+    # 2단계: 어두운 획의 연결 요소 중 글자 크기/모양인 것의 수
+    binary = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    stats = stats[1:].astype(np.float64)
+    features["text_components"] = count_char_like(stats[:, cv2.CC_STAT_HEIGHT], stats[:, cv2.CC_STAT_WIDTH],
+                                                  stats[:, cv2.CC_STAT_AREA], small_h, thresholds)
+
+    # 3단계: 글자 크기의 MSER 영역 수
+    if features["text_components"] <= thresholds["max_text_components"] or all_features:
+        mser = cv2.MSER_create()
+        min_char = thresholds["char_height_range"][0] * small_h
+        max_char = thresholds["char_height_range"][1] * small_h
+        mser.setMinArea(max(5, int(min_char * min_char * 0.2)))
+        mser.setMaxArea(max(10, int(max_char * max_char * 2)))
+        _, bboxes = mser.detectRegions(small)
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        rel_heights = bboxes[:, 3] / small_h
+        features["mser_regions"] = int(np.count_nonzero(
+            (rel_heights >= thresholds["char_height_range"][0]) &
+            (rel_heights <= thresholds["char_height_range"][1])))
+
+    if all_features and features["edge_density"] <= thresholds["max_edge_density"]:
+        return "no_text", features
+    if (features["text_components"] <= thresholds["max_text_components"]
+            and features["mser_regions"] <= thresholds["max_mser_regions"]):
+        return "no_text", features
+    return "ambiguous", features
+
+def calibrate_prescreen(reader, src_dir, files, sample_size, seed=0):
+    """
+    표본에 대해 사전 검사와 전체 OCR을 모두 실행해 일치율을 보고함.
+    사전 검사가 텍스트 없음으로 통과시켰는데 OCR이 텍스트를 찾은 경우가 놓친 이미지
+    """
+    rng = np.random.RandomState(seed)
+    sample = [files[i] for i in rng.choice(len(files), min(sample_size, len(files)), replace=False)]
+    counts = {("no_text", False): 0, ("no_text", True): 0, ("ambiguous", False): 0, ("ambiguous", True): 0}
+    features_by_ocr = {False: [], True: []}
+    prescreen_seconds, ocr_seconds = 0.0, 0.0
+
+    for i, fname in enumerate(sample):
+        img_gray = cv2.imread(os.path.join(src_dir, fname), cv2.IMREAD_GRAYSCALE)
+        if img_gray is None:
+            continue
+        started = time.perf_counter()
+        verdict, features = prescreen_text_likelihood(img_gray, all_features=True)
+        prescreen_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        contains_text = detect_text_easyocr(reader, img_gray, fname)[0]
+        ocr_seconds += time.perf_counter() - started
+
+        counts[(verdict, contains_text)] += 1
+        features_by_ocr[contains_text].append(features)
+        print(f"[보정] ({i+1}/{len(sample)}) {fname}: 사전 검사 {verdict}, OCR {'텍스트' if contains_text else '없음'}")
+
+    total = sum(counts.values())
+    if total == 0:
+        print("[보정] 읽을 수 있는 이미지 없음")
+        return counts
+    accepted = counts[("no_text", False)] + counts[("no_text", True)]
+    agreement = (counts[("no_text", False)] + counts[("ambiguous", True)]) / total
+    print(f"\n[보정] 표본 {total}장: 사전 검사 통과 {accepted}장 ({accepted / total:.1%}가 OCR 생략)")
+    print(f"  통과 & OCR 없음: {counts[('no_text', False)]}, 통과 & OCR 텍스트 (놓침): {counts[('no_text', True)]}")
+    print(f"  애매 & OCR 텍스트: {counts[('ambiguous', True)]}, 애매 & OCR 없음: {counts[('ambiguous', False)]}")
+    print(f"  일치율: {agreement:.1%}, 놓친 비율 (통과 중): {counts[('no_text', True)] / max(accepted, 1):.1%}")
+    print(f"  이미지당 사전 검사 {1000 * prescreen_seconds / total:.1f}ms, OCR {1000 * ocr_seconds / total:.0f}ms")
+    for contains_text, label in [(False, "OCR 없음"), (True, "OCR 텍스트")]:
+        if not features_by_ocr[contains_text]:
+            continue
+        summary = ", ".join(
+            f"{name} p50={np.percentile([f[name] for f in features_by_ocr[contains_text]], 50):.3g} "
+            f"p90={np.percentile([f[name] for f in features_by_ocr[contains_text]], 90):.3g}"
+            for name in ["edge_density", "text_components", "mser_regions"])
+        print(f"  {label}: {summary}")
+    return counts
+
 def draw_ocr_easyocr_results(image_path_or_array, ocr_results, save_path, min_confidence_draw=0.1):
     try:
         if isinstance(image_path_or_array, str):
@@ -98,87 +314,350 @@ def draw_ocr_easyocr_results(image_path_or_array, ocr_results, save_path, min_co
     except Exception as e:
         print(f"[오류] 디버그 이미지 ({save_path}): {e}")
 
-def filter_images_by_easyocr(reader):
-    if not os.path.exists(SRC_DIR):
-        print(f"[오류] 원본 폴더 없음: {SRC_DIR}")
+def classify_image(reader, src_path, fname, strategy_stats, prescreen_stats, use_prescreen=True, debug_dir=None):
+    """
+    이미지 하나를 한 번 디코딩해서 사전 검사와 OCR로 판정함.
+    반환: 판정 기록 (fname, verdict "keep"/"skip", strategy, confidence, snippet)
+    """
+    img_gray = cv2.imread(src_path, cv2.IMREAD_GRAYSCALE)
+    verdict = "ambiguous"
+    if img_gray is not None and use_prescreen:
+        started = time.perf_counter()
+        verdict, _ = prescreen_text_likelihood(img_gray)
+        prescreen_stats["seconds"] += time.perf_counter() - started
+        prescreen_stats[verdict] += 1
+
+    if img_gray is not None and verdict == "no_text":
+        # 확실히 텍스트가 없으므로 OCR 생략
+        overall_contains_text, overall_detected_snippet, strategy_that_detected_text = False, "", "prescreen"
+        img_for_ocr_processed, ocr_results_for_debug, last_ocr_criteria_params = img_gray, [], None
+    elif img_gray is not None:
+        (overall_contains_text, overall_detected_snippet, strategy_that_detected_text,
+         img_for_ocr_processed, ocr_results_for_debug,
+         last_ocr_criteria_params) = detect_text_easyocr(reader, img_gray, fname, strategy_stats)
+    else:
+        print(f"[경고] 이미지 로드 실패 (전처리): {fname}")
+        overall_contains_text, overall_detected_snippet, strategy_that_detected_text = False, "", "load_failed"
+        img_for_ocr_processed, ocr_results_for_debug, last_ocr_criteria_params = None, None, None
+
+    if debug_dir:
+        debug_fname_prefix = "TEXT_" if overall_contains_text else "NOTEXT_"
+        detected_by_suffix = f"_by_{strategy_that_detected_text.replace('/','-')}" if overall_contains_text else ""
+        safe_fname_part, original_ext = os.path.splitext(fname)[0].replace(":", "_"), os.path.splitext(fname)[1]
+        debug_save_path = os.path.join(debug_dir, f"{debug_fname_prefix}{safe_fname_part}{detected_by_suffix}{original_ext}")
+
+        min_conf_val = MIN_CONF_DEBUG_DRAW_FOR_TEXT_FOCUS # 기본 디버그 신뢰도
+        if overall_contains_text and last_ocr_criteria_params : # 텍스트 감지 시 해당 전략의 min_confidence 사용
+             min_conf_val = last_ocr_criteria_params.get("min_confidence", MIN_CONF_DEBUG_DRAW_FOR_TEXT_FOCUS)
+
+        if img_for_ocr_processed is not None:
+            draw_ocr_easyocr_results(img_for_ocr_processed, ocr_results_for_debug, debug_save_path, min_confidence_draw=min_conf_val)
+        else: # 전처리가 없었거나 실패한 경우 (거의 발생 안 함)
+             draw_ocr_easyocr_results(src_path, ocr_results_for_debug, debug_save_path, min_confidence_draw=min_conf_val)
+
+    # 마지막 OCR 결과 중 가장 높은 신뢰도, OCR을 하지 않았으면 None
+    confidence = max((float(prob) for (_, _, prob) in ocr_results_for_debug), default=0.0) \
+        if ocr_results_for_debug is not None and strategy_that_detected_text != "prescreen" else None
+    return {
+        "path": fname,
+        "verdict": "skip" if overall_contains_text else "keep",
+        "strategy": strategy_that_detected_text,
+        "confidence": confidence,
+        "snippet": overall_detected_snippet.replace('\n', ' ').strip()[:60],
+    }
+
+def load_decisions(log_dir):
+    """
+    모든 워커의 판정 기록을 읽음. 중단되어 잘린 마지막 줄은 무시
+    반환: 파일 이름 → 판정 기록
+    """
+    decisions = {}
+    for log_path in sorted(glob.glob(os.path.join(log_dir, "decisions-*.jsonl"))):
+        with open(log_path, encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                decisions[record["path"]] = record
+    return decisions
+
+def trim_partial_line(log_path, block_size=4096):
+    """
+    중단되어 잘린 마지막 줄을 마지막 줄바꿈 뒤까지 잘라냄.
+    그대로 두면 이어서 추가한 첫 기록이 잘린 줄에 붙어 둘 다 읽히지 않음
+    """
+    if not os.path.exists(log_path):
         return
-    os.makedirs(DST_DIR, exist_ok=True)
-    if ENABLE_DEBUG: os.makedirs(DEBUG_DIR, exist_ok=True)
-
-    files = sorted([f for f in os.listdir(SRC_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
-    if MAX_FILES_TO_PROCESS > 0: files = files[:MAX_FILES_TO_PROCESS]
-    
-    kept_count, skipped_count = 0, 0
-    for i, fname in enumerate(files):
-        src_path = os.path.join(SRC_DIR, fname)
-        overall_contains_text, overall_detected_snippet, strategy_that_detected_text = False, "", "N/A"
-        img_for_ocr_processed, ocr_results_for_debug = None, None
-        last_ocr_criteria_params = None # 마지막 사용된 OCR 기준 저장용
-
-        for prep_profile_name, ocr_criteria_name in STRATEGIES_TO_TRY:
-            prep_params = PREPROCESSING_PROFILES.get(prep_profile_name)
-            ocr_criteria_params = OCR_CRITERIA_EASYOCR.get(ocr_criteria_name)
-            last_ocr_criteria_params = ocr_criteria_params # 현재 사용된 기준 저장
-            if not prep_params or not ocr_criteria_params:
-                print(f"[경고] 프로파일 없음: {prep_profile_name} 또는 {ocr_criteria_name} ({fname})")
-                continue
-            
-            img_gray = cv2.imread(src_path, cv2.IMREAD_GRAYSCALE)
-            if img_gray is None:
-                print(f"[경고] 이미지 로드 실패 (전처리): {fname}")
-                continue
-            
-            current_processed_img = preprocess_image_for_easyocr(img_gray, prep_params["scale_factor"], prep_params["gaussian_blur_ksize"])
-            img_for_ocr_processed = current_processed_img
-
-            try:
-                result = reader.readtext(img_for_ocr_processed)
-                ocr_results_for_debug = result
-            except Exception as e:
-                print(f"[오류] EasyOCR ({fname}, 전략: {prep_profile_name}/{ocr_criteria_name}): {e}")
-                ocr_results_for_debug = []
-                continue 
-
-            contains_text_this_strategy, snippet_this_strategy = has_text_easyocr(result, **ocr_criteria_params)
-            if contains_text_this_strategy:
-                overall_contains_text, overall_detected_snippet, strategy_that_detected_text = True, snippet_this_strategy, f"{prep_profile_name}/{ocr_criteria_name}"
+    with open(log_path, "rb+") as log_file:
+        end = log_file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            log_file.seek(start)
+            block = log_file.read(position - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
                 break
-        
-        if ENABLE_DEBUG:
-            debug_fname_prefix = "TEXT_" if overall_contains_text else "NOTEXT_"
-            detected_by_suffix = f"_by_{strategy_that_detected_text.replace('/','-')}" if overall_contains_text else ""
-            safe_fname_part, original_ext = os.path.splitext(fname)[0].replace(":", "_"), os.path.splitext(fname)[1]
-            debug_save_path = os.path.join(DEBUG_DIR, f"{debug_fname_prefix}{safe_fname_part}{detected_by_suffix}{original_ext}")
-            
-            min_conf_val = MIN_CONF_DEBUG_DRAW_FOR_TEXT_FOCUS # 기본 디버그 신뢰도
-            if overall_contains_text and last_ocr_criteria_params : # 텍스트 감지 시 해당 전략의 min_confidence 사용
-                 min_conf_val = last_ocr_criteria_params.get("min_confidence", MIN_CONF_DEBUG_DRAW_FOR_TEXT_FOCUS)
-            
-            if img_for_ocr_processed is not None:
-                draw_ocr_easyocr_results(img_for_ocr_processed, ocr_results_for_debug, debug_save_path, min_confidence_draw=min_conf_val)
-            else: # 전처리가 없었거나 실패한 경우 (거의 발생 안 함)
-                 draw_ocr_easyocr_results(src_path, ocr_results_for_debug, debug_save_path, min_confidence_draw=min_conf_val)
-
-        if not overall_contains_text:
-            kept_count += 1
-            dst_fname = f"{kept_count}.{OUTPUT_EXTENSION}" if RENAME_SEQUENTIAL else fname
-            shutil.copy2(src_path, os.path.join(DST_DIR, dst_fname))
-            print(f"[KEEP] ({i+1}/{len(files)}) {fname} → {dst_fname}")
+            position = start
+        if position != end:
+            log_file.truncate(position)
+
+# 워커 프로세스마다 하나씩 만드는 EasyOCR 리더
+_reader = None
+
+def init_filter_worker(languages, gpu, threads):
+    global _reader
+    # 워커들이 코어를 나눠 쓰도록 스레드 수 제한
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _reader = easyocr.Reader(languages, gpu=gpu)
+
+def filter_shard(shard_index, fnames, src_dir, log_dir, use_prescreen=True, debug_dir=None):
+    """
+    워커 하나가 맡은 파일들을 판정하고 자기 판정 기록 파일에 한 줄씩 추가함
+    반환: (판정 수, 전략별 통계, 사전 검사 통계)
+    """
+    strategy_stats = new_strategy_stats()
+    prescreen_stats = {"no_text": 0, "ambiguous": 0, "seconds": 0.0}
+    log_path = os.path.join(log_dir, f"decisions-{shard_index:03d}.jsonl")
+    trim_partial_line(log_path)
+    with open(log_path, "a", encoding="utf-8") as log_file:
+        for i, fname in enumerate(fnames):
+            record = classify_image(_reader, os.path.join(src_dir, fname), fname, strategy_stats,
+                                    prescreen_stats, use_prescreen, debug_dir)
+            log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            log_file.flush()
+            if (i + 1) % 100 == 0:
+                os.fsync(log_file.fileno())
+            tag = "KEEP" if record["verdict"] == "keep" else "SKIP"
+            print(f"[{tag}] [워커 {shard_index}] ({i+1}/{len(fnames)}) {fname} ({record['strategy']})")
+    return len(fnames), strategy_stats, prescreen_stats
+
+def filter_chunk(fnames, src_dir, log_dir, use_prescreen=True, debug_dir=None):
+    """
+    워커가 받은 묶음 하나를 판정함. 판정 기록 파일은 워커 프로세스마다 따로 씀
+    """
+    return filter_shard(os.getpid(), fnames, src_dir, log_dir, use_prescreen, debug_dir)
+
+def make_filter_pool(workers, gpu, threads):
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_filter_worker,
+        initargs=(EASYOCR_LANGUAGES, gpu, threads))
+
+def run_filter_chunks(fnames, src_dir, log_dir, workers, gpu, threads, use_prescreen=True,
+                      debug_dir=None, chunk_size=FILTER_CHUNK_SIZE, max_in_flight=None):
+    """
+    파일을 작은 묶음으로 나눠 일이 끝난 워커에 차례로 보냄. 보내 둔 묶음 수는 max_in_flight로 제한.
+    묶음이 실패하거나 워커가 죽어도 출력만 하고 계속 진행하며, 판정되지 않은 파일은 다시 실행하면 처리됨
+    반환: (전략별 통계, 사전 검사 통계, 실패한 묶음 수)
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    strategy_stats, prescreen_stats = new_strategy_stats(), {}
+    pending = collections.deque(fnames[k:k + chunk_size] for k in range(0, len(fnames), chunk_size))
+    in_flight = {}
+    failed = 0
+    finished_since_break = True
+
+    def collect(future):
+        """묶음의 결과를 합치고 풀이 망가졌는지 반환"""
+        nonlocal failed, finished_since_break
+        chunk = in_flight.pop(future)
+        try:
+            _, chunk_strategy_stats, chunk_prescreen_stats = future.result()
+        except Exception as e:
+            failed += 1
+            print(f"[오류] {chunk[0]} ~ {chunk[-1]} ({len(chunk)}장) 판정 실패: {type(e).__name__}: {e}")
+            return isinstance(e, BrokenProcessPool)
+        finished_since_break = True
+        merge_stats(strategy_stats, chunk_strategy_stats)
+        merge_stats(prescreen_stats, chunk_prescreen_stats)
+        return False
+
+    executor = make_filter_pool(workers, gpu, threads)
+    try:
+        while pending or in_flight:
+            broken = False
+            while pending and len(in_flight) < max_in_flight:
+                try:
+                    future = executor.submit(filter_chunk, pending[0], src_dir, log_dir,
+                                             use_prescreen, debug_dir)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                in_flight[future] = pending.popleft()
+            if in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    broken = collect(future) or broken
+            if broken:
+                # 워커가 죽으면 풀 전체가 망가져 보내 둔 묶음도 모두 실패하므로 새 풀로 계속
+                for future in list(in_flight):
+                    collect(future)
+                executor.shutdown(wait=True)
+                # 새 풀이 묶음 하나 끝내지 못하고 망가지면 워커를 만들 수 없는 것이므로 멈춤
+                if not finished_since_break:
+                    print("[오류] 워커가 연달아 죽어 판정을 멈춤")
+                    failed += len(pending)
+                    break
+                finished_since_break = False
+                executor = make_filter_pool(workers, gpu, threads)
+    finally:
+        executor.shutdown(wait=True)
+    return strategy_stats, prescreen_stats, failed
+
+def get_output_names(decisions, rename_sequential=False):
+    """
+    저장할 파일의 출력 이름. 판정이 같으면 몇 번을 다시 실행해도 같은 이름이 나옴
+    반환: (원래 파일 이름, 출력 파일 이름) 목록
+    """
+    kept = sorted(fname for fname, record in decisions.items() if record["verdict"] == "keep")
+    if rename_sequential:
+        return [(fname, f"{k}.{OUTPUT_EXTENSION}") for k, fname in enumerate(kept, 1)]
+    return [(fname, fname) for fname in kept]
+
+def holds_source(src_path, dst_path):
+    """
+    dst_path가 src_path를 저장한 파일인지 확인. 링크면 같은 파일이고,
+    복사본이면 copy2가 수정 시각까지 옮기므로 크기와 수정 시각이 같음
+    """
+    try:
+        if os.path.samefile(src_path, dst_path):
+            return True
+        src_stat, dst_stat = os.stat(src_path), os.stat(dst_path)
+    except OSError:
+        return False
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+def write_filtered_images(decisions, src_dir, dst_dir, rename_sequential=False, mode="copy"):
+    """
+    저장할 이미지를 mode에 따라 복사하거나 링크함. 링크할 수 없으면 (다른 파일 시스템 등) 복사
+    반환: (새로 만든 파일 수, 링크 대신 복사한 파일 수, 다른 원본을 담고 있어 바꾼 파일 수)
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    written, copied_instead, replaced = 0, 0, 0
+    for fname, dst_fname in get_output_names(decisions, rename_sequential):
+        src_path, dst_path = os.path.join(src_dir, fname), os.path.join(dst_dir, dst_fname)
+        if os.path.lexists(dst_path):
+            # 이미 저장된 파일은 건너뛰어 이어서 실행 가능.
+            # 번호로 저장할 때 원본이 추가되면 번호가 밀리므로 다른 원본을 담은 파일은 바꿈
+            if holds_source(src_path, dst_path):
+                continue
+            os.remove(dst_path)
+            replaced += 1
+        try:
+            if mode == "hardlink":
+                os.link(src_path, dst_path)
+            elif mode == "symlink":
+                os.symlink(os.path.abspath(src_path), dst_path)
+            else:
+                shutil.copy2(src_path, dst_path)
+        except OSError:
+            if mode == "copy":
+                raise
+            shutil.copy2(src_path, dst_path)
+            copied_instead += 1
+        written += 1
+    return written, copied_instead, replaced
+
+def merge_stats(total, stats):
+    for name, values in stats.items():
+        if isinstance(values, dict):
+            merged = total.setdefault(name, {key: 0 for key in values})
+            for key, value in values.items():
+                merged[key] += value
         else:
-            skipped_count += 1
-            # 오류 수정: replace('\n', ' ') 호출 후 strip() 적용
-            snippet_to_print = overall_detected_snippet.replace('\n', ' ').strip()[:60]
-            print(f"[SKIP] ({i+1}/{len(files)}) {fname} (감지: {strategy_that_detected_text}, 내용: {snippet_to_print}...)")
+            total[name] = total.get(name, 0) + values
+
+def filter_images(args):
+    if not os.path.exists(args.src):
+        print(f"[오류] 원본 폴더 없음: {args.src}")
+        return
+    os.makedirs(args.decision_log_dir, exist_ok=True)
+    debug_dir = args.debug_dir if args.debug else None
+    if debug_dir: os.makedirs(debug_dir, exist_ok=True)
 
+    files = sorted(entry.name for entry in os.scandir(args.src)
+                   if entry.name.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if args.max_files > 0: files = files[:args.max_files]
 
-    print(f"\n완료: 총 {len(files)} 중 {kept_count} 저장 → {DST_DIR}, 스킵: {skipped_count}")
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    if args.calibrate > 0:
+        init_filter_worker(EASYOCR_LANGUAGES, args.gpu, threads)
+        calibrate_prescreen(_reader, args.src, files, args.calibrate)
+        return
+
+    # 이전 실행에서 판정한 파일은 건너뜀
+    decisions = load_decisions(args.decision_log_dir)
+    remaining = [fname for fname in files if fname not in decisions]
+    print(f"총 {len(files)}장 중 {len(files) - len(remaining)}장은 이미 판정됨, {len(remaining)}장을 워커 {args.workers}개로 처리")
+
+    strategy_stats, prescreen_stats = new_strategy_stats(), {}
+    if remaining:
+        strategy_stats, prescreen_stats, failed = run_filter_chunks(
+            remaining, args.src, args.decision_log_dir, min(args.workers, len(remaining)),
+            args.gpu, threads, args.prescreen, debug_dir, args.chunk_size)
+        if failed:
+            print(f"[경고] {failed}개 묶음을 판정하지 못함. 다시 실행하면 판정되지 않은 파일만 처리")
+        decisions = load_decisions(args.decision_log_dir)
+
+    decisions = {fname: decisions[fname] for fname in files if fname in decisions}
+    kept_count = sum(1 for record in decisions.values() if record["verdict"] == "keep")
+    if args.output_mode == "manifest":
+        if args.rename_sequential:
+            print("[경고] manifest 모드에서는 원래 파일 이름을 그대로 씀")
+        write_filtered_manifest(args.src, [fname for fname, _ in get_output_names(decisions)], args.manifest_path)
+        print(f"\n완료: 총 {len(files)} 중 {kept_count} 목록에 기록 → {args.manifest_path}, 스킵: {len(decisions) - kept_count}")
+    else:
+        written, copied_instead, replaced = write_filtered_images(decisions, args.src, args.dst,
+                                                                  args.rename_sequential, args.output_mode)
+        print(f"\n완료: 총 {len(files)} 중 {kept_count} 저장 ({written}장 새로 저장) → {args.dst}, 스킵: {len(decisions) - kept_count}")
+        if replaced:
+            print(f"[경고] 다른 원본을 담고 있던 {replaced}장을 바꿈 (원본이 추가되어 번호가 밀렸을 수 있음)")
+        if copied_instead:
+            print(f"[경고] 링크할 수 없어 {copied_instead}장은 복사함 (다른 파일 시스템?)")
+    if prescreen_stats:
+        checked = prescreen_stats["no_text"] + prescreen_stats["ambiguous"]
+        print(f"\n사전 검사: {prescreen_stats['no_text']}장 OCR 생략, {prescreen_stats['ambiguous']}장 OCR로 보냄 "
+              f"(이미지당 {1000 * prescreen_stats['seconds'] / max(checked, 1):.1f}ms)")
+    print_strategy_stats(strategy_stats)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="텍스트가 있는 일러스트를 걸러내고 나머지를 저장")
+    parser.add_argument("--src", default=SRC_DIR, help="흑백 일러스트 폴더")
+    parser.add_argument("--dst", default=DST_DIR, help="텍스트 없는 일러스트를 저장할 폴더")
+    parser.add_argument("--decision_log_dir", default=DECISION_LOG_DIR,
+                        help="판정 기록 폴더. 다시 실행하면 기록된 파일은 건너뜀")
+    parser.add_argument("--workers", type=int, default=1, help="워커 프로세스 수 (각자 EasyOCR 리더를 가짐)")
+    parser.add_argument("--chunk_size", type=int, default=FILTER_CHUNK_SIZE,
+                        help="워커에 한 번에 보내는 파일 수")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="워커당 스레드 수 (기본: CPU 수 / 워커 수)")
+    parser.add_argument("--gpu", dest="gpu", action="store_true", default=EASYOCR_GPU)
+    parser.add_argument("--no_gpu", dest="gpu", action="store_false")
+    parser.add_argument("--prescreen", dest="prescreen", action="store_true", default=PRESCREEN_ENABLED,
+                        help="확실히 텍스트가 없는 이미지는 OCR 생략 (먼저 --calibrate 로 기준값 확인)")
+    parser.add_argument("--no_prescreen", dest="prescreen", action="store_false",
+                        help="사전 검사 없이 모든 이미지를 OCR")
+    parser.add_argument("--calibrate", type=int, default=CALIBRATE_PRESCREEN_SAMPLE, metavar="N",
+                        help="필터링 대신 N장 표본으로 사전 검사와 OCR 일치율 보고")
+    parser.add_argument("--rename_sequential", action="store_true", default=RENAME_SEQUENTIAL,
+                        help="저장할 파일을 이름순으로 1, 2, ... 으로 저장")
+    parser.add_argument("--output_mode", choices=OUTPUT_MODES, default=OUTPUT_MODE,
+                        help="저장할 이미지를 복사, 하드 링크, 심볼릭 링크하거나 목록 파일만 씀")
+    parser.add_argument("--manifest_path", default=cfg.filtered_manifest_path,
+                        help="manifest 모드에서 쓸 목록 파일")
+    parser.add_argument("--max_files", type=int, default=MAX_FILES_TO_PROCESS)
+    parser.add_argument("--debug", action="store_true", default=ENABLE_DEBUG,
+                        help="OCR 결과를 그린 디버그 이미지 저장")
+    parser.add_argument("--debug_dir", default=DEBUG_DIR)
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    print("EasyOCR Reader 초기화 중...")
-    try:
-        reader = easyocr.Reader(EASYOCR_LANGUAGES, gpu=EASYOCR_GPU)
-    except Exception as e:
-        print(f"[오류] EasyOCR 초기화 실패: {e}")
-        sys.exit(1)
-    print("EasyOCR Reader 초기화 완료.")
-    filter_images_by_easyocr(reader)
\ No newline at end of file
+    filter_images(parse_args())
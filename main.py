@@ -3,15 +3,29 @@
 
 from scraping.download_images import download_db_illustrations
 from preprocesing.convert_images import convert_images_to_bw
-from preprocesing.layout_engine.page_creator import render_pages
-from preprocesing.layout_engine.page_dataset_creator import create_page_metadata
+from preprocesing.crop_box_index import build_crop_box_index
+from preprocesing.packed_store import build_packed_store
+from preprocesing.illustration_catalog import (
+    build_illustration_catalog, load_illustration_catalog,
+    load_filtered_manifest
+)
+from preprocesing.bubble_manifest import (
+    update_bubble_manifest, load_bubble_manifest
+)
+from preprocesing.layout_engine.page_creator import (
+    render_pages, stream_render_pages
+)
+from preprocesing.layout_engine.metadata_store import MetadataStore
+from preprocesing.layout_engine.page_dataset_creator import (
+    create_page_metadata, create_seeded_page_metadata,
+    create_page_metadata_parallel, build_speech_bubble_catalog
+)
 from tqdm import tqdm
 import os
 import pandas as pd
 from argparse import ArgumentParser
 import pytest
 import json
-from PIL import Image
 
 import preprocesing.config_file as cfg
 
@@ -30,14 +44,22 @@ cfg.SPEECH_BUBBLE_SETTINGS["enabled"] = True
 def find_image_dir():
     """
     Identify the correct BW image directory among possible candidates.
+    A manifest of filtered images points at the directory they are in.
     Raises RuntimeError if none found or all are empty.
     """
+    manifest = load_filtered_manifest()
+    if manifest is not None:
+        return os.path.join(manifest[0], "")
+
     candidates = [
         "datasets/image_dataset/filtered_illustrations_bw",
     ]
     for d in candidates:
-        if os.path.isdir(d) and os.listdir(d):
-            return d + os.sep
+        # Only look for a first entry instead of listing them all
+        if os.path.isdir(d):
+            with os.scandir(d) as entries:
+                if next(entries, None) is not None:
+                    return d + os.sep
     raise RuntimeError(
         "No BW image folder found. Please ensure images are downloaded and converted.\n"
         "Expected one of:\n  " + "\n  ".join(candidates)
@@ -91,43 +113,24 @@ def create_default_tags(speech_bubble_files):
     """
     말풍선 파일들에 대한 기본 태그를 생성합니다.
     각 말풍선 이미지 중앙에 텍스트 영역을 배치합니다.
+    크기와 기본 영역은 말풍선 매니페스트에서 가져오므로
+    새로 추가되거나 수정된 파일만 엽니다.
     
     :param speech_bubble_files: 말풍선 이미지 파일 경로 목록
     :return: 말풍선 태그 정보가 있는 데이터프레임
     """
     print("기본 말풍선 태그 생성 중...")
-    
+
+    manifest = update_bubble_manifest(speech_bubble_files)
+
     # 파일별 기본 쓰기 영역 생성
     labels = []
     for file_path in speech_bubble_files:
-        try:
-            # 이미지 크기 확인
-            with Image.open(file_path) as img:
-                width, height = img.size
-            
+        if file_path in manifest:
             # 이미지 중앙 60% 영역을 텍스트 영역으로 설정
-            x_margin = width * 0.2
-            y_margin = height * 0.2
-            
-            # 말풍선 중앙에 사각형 영역 생성
-            points = [
-                [x_margin, y_margin],  # 좌상단
-                [width - x_margin, y_margin],  # 우상단
-                [width - x_margin, height - y_margin],  # 우하단
-                [x_margin, height - y_margin]  # 좌하단
-            ]
-            
-            # JSON 형식의 레이블 생성
-            label_json = json.dumps([{
-                "points": points,
-                "shape_type": "polygon"
-            }])
-            
-            labels.append(label_json)
-            
-        except Exception as e:
-            print(f"파일 {file_path} 처리 중 오류: {e}")
-            # 기본값 사용
+            labels.append(json.dumps(manifest[file_path]['default_area']))
+        else:
+            # 읽을 수 없는 파일은 기본값 사용
             labels.append('[{"points": [[10, 10], [90, 10], [90, 90], [10, 90]], "shape_type": "polygon"}]')
     
     # 데이터프레임 생성
@@ -168,12 +171,65 @@ if __name__ == '__main__':
                         action="store_true",
                         help="Convert existing images to black and white")
 
+    parser.add_argument("--cap_bw_resolution", action="store_true",
+                        help="Scale BW images down while converting them "
+                        "to just cover the page size")
+
+    parser.add_argument("--draft_decode", action="store_true",
+                        help="Decode JPEG images straight to grayscale at "
+                        "the smallest scale that covers the page")
+
+    parser.add_argument("--index_crop_boxes", "-ic",
+                        action="store_true",
+                        help="Record the crop box of every BW image "
+                        "so rendering doesn't recompute it")
+
+    parser.add_argument("--catalog_images", "-cat",
+                        action="store_true",
+                        help="Create or update the catalog of BW images "
+                        "that page metadata is sampled from")
+
+    parser.add_argument("--pack_images", action="store_true",
+                        help="Pack cropped BW images into memory mapped "
+                        "blobs that rendering can read without decoding")
+
+    parser.add_argument("--packed_rendering", action="store_true",
+                        help="Render illustrations from the packed images "
+                        "instead of decoding the JPEG files")
+
     parser.add_argument("--create_page_metadata", "-pm", nargs=1, type=int,
                         help="Generate metadata for N pages (image-only mode)")
     parser.add_argument("--render_pages", "-rp", action="store_true",
                         help="Render pages from existing metadata")
     parser.add_argument("--generate_pages", "-gp", nargs=1, type=int,
                         help="One-shot: create metadata and render N pages")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Create page metadata reproducibly from this "
+                        "master seed, in parallel unless streaming")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of processes used to create seeded "
+                        "page metadata (default: number of CPUs)")
+    parser.add_argument("--metadata_format",
+                        choices=["json", "jsonl", "jsonl.gz"],
+                        default=cfg.metadata_format,
+                        help="Write a JSON file per page or append pages "
+                        "to sharded (gzipped) JSON lines files")
+    parser.add_argument("--tar_shards", action="store_true",
+                        help="Write rendered pages and their metadata into "
+                        "tar shards instead of an image file per page")
+    parser.add_argument("--render_timing", nargs="?", const="",
+                        default=None, metavar="REPORT_JSON",
+                        help="Time each stage of rendering and print a "
+                        "summary, optionally also writing it to a JSON file")
+    parser.add_argument("--cost_scheduling", action="store_true",
+                        help="Render the pages expected to take longest "
+                        "first so the workers finish together")
+    parser.add_argument("--shared_cache_mb", type=int, default=None,
+                        help="Share a cache of decoded illustrations of "
+                        "this many MB between all the render workers")
+    parser.add_argument("--stream", action="store_true",
+                        help="With --generate_pages render pages while "
+                        "their metadata is created instead of after")
     parser.add_argument("--images_only", action="store_true",
                         help="Strip out all text and speech bubbles; only frames and images")
     parser.add_argument("--speech_bubbles", action="store_true", default=True,
@@ -204,6 +260,12 @@ if __name__ == '__main__':
         cfg.TEXT_SETTINGS["enabled"] = False
         cfg.SPEECH_BUBBLE_SETTINGS["enabled"] = True
 
+    if args.cap_bw_resolution:
+        cfg.bw_max_size = cfg.page_size
+
+    if args.draft_decode:
+        cfg.draft_decode = True
+
     if args.download_images:
         download_db_illustrations()
         convert_images_to_bw()
@@ -211,22 +273,80 @@ if __name__ == '__main__':
     if args.convert_images:
         convert_images_to_bw()
 
+    if args.index_crop_boxes:
+        build_crop_box_index(find_image_dir())
+
+    if args.catalog_images:
+        # Only the filtered images if there is a manifest of them
+        manifest = load_filtered_manifest()
+        names = manifest[1] if manifest is not None else None
+        build_illustration_catalog(find_image_dir(), names=names)
+
+    if args.pack_images:
+        build_packed_store(find_image_dir())
+
+    if args.packed_rendering:
+        cfg.packed_rendering = True
+
+    def get_image_list(image_dir_path):
+        """Sample from the image catalog, the filtered manifest, or list the directory."""
+        manifest = load_filtered_manifest()
+        names = manifest[1] if manifest is not None else None
+        # Only a catalog of the same directory and filtered images
+        catalog = load_illustration_catalog(image_dir=image_dir_path,
+                                            names=names)
+        if catalog is not None:
+            return catalog
+        if names is not None:
+            return names
+        print("No image catalog found, listing the image directory. "
+              "Run --catalog_images to skip this and unreadable images.")
+        return sorted(os.listdir(image_dir_path))
+
     def prepare_image_only_inputs():
         """Return empty placeholders for text/bubbles when images_only."""
         if args.images_only:
-            return pd.DataFrame(), [], pd.DataFrame(), []
+            return pd.DataFrame(), [], {}, []
         else:
             # 말풍선 데이터 로드 (텍스트 없이)
             text_dataset = pd.DataFrame()  # 빈 텍스트 데이터셋
             
             # 말풍선 파일 및 태그 로드
             speech_bubble_files, speech_bubble_tags = find_speech_bubbles()
+
+            # 말풍선별 쓰기 영역과 크기를 한 번만 읽어둠
+            speech_bubble_tags = build_speech_bubble_catalog(
+                speech_bubble_files, speech_bubble_tags,
+                bubble_manifest=load_bubble_manifest())
+            # 읽을 수 없어 빠진 말풍선은 고르지 않음
+            speech_bubble_files = [speech_bubble_file
+                                   for speech_bubble_file in speech_bubble_files
+                                   if speech_bubble_file in speech_bubble_tags]
             
             # 폰트 파일은 빈 리스트로 설정 (텍스트 없음)
             viable_font_files = []
             
             return text_dataset, speech_bubble_files, speech_bubble_tags, viable_font_files
 
+    def get_metadata_store(metadata_folder):
+        """Return a sharded metadata store unless writing JSON files."""
+        if args.metadata_format == "json":
+            return None
+        return MetadataStore(metadata_folder,
+                             compress=args.metadata_format == "jsonl.gz")
+
+    page_output = "tar" if args.tar_shards else "files"
+
+    if args.cost_scheduling:
+        cfg.render_cost_scheduling = True
+
+    if args.shared_cache_mb is not None:
+        cfg.shared_illustration_cache_bytes = args.shared_cache_mb*1024*1024
+
+    if args.render_timing is not None:
+        cfg.render_timing = True
+        cfg.render_timing_path = args.render_timing or None
+
     # 3) Metadata generation (image-only)
     if args.create_page_metadata:
         n = args.create_page_metadata[0]
@@ -234,21 +354,40 @@ if __name__ == '__main__':
         os.makedirs(metadata_folder, exist_ok=True)
 
         image_dir_path = find_image_dir()
-        image_list = sorted(os.listdir(image_dir_path))
+        image_list = get_image_list(image_dir_path)
 
         text_dataset, speech_bubble_files, speech_bubble_tags, viable_font_files = prepare_image_only_inputs()
 
         print(f"Creating metadata for {n} image-only pages...")
-        for _ in tqdm(range(n)):
-            page = create_page_metadata(
+        store = get_metadata_store(metadata_folder)
+        if args.seed is not None:
+            create_page_metadata_parallel(
+                n,
+                args.seed,
                 image_list,
                 image_dir_path,
                 viable_font_files,
                 text_dataset,
                 speech_bubble_files,
-                speech_bubble_tags
+                speech_bubble_tags,
+                metadata_folder,
+                dry=args.dry,
+                workers=args.workers,
+                store=store
             )
-            page.dump_data(metadata_folder, dry=args.dry)
+        else:
+            for _ in tqdm(range(n)):
+                page = create_page_metadata(
+                    image_list,
+                    image_dir_path,
+                    viable_font_files,
+                    text_dataset,
+                    speech_bubble_files,
+                    speech_bubble_tags
+                )
+                page.dump_data(metadata_folder, dry=args.dry, store=store)
+        if store is not None:
+            store.close()
 
     # 4) Render existing metadata to images
     if args.render_pages:
@@ -257,7 +396,8 @@ if __name__ == '__main__':
         os.makedirs(images_folder, exist_ok=True)
 
         print("Rendering pages from metadata...")
-        render_pages(metadata_folder, images_folder, dry=args.dry)
+        render_pages(metadata_folder, images_folder, dry=args.dry,
+                     output=page_output)
 
     # 5) One-shot: create metadata + render
     if args.generate_pages:
@@ -266,22 +406,55 @@ if __name__ == '__main__':
         os.makedirs(metadata_folder, exist_ok=True)
 
         image_dir_path = find_image_dir()
-        image_list = sorted(os.listdir(image_dir_path))
+        image_list = get_image_list(image_dir_path)
 
         text_dataset, speech_bubble_files, speech_bubble_tags, viable_font_files = prepare_image_only_inputs()
 
-        print(f"Generating and rendering {n} image-only pages...")
-        for _ in tqdm(range(n)):
-            page = create_page_metadata(
-                image_list,
-                image_dir_path,
-                viable_font_files,
-                text_dataset,
-                speech_bubble_files,
-                speech_bubble_tags
-            )
-            page.dump_data(metadata_folder, dry=args.dry)
-
         images_folder = "datasets/page_images/"
         os.makedirs(images_folder, exist_ok=True)
-        render_pages(metadata_folder, images_folder, dry=args.dry)
+
+        print(f"Generating and rendering {n} image-only pages...")
+        page_inputs = (
+            image_list,
+            image_dir_path,
+            viable_font_files,
+            text_dataset,
+            speech_bubble_files,
+            speech_bubble_tags
+        )
+        if args.seed is not None:
+            pages = (create_seeded_page_metadata(args.seed, i, *page_inputs)
+                     for i in range(n))
+        else:
+            pages = (create_page_metadata(*page_inputs) for _ in range(n))
+
+        store = get_metadata_store(metadata_folder)
+        if args.stream:
+            # Metadata goes straight to the renderers and is
+            # written to disk in the background
+            stream_render_pages(tqdm(pages, total=n),
+                                metadata_folder,
+                                images_folder,
+                                dry=args.dry,
+                                store=store,
+                                output=page_output)
+            if store is not None:
+                store.close()
+        else:
+            if args.seed is not None:
+                create_page_metadata_parallel(n,
+                                              args.seed,
+                                              *page_inputs,
+                                              metadata_folder,
+                                              dry=args.dry,
+                                              workers=args.workers,
+                                              store=store)
+            else:
+                for page in tqdm(pages, total=n):
+                    page.dump_data(metadata_folder, dry=args.dry,
+                                   store=store)
+            if store is not None:
+                store.close()
+
+            render_pages(metadata_folder, images_folder, dry=args.dry,
+                         output=page_output)
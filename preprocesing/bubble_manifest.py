@@ -0,0 +1,133 @@
+import os
+import json
+from PIL import Image
+
+from . import config_file as cfg
+
+
+def get_default_writing_area(width, height):
+    """
+    Make a writing area covering the middle 60% of a speech bubble
+
+    :param width: Width of the speech bubble image
+
+    :type width: int
+
+    :param height: Height of the speech bubble image
+
+    :type height: int
+
+    :return: A list with one polygon writing area
+
+    :rtype: list
+    """
+    x_margin = width * 0.2
+    y_margin = height * 0.2
+
+    points = [
+        [x_margin, y_margin],
+        [width - x_margin, y_margin],
+        [width - x_margin, height - y_margin],
+        [x_margin, height - y_margin]
+    ]
+
+    return [{"points": points, "shape_type": "polygon"}]
+
+
+def load_bubble_manifest(manifest_path=None):
+    """
+    Load the speech bubble manifest
+
+    :param manifest_path: Path of the manifest, defaults to
+    the path in the config
+
+    :type manifest_path: str, optional
+
+    :return: A dictionary of speech bubble file to its size,
+    modification time and default writing area, empty if there
+    is no readable manifest
+
+    :rtype: dict
+    """
+    if manifest_path is None:
+        manifest_path = cfg.bubble_manifest_path
+
+    try:
+        with open(manifest_path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_bubble_manifest(speech_bubble_files, manifest_path=None):
+    """
+    Bring the speech bubble manifest up to date with a list of
+    bubble files. Only files which are new or whose modification
+    time changed are opened, entries of files that are no longer
+    listed are dropped and the manifest is only rewritten if
+    anything changed
+
+    :param speech_bubble_files: list of base speech bubble
+    template files
+
+    :type speech_bubble_files: list
+
+    :param manifest_path: Path of the manifest, defaults to
+    the path in the config
+
+    :type manifest_path: str, optional
+
+    :return: A dictionary of speech bubble file to its size,
+    modification time and default writing area. Files that
+    can't be read are left out
+
+    :rtype: dict
+    """
+    if manifest_path is None:
+        manifest_path = cfg.bubble_manifest_path
+
+    old_manifest = load_bubble_manifest(manifest_path)
+    manifest = {}
+    changed = len(old_manifest) != len(speech_bubble_files)
+
+    for speech_bubble_file in speech_bubble_files:
+        try:
+            mtime = os.stat(speech_bubble_file).st_mtime_ns
+        except OSError as e:
+            print("Skipping speech bubble", speech_bubble_file, e)
+            changed = True
+            continue
+
+        entry = old_manifest.get(speech_bubble_file)
+        if entry is not None and entry['mtime'] == mtime:
+            manifest[speech_bubble_file] = entry
+            continue
+
+        try:
+            with Image.open(speech_bubble_file) as img:
+                width, height = img.size
+        except OSError as e:
+            print("Skipping speech bubble", speech_bubble_file, e)
+            changed = True
+            continue
+
+        manifest[speech_bubble_file] = {
+            "size": [width, height],
+            "mtime": mtime,
+            "default_area": get_default_writing_area(width, height)
+        }
+        changed = True
+
+    if changed:
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+
+        # Write and swap so an interrupted run can't leave
+        # half a manifest behind
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w+") as json_file:
+            json.dump(manifest, json_file, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    return manifest
@@ -8,10 +8,97 @@ output_format = ".png"
 
 boundary_width = 10
 
+# Bytes of decoded, cropped and page resized illustrations
+# each render worker keeps in memory. 0 disables the cache
+illustration_cache_max_bytes = 256 * 1024 * 1024
+
+# Bytes of page resized illustrations in shared memory that every
+# render worker can read, bounding the memory of all the workers
+# together. 0 leaves each worker with only its own cache
+shared_illustration_cache_bytes = 0
+shared_illustration_cache_slots = 1 << 16
+
+# Crop boxes of the BW illustrations recorded once so that
+# rendering doesn't scan every image for its black borders
+crop_box_index_path = "datasets/image_dataset/crop_box_index.npz"
+
+# Decode JPEG illustrations straight to grayscale at the smallest
+# DCT scale that still covers the page rather than at full
+# resolution. Faster, but pixels differ slightly from a full decode
+draft_decode = False
+
+# Scale BW illustrations down when converting them so they are
+# no larger than needed to cover this size, None keeps them at
+# full resolution
+bw_max_size = None
+
+# Name, size, cropped aspect ratio, crop box, mean intensity and validity
+# of every BW illustration that pages are created from
+illustration_catalog_path = "datasets/image_dataset/illustration_catalog.npy"
+
+# Pick each panel's illustration out of the cataloged ones with an
+# aspect ratio within the tolerance of the panel's, or the closest
+# ones if fewer than the minimum are, instead of any at random
+illustration_aspect_matching = False
+illustration_aspect_tolerance = 0.1
+illustration_aspect_min_candidates = 32
+
+# Names of the illustrations in the BW image directory that passed
+# filtering, written by filter_images.py --output_mode manifest
+# instead of copying them. Used in place of the filtered directory
+filtered_manifest_path = "datasets/image_dataset/filtered_illustrations_bw.json"
+
+# Cropped grayscale illustrations packed back to back into large
+# blobs with an index so rendering maps them instead of opening and
+# decoding JPEGs. They are scaled down to just cover the max size,
+# None keeps them at full resolution
+packed_store_dir = "datasets/image_dataset/packed_illustrations/"
+packed_rendering = False
+packed_max_size = page_size
+packed_blob_max_bytes = 1024 * 1024 * 1024
+
+# **Page metadata**
+# "json" writes a file per page, "jsonl" and "jsonl.gz" append
+# pages to sharded JSON lines files with an offset index
+metadata_format = "json"
+metadata_shard_size = 10000
+
+# Pages per tar shard when rendering pages into tar shards
+tar_shard_size = 1000
+
+# Time the stages of rendering every page and report them after
+# rendering. The report is also written to the JSON file if set
+render_timing = False
+render_timing_path = None
+
+# Render the pages expected to take longest first, in chunks that
+# shrink towards the end of the run, so workers finish together.
+# A page's expected cost is a weighted sum of its panels, speech
+# bubbles and background. Pages are planned this many at a time
+# as they are read so rendering starts straight away. Off until the
+# weights are calibrated against measured render times since planning
+# parses every page's metadata an extra time
+render_cost_scheduling = False
+render_cost_weights = dict(page=1.0, panel=1.0, bubble=0.5, background=1.0)
+render_schedule_window = 4096
+
+# Pages that fail to render twice are listed with their errors in
+# this file in the output directory instead of stopping the run
+render_quarantine_file = "render_quarantine.jsonl"
+
+# Replace each render worker after it has rendered this many chunks
+# of pages so memory doesn't creep up over long runs, None never
+# replaces them. Needs Python 3.11 or newer
+render_max_tasks_per_child = None
+
 # **Font coverage**
 # How many characters of the dataset should the font files support
 font_character_coverage = 0.80
 
+# Which of the dataset's characters each font has glyphs for, saved
+# as a bit matrix next to viable_fonts.csv when verifying the fonts
+font_coverage_file = "font_coverage.npz"
+
 
 # **Panel Drawing**
 # *Panel ratios*
@@ -56,6 +143,10 @@ bubble_mask_y_increase = 15
 min_font_size = 54
 max_font_size = 72
 
+# Size, modification time and default writing area of every
+# bubble template so creating metadata doesn't open the images
+bubble_manifest_path = "datasets/speech_bubbles/bubble_manifest.json"
+
 TEXT_SETTINGS = {
     "enabled": False,
     # or text probability = 0
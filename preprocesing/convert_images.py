@@ -1,42 +1,279 @@
 import os
+import csv
 from tqdm import tqdm
 from PIL import Image
 import concurrent.futures
+import itertools
 import time
 
+from .layout_engine.helpers import get_draft_size
+from . import config_file as cfg
+
 image_dataset_dir = "datasets/image_dataset/tagged-anime-illustrations/"\
                     "danbooru-images/danbooru-images/"
 
 processed_image_dir = "datasets/image_dataset/db_illustrations_bw/"
 
+conversion_errors_file = "datasets/image_dataset/conversion_errors.csv"
+
+
+def iter_image_paths(image_dir):
+    """
+    Lazily walk the image folders of the dataset and
+    find the images in them
+
+    :param image_dir: Directory of the image folders
+
+    :type image_dir: str
+
+    :return: A generator of image paths
+
+    :rtype: generator
+    """
+    with os.scandir(image_dir) as folders:
+        for folder in folders:
+            if not folder.is_dir():
+                continue
+            with os.scandir(folder.path) as images:
+                for image in images:
+                    if image.name.endswith(".jpg"):
+                        yield image.path
+
 
-def convert_single_image(image_path):
+def get_converted_size(size, max_size):
+    """
+    Get the size an image is converted to
+
+    :param size: Width and height of the image
+
+    :type size: tuple
+
+    :param max_size: Size the image is scaled down to cover
+    or None to keep its resolution
+
+    :type max_size: tuple
+
+    :return: Width and height of the converted image
+
+    :rtype: tuple
+    """
+    if max_size is None:
+        return size
+    return get_draft_size(size, (0, 0) + size, max_size)
+
+
+def is_converted(image_path, output_path, max_size):
+    """
+    Check whether an image was already converted since it last
+    changed and at the size the current setting gives, reading
+    only the headers of the two images
+
+    :param image_path: Path of the image
+
+    :type image_path: str
+
+    :param output_path: Path of the converted image
+
+    :type output_path: str
+
+    :param max_size: Size the image is scaled down to cover
+    or None to keep its resolution
+
+    :type max_size: tuple
+
+    :return: Whether the converted image is up to date
+
+    :rtype: bool
+    """
+    try:
+        if os.stat(output_path).st_mtime_ns < os.stat(image_path).st_mtime_ns:
+            return False
+        with Image.open(image_path) as img:
+            size = get_converted_size(img.size, max_size)
+        with Image.open(output_path) as bw_img:
+            return bw_img.size == size
+    except OSError:
+        return False
+
+
+def convert_single_image(task):
     """
     Opens a anime illustration image and turns it black and white
+    unless it has already been converted since it last changed
+    at the size the current setting gives. The converted image is written under a temporary name first
+    so an interrupted run never leaves a partial image behind
+
+    :param task: A tuple of the image's path, the directory to
+    save the converted image to, the size the image is scaled down
+    to cover or None to keep its resolution and whether JPEGs are
+    decoded straight to grayscale
+
+    :type task: tuple
+
+    :return: The image's path, whether it was converted, skipped
+    or failed and the error if it failed
+
+    :rtype: tuple
     """
-    img = Image.open(image_path)
-    bw_img = img.convert("L")
-    filename = image_path.split("/")[-1]
-    bw_img.save(processed_image_dir+filename, "JPEG")
+    image_path, output_dir, max_size, draft = task
+    output_path = os.path.join(output_dir, os.path.basename(image_path))
+    if is_converted(image_path, output_path, max_size):
+        return image_path, "skipped", None
+
+    try:
+        with Image.open(image_path) as img:
+            size = get_converted_size(img.size, max_size)
+            # Have the JPEG decoder skip the colour and, when scaling
+            # down, as much of the detail as possible
+            if (draft or size != img.size) and img.format == "JPEG":
+                img.draft("L", size)
+            bw_img = img.convert("L")
+        if bw_img.size != size:
+            bw_img = bw_img.resize(size, Image.LANCZOS)
+        bw_img.save(output_path+".tmp", "JPEG")
+        os.replace(output_path+".tmp", output_path)
+    except Exception as e:
+        return image_path, "failed", "{}: {}".format(type(e).__name__, e)
 
+    return image_path, "converted", None
 
-def convert_images_to_bw():
+
+def convert_image_chunk(tasks):
+    """
+    Convert a chunk of images one after the other in a worker
+
+    :param tasks: A list of convert_single_image arguments
+
+    :type tasks: list
+
+    :return: The results of convert_single_image for each image
+
+    :rtype: list
+    """
+    return [convert_single_image(task) for task in tasks]
+
+
+def convert_images_to_bw(image_dir=image_dataset_dir,
+                         output_dir=processed_image_dir,
+                         errors_file=conversion_errors_file,
+                         chunksize=64,
+                         max_size=None,
+                         draft=None,
+                         max_in_flight=None):
     """
     Concurrently and in parallel convert the anime
-    illustration images to black and white
+    illustration images to black and white with a single pool
+    of workers. Images are found as the workers free up with a
+    bounded number of chunks of them waiting to be converted, so
+    the dataset is never listed in memory. Images already converted
+    are skipped so an interrupted conversion can be resumed
+
+    :param image_dir: Directory of the image folders
+
+    :type image_dir: str, optional
+
+    :param output_dir: Directory to save the converted images to
+
+    :type output_dir: str, optional
+
+    :param errors_file: CSV file to list the images that
+    couldn't be converted and why in
+
+    :type errors_file: str, optional
+
+    :param chunksize: Number of images sent to a worker at once
+
+    :type chunksize: int, optional
+
+    :param max_size: Size to scale the images down to cover so that
+    rendering reads smaller files, defaults to the size in the config
+
+    :type max_size: tuple, optional
+
+    :param draft: Whether to decode JPEGs straight to grayscale,
+    defaults to the setting in the config
+
+    :type draft: bool, optional
+
+    :param max_in_flight: Maximum number of chunks waiting to be
+    converted, defaults to twice the number of CPUs
+
+    :type max_in_flight: int, optional
+
+    :return: The number of converted, skipped and failed images
+    and the images per second
+
+    :rtype: dict
     """
-    if not os.path.isdir(processed_image_dir):
-        os.mkdir(processed_image_dir)
+    if max_size is None and cfg.bw_max_size is not None:
+        max_size = tuple(cfg.bw_max_size)
+    if draft is None:
+        draft = cfg.draft_decode
+    if max_in_flight is None:
+        max_in_flight = 2*(os.cpu_count() or 1)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Only list the errors of this run
+    if os.path.isfile(errors_file):
+        os.remove(errors_file)
 
     print("Converting images to black and white")
-    image_folders = os.listdir(image_dataset_dir)
-    for folder in tqdm(image_folders):
-        folder_path = image_dataset_dir+folder + "/"
-        if os.path.isdir(folder_path):
-            image_paths = [folder_path + image
-                           for image in os.listdir(folder_path)
-                           if image.endswith(".jpg")]
-
-            # Since image processing is CPU and IO intensive
-            with concurrent.futures.ProcessPoolExecutor() as executor:
-                results = executor.map(convert_single_image, image_paths)
+    tasks = ((image_path, output_dir, max_size, draft)
+             for image_path in iter_image_paths(image_dir))
+
+    summary = dict(converted=0, skipped=0, failed=0)
+    errors = []
+    start = time.perf_counter()
+    progress = tqdm()
+    in_flight = set()
+
+    def collect(future):
+        in_flight.remove(future)
+        results = future.result()
+        for image_path, status, error in results:
+            summary[status] += 1
+            if error is not None:
+                errors.append((image_path, error))
+        progress.update(len(results))
+
+    # Since image processing is CPU and IO intensive
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        while True:
+            chunk = list(itertools.islice(tasks, chunksize))
+            if len(chunk) == 0:
+                break
+            in_flight.add(executor.submit(convert_image_chunk, chunk))
+
+            # Wait for a chunk to finish before finding more images
+            if len(in_flight) >= max_in_flight:
+                done, _ = concurrent.futures.wait(
+                    in_flight,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    collect(future)
+
+        for future in concurrent.futures.as_completed(list(in_flight)):
+            collect(future)
+    progress.close()
+
+    seconds = time.perf_counter() - start
+    summary['images_per_sec'] = summary['converted']/max(seconds, 1e-9)
+
+    if len(errors) > 0:
+        errors_dir = os.path.dirname(errors_file)
+        if errors_dir:
+            os.makedirs(errors_dir, exist_ok=True)
+        with open(errors_file, "w+", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["image_path", "error"])
+            writer.writerows(errors)
+
+    print("Converted {converted}, skipped {skipped} already converted and "
+          "failed {failed} images ({images_per_sec:.1f} images/sec)".format(
+              **summary))
+    if len(errors) > 0:
+        print("Images that failed are listed in", errors_file)
+
+    return summary
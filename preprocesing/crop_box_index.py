@@ -0,0 +1,201 @@
+import os
+import concurrent.futures
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from .layout_engine.helpers import get_crop_box
+from . import config_file as cfg
+
+
+def index_single_image(image_path):
+    """
+    Find the crop box and size of one illustration
+
+    :param image_path: Path to the illustration
+
+    :type image_path: str
+
+    :return: The image's width and height and its crop box
+    or None if the image can't be read
+
+    :rtype: tuple
+    """
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert("L")
+            return img.size, get_crop_box(np.asarray(img))
+    except (OSError, ValueError):
+        return None
+
+
+def build_crop_box_index(image_dir, index_path=None):
+    """
+    Concurrently and in parallel record the crop box and original
+    size of every illustration in a directory into one compressed
+    columnar npz file
+
+    :param image_dir: Directory of BW illustrations
+
+    :type image_dir: str
+
+    :param index_path: Where to write the index, defaults to
+    the path in the config
+
+    :type index_path: str, optional
+    """
+    if index_path is None:
+        index_path = cfg.crop_box_index_path
+
+    names = sorted(entry.name for entry in os.scandir(image_dir)
+                   if entry.is_file())
+    image_paths = [os.path.join(image_dir, name) for name in names]
+
+    print("Indexing crop boxes of", len(names), "images")
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        results = list(tqdm(executor.map(index_single_image,
+                                         image_paths,
+                                         chunksize=256),
+                            total=len(image_paths)))
+
+    indexed_names = []
+    sizes = []
+    boxes = []
+    for name, result in zip(names, results):
+        if result is None:
+            continue
+        indexed_names.append(name)
+        sizes.append(result[0])
+        boxes.append(result[1])
+
+    np.savez_compressed(
+        index_path,
+        image_dir=np.array(os.path.abspath(image_dir)),
+        names=np.array(indexed_names),
+        sizes=np.array(sizes, dtype=np.int32).reshape(-1, 2),
+        boxes=np.array(boxes, dtype=np.int32).reshape(-1, 4)
+    )
+    print("Wrote crop boxes of", len(indexed_names), "images to",
+          index_path)
+
+
+def find_indexed_name(image_dir, names, path):
+    """
+    Find where an image is in the sorted names of an index
+    by its path relative to the indexed directory
+
+    :param image_dir: Absolute path of the indexed directory
+
+    :type image_dir: str
+
+    :param names: Sorted names of the indexed images
+
+    :type names: numpy.ndarray
+
+    :param path: Absolute path of the image
+
+    :type path: str
+
+    :return: Position of the image's name or None if
+    it isn't indexed
+
+    :rtype: int
+    """
+    if os.path.dirname(path) != image_dir:
+        return None
+
+    name = os.path.basename(path)
+    position = int(np.searchsorted(names, name))
+    if position == len(names) or names[position] != name:
+        return None
+
+    return position
+
+
+class CropBoxIndex(object):
+    """
+    A crop box index kept as its sorted columns, so a lookup is
+    a binary search rather than every worker holding a dictionary
+    of every image's path
+
+    :param image_dir: Absolute path of the indexed directory
+
+    :type image_dir: str
+
+    :param names: Sorted names of the indexed images
+
+    :type names: numpy.ndarray
+
+    :param sizes: Width and height of each image
+
+    :type sizes: numpy.ndarray
+
+    :param boxes: Crop box of each image
+
+    :type boxes: numpy.ndarray
+    """
+    def __init__(self, image_dir=None, names=None, sizes=None, boxes=None):
+
+        if names is None:
+            names = np.array([], dtype=str)
+            sizes = np.zeros((0, 2), dtype=np.int32)
+            boxes = np.zeros((0, 4), dtype=np.int32)
+
+        self.image_dir = image_dir
+        self.names = names
+        self.sizes = sizes
+        self.boxes = boxes
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, path):
+        """
+        Look up an image's size and crop box
+
+        :param path: Absolute path of the image
+
+        :type path: str
+
+        :return: A tuple of the image's size and crop box or
+        None if it isn't indexed
+
+        :rtype: tuple
+        """
+        position = find_indexed_name(self.image_dir, self.names, path)
+        if position is None:
+            return None
+
+        return (tuple(self.sizes[position].tolist()),
+                tuple(self.boxes[position].tolist()))
+
+
+def load_crop_box_index(index_path=None):
+    """
+    Load a crop box index for lookups by absolute image path
+
+    :param index_path: Path of the index, defaults to
+    the path in the config
+
+    :type index_path: str, optional
+
+    :return: The index, empty if there is none
+
+    :rtype: CropBoxIndex
+    """
+    if index_path is None:
+        index_path = cfg.crop_box_index_path
+
+    if not os.path.isfile(index_path):
+        return CropBoxIndex()
+
+    with np.load(index_path) as index:
+        image_dir = str(index['image_dir'])
+        names = index['names']
+        sizes = index['sizes']
+        boxes = index['boxes']
+
+    # Indexes are written in name order but sorting
+    # keeps the lookups right if one isn't
+    order = np.argsort(names, kind="stable")
+    return CropBoxIndex(image_dir, names[order], sizes[order], boxes[order])
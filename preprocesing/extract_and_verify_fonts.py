@@ -6,6 +6,7 @@ import shutil
 from PIL import Image, ImageFont, ImageDraw
 import dask.dataframe as dd
 import itertools
+import numpy as np
 from fontTools.ttLib import TTFont
 from fontTools.unicode import Unicode
 from fontTools.ttLib import TTLibError
@@ -140,27 +141,116 @@ def create_character_test_string(dataframe_file, render_text_test_file):
         wf.write(test_string)
 
 
-def has_glyph(font, glyph):
+def get_font_codepoints(font):
     """
-    Check if a font file has the character
-    glyph specified
+    Merge the codepoints of every cmap table of a font
+    into one sorted array
 
     :param font: A TTFont object from fontTools
 
     :type font: TTFont
 
-    :param glyph: A character glyph
+    :return: The codepoints the font has glyphs for
+
+    :rtype: numpy.ndarray
+    """
+    codepoints = set()
+    for table in font['cmap'].tables:
+        codepoints.update(table.cmap.keys())
+    return np.array(sorted(codepoints), dtype=np.int64)
 
-    :type glyph: str
 
-    :return: 0 or 1 as a yes or no
+# Codepoints of the test characters, set once in each worker
+_test_codepoints = None
 
-    :rtype: int
+
+def init_coverage_worker(test_codepoints):
     """
-    for table in font['cmap'].tables:
-        if ord(glyph) in table.cmap.keys():
-            return 1
-    return 0
+    Give a font coverage worker the codepoints to test
+    so they aren't sent along with every font
+
+    :param test_codepoints: Codepoints of the test characters
+
+    :type test_codepoints: numpy.ndarray
+    """
+    global _test_codepoints
+    _test_codepoints = test_codepoints
+
+
+def get_font_coverage(font_path):
+    """
+    Check which of the test characters a font has glyphs for,
+    reading only its cmap tables
+
+    :param font_path: Path of the font file
+
+    :type font_path: str
+
+    :return: Whether the font covers each test character or None
+    if the font can't be read
+
+    :rtype: numpy.ndarray
+    """
+    try:
+        with TTFont(font_path, lazy=True) as font:
+            codepoints = get_font_codepoints(font)
+    except (TTLibError, OSError, KeyError, AssertionError):
+        return None
+
+    return np.isin(_test_codepoints, codepoints, assume_unique=True)
+
+
+def save_font_coverage(coverage_path, font_paths, chars, coverage):
+    """
+    Save which characters each font covers as a bit matrix with
+    a row of bits per font, packed 8 characters to a byte
+
+    :param coverage_path: Where to write the matrix
+
+    :type coverage_path: str
+
+    :param font_paths: Paths of the fonts in row order
+
+    :type font_paths: list
+
+    :param chars: The test characters in column order
+
+    :type chars: list
+
+    :param coverage: Boolean matrix of fonts by characters
+
+    :type coverage: numpy.ndarray
+    """
+    with open(coverage_path + ".tmp", "wb") as coverage_file:
+        np.savez_compressed(
+            coverage_file,
+            fonts=np.array(font_paths),
+            chars=np.array(chars),
+            coverage=np.packbits(coverage, axis=1)
+        )
+    os.replace(coverage_path + ".tmp", coverage_path)
+
+
+def load_font_coverage(coverage_path):
+    """
+    Load the font coverage matrix saved by verify_font_files
+
+    :param coverage_path: Path of the matrix
+
+    :type coverage_path: str
+
+    :return: The font paths, the test characters and a boolean
+    matrix of whether each font covers each character
+
+    :rtype: tuple
+    """
+    with np.load(coverage_path) as saved:
+        font_paths = saved['fonts'].tolist()
+        chars = saved['chars'].tolist()
+        coverage = np.unpackbits(saved['coverage'], axis=1,
+                                 count=len(chars)).astype(bool)
+
+    return font_paths, chars, coverage
 
 
 def verify_font_files(dataframe_file,
@@ -172,7 +262,9 @@ def verify_font_files(dataframe_file,
     A function that tests whether the font files
     that have been scraped meet the benchmark of
     rendering at least x% (as specififed in the config)
-    of the unique characters in the text corpus
+    of the unique characters in the text corpus.
+    Fonts are checked in parallel and which characters
+    each one covers is saved alongside the viable fonts
     """
     if not os.path.isfile(render_text_test_file):
         print("Character test string does exist. Generating!")
@@ -185,34 +277,37 @@ def verify_font_files(dataframe_file,
         test_string = test_file.readlines()[0]
 
     chars = test_string.split(" ")
-    all_fonts = os.listdir(font_file_dir)
-
-    total_chars = len(chars)
+    test_codepoints = np.array([ord(char) for char in chars], dtype=np.int64)
+    all_fonts = sorted(font_name for font_name in os.listdir(font_file_dir)
+                       if font_name != ".DS_Store")
+    font_paths = [font_file_dir + font_name for font_name in all_fonts]
 
-    coverages = []
+    coverage = np.zeros((len(font_paths), len(chars)), dtype=bool)
     print("Verifying fonts")
-    for font_name in tqdm(all_fonts):
-        if font_name == ".DS_Store":
-            continue
-        font_path = font_file_dir + font_name
-        try:
-            font = TTFont(font_path)
-        except TTLibError as e:
-            print(font_path)
-
-        has_glyph_list = []
-        for char in chars:
-            has_glyph_list.append(has_glyph(font, char))
-
-        coverage = sum(has_glyph_list)/total_chars
-        coverages.append([font_path, coverage])
+    with concurrent.futures.ProcessPoolExecutor(
+            initializer=init_coverage_worker,
+            initargs=(test_codepoints,)) as executor:
+        results = executor.map(get_font_coverage, font_paths, chunksize=16)
+        for idx, font_coverage in enumerate(tqdm(results,
+                                                 total=len(font_paths))):
+            if font_coverage is None:
+                # Unreadable fonts cover nothing so they aren't viable
+                print(font_paths[idx])
+                continue
+            coverage[idx] = font_coverage
+
+    coverage_path = font_dataset_path + cfg.font_coverage_file
+    print("Writing font coverage to file:", coverage_path)
+    save_font_coverage(coverage_path, font_paths, chars, coverage)
+
+    coverages = coverage.mean(axis=1)
 
     print("Writing viability to file:", font_dataset_path+"viable_fonts.csv")
     with open(font_dataset_path+"viable_fonts.csv", "w+") as viable_font_file:
-        for font in coverages:
+        for font_path, font_coverage in zip(font_paths, coverages):
             # Coverge %
-            if font[1] > cfg.font_character_coverage:
+            if font_coverage > cfg.font_character_coverage:
                 viable = True
             else:
                 viable = False
-            viable_font_file.write(font[0] + ","+str(viable)+"\n")
+            viable_font_file.write(font_path + ","+str(viable)+"\n")
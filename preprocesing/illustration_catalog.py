@@ -0,0 +1,462 @@
+import os
+import json
+import hashlib
+import concurrent.futures
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from .layout_engine.helpers import get_crop_box
+from . import config_file as cfg
+
+
+def get_catalog_dtype(name_length):
+    """
+    Make the record type of the illustration catalog
+
+    :param name_length: Longest filename in bytes
+
+    :type name_length: int
+
+    :return: The record type
+
+    :rtype: numpy.dtype
+    """
+    return np.dtype([
+        ("name", "S{}".format(max(name_length, 1))),
+        ("mtime", np.int64),
+        ("width", np.int32),
+        ("height", np.int32),
+        ("aspect_ratio", np.float32),
+        ("crop_box", np.int32, (4,)),
+        ("mean_intensity", np.float32),
+        ("valid", np.bool_)
+    ])
+
+
+def get_aspect_index_path(catalog_path):
+    """
+    Get the path of a catalog's aspect ratio index
+
+    :param catalog_path: Path of the catalog
+
+    :type catalog_path: str
+
+    :return: Path of the aspect ratio index
+
+    :rtype: str
+    """
+    return os.path.splitext(catalog_path)[0] + "_by_aspect.npy"
+
+
+def get_catalog_source_path(catalog_path):
+    """
+    Get the path of the file recording what a catalog was built from
+
+    :param catalog_path: Path of the catalog
+
+    :type catalog_path: str
+
+    :return: Path of the catalog's source file
+
+    :rtype: str
+    """
+    return os.path.splitext(catalog_path)[0] + "_source.json"
+
+
+def get_catalog_source(image_dir, names=None):
+    """
+    Describe what a catalog is built from so that a catalog of
+    another directory or of another filtered set isn't used
+
+    :param image_dir: Directory of the illustrations
+
+    :type image_dir: str
+
+    :param names: File names of the cataloged illustrations if only
+    the ones listed in a filtered manifest are cataloged
+
+    :type names: list, optional
+
+    :return: The absolute directory and a digest of the names,
+    None if every file in the directory is cataloged
+
+    :rtype: dict
+    """
+    digest = None
+    if names is not None:
+        digest = hashlib.sha1(
+            "\n".join(sorted(names)).encode("utf-8")).hexdigest()
+
+    return dict(image_dir=os.path.abspath(image_dir), names=digest)
+
+
+def load_catalog_source(catalog_path):
+    """
+    Read what a catalog was built from
+
+    :param catalog_path: Path of the catalog
+
+    :type catalog_path: str
+
+    :return: The catalog's source or None if it wasn't recorded
+
+    :rtype: dict
+    """
+    source_path = get_catalog_source_path(catalog_path)
+    if not os.path.isfile(source_path):
+        return None
+
+    with open(source_path, encoding="utf-8") as source_file:
+        return json.load(source_file)
+
+
+def analyze_illustration(image_path):
+    """
+    Read the size, crop box and mean intensity of one illustration
+
+    :param image_path: Path to the illustration
+
+    :type image_path: str
+
+    :return: The width, height, crop box and mean intensity
+    of the illustration or None if it can't be read
+
+    :rtype: tuple
+    """
+    try:
+        with Image.open(image_path) as img:
+            img = np.asarray(img.convert("L"))
+    except (OSError, ValueError):
+        return None
+
+    if img.size == 0:
+        return None
+
+    height, width = img.shape
+    return width, height, get_crop_box(img), float(img.mean())
+
+
+def build_illustration_catalog(image_dir, catalog_path=None, names=None):
+    """
+    Create or update the catalog of every illustration in a
+    directory, or of the listed ones only. Only files that are new or whose modification time
+    changed are read, in parallel. Unreadable files are kept in the
+    catalog as invalid so that they aren't read again on every update.
+    Valid illustrations come first, sorted by name. The directory
+    and names are recorded next to the catalog so it is only used
+    with the images it was built from
+
+    :param image_dir: Directory of BW illustrations
+
+    :type image_dir: str
+
+    :param catalog_path: Where to write the catalog, defaults to
+    the path in the config
+
+    :type catalog_path: str, optional
+
+    :param names: File names of the illustrations to catalog,
+    defaults to every file in the directory
+
+    :type names: list, optional
+
+    :return: The number of valid and invalid illustrations
+
+    :rtype: tuple
+    """
+    if catalog_path is None:
+        catalog_path = cfg.illustration_catalog_path
+
+    source = get_catalog_source(image_dir, names)
+    previous_source = load_catalog_source(catalog_path)
+
+    # Records of another directory's files can't be reused
+    previous = {}
+    if (os.path.isfile(catalog_path) and previous_source is not None
+            and previous_source['image_dir'] == source['image_dir']):
+        for record in np.load(catalog_path):
+            previous[record['name']] = record
+
+    if names is not None:
+        names = set(names)
+
+    entries = []
+    to_analyze = []
+    for entry in os.scandir(image_dir):
+        if not entry.is_file():
+            continue
+        if names is not None and entry.name not in names:
+            continue
+        name = os.fsencode(entry.name)
+        mtime = entry.stat().st_mtime_ns
+        record = previous.get(name)
+        if record is not None and record['mtime'] == mtime:
+            entries.append((name, mtime, record))
+        else:
+            entries.append((name, mtime, None))
+            to_analyze.append(entry.path)
+
+    print("Cataloging", len(to_analyze), "new or changed illustrations of",
+          len(entries))
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        analyzed = iter(list(tqdm(executor.map(analyze_illustration,
+                                               to_analyze,
+                                               chunksize=256),
+                                  total=len(to_analyze))))
+
+    name_length = max([len(name) for name, _, _ in entries], default=1)
+    catalog = np.zeros(len(entries), dtype=get_catalog_dtype(name_length))
+    for idx, (name, mtime, record) in enumerate(entries):
+        row = catalog[idx]
+        row['name'] = name
+        row['mtime'] = mtime
+        if record is None:
+            result = next(analyzed)
+            if result is None:
+                continue
+            width, height, box, mean_intensity = result
+            row['width'] = width
+            row['height'] = height
+            row['crop_box'] = box
+            row['mean_intensity'] = mean_intensity
+            row['valid'] = True
+        else:
+            for field in ['width', 'height', 'crop_box',
+                          'mean_intensity', 'valid']:
+                row[field] = record[field]
+
+    # Pages are rendered from the cropped illustrations so match
+    # panels against their aspect ratio, also for reused records
+    # which may come from catalogs that used the uncropped size
+    boxes = catalog['crop_box']
+    catalog['aspect_ratio'] = (boxes[:, 2] - boxes[:, 0])/np.maximum(
+        boxes[:, 3] - boxes[:, 1], 1)
+
+    catalog = catalog[np.lexsort((catalog['name'], ~catalog['valid']))]
+    num_valid = int(np.count_nonzero(catalog['valid']))
+
+    # The valid illustrations sorted by aspect ratio so the ones
+    # closest to a panel's can be binary searched
+    order = np.argsort(catalog['aspect_ratio'][:num_valid], kind="stable")
+    aspect_index = np.zeros(num_valid, dtype=[("aspect_ratio", np.float32),
+                                              ("index", np.int32)])
+    aspect_index['aspect_ratio'] = catalog['aspect_ratio'][order]
+    aspect_index['index'] = order
+
+    # Write and swap so readers never see half a catalog
+    for path, array in [(get_aspect_index_path(catalog_path), aspect_index),
+                        (catalog_path, catalog)]:
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    # Recorded last so an interrupted update can't vouch for
+    # a catalog of other images
+    source_path = get_catalog_source_path(catalog_path)
+    with open(source_path + ".tmp", "w", encoding="utf-8") as source_file:
+        json.dump(source, source_file, ensure_ascii=False)
+    os.replace(source_path + ".tmp", source_path)
+
+    print("Cataloged", num_valid, "valid and", len(catalog) - num_valid,
+          "invalid illustrations in", catalog_path)
+
+    return num_valid, len(catalog) - num_valid
+
+
+class IllustrationCatalog(object):
+    """
+    A read only, memory mapped view of the valid illustrations
+    of a catalog. It can be used in place of the list of
+    illustration filenames pages are created from: its length is
+    the number of valid illustrations and indexing it gives their
+    filenames. Only the catalog's path is pickled so worker
+    processes map the file again instead of copying it
+
+    :param catalog_path: Path of the catalog, defaults to
+    the path in the config
+
+    :type catalog_path: str, optional
+    """
+    def __init__(self, catalog_path=None):
+
+        if catalog_path is None:
+            catalog_path = cfg.illustration_catalog_path
+
+        self.catalog_path = catalog_path
+        self.records = np.load(catalog_path, mmap_mode="r")
+
+        # Valid records come first so binary search for the
+        # first invalid one rather than reading every record
+        valid = self.records['valid']
+        low, high = 0, len(valid)
+        while low < high:
+            middle = (low + high)//2
+            if valid[middle]:
+                low = middle + 1
+            else:
+                high = middle
+        self.num_valid = low
+
+        aspect_index_path = get_aspect_index_path(catalog_path)
+        if os.path.isfile(aspect_index_path):
+            self.aspect_index = np.load(aspect_index_path, mmap_mode="r")
+        else:
+            self.aspect_index = None
+
+    def __len__(self):
+        return self.num_valid
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.num_valid
+        if not 0 <= idx < self.num_valid:
+            raise IndexError("illustration index out of range")
+
+        return os.fsdecode(self.records['name'][idx])
+
+    def __iter__(self):
+        for idx in range(self.num_valid):
+            yield self[idx]
+
+    def choose_by_aspect(self, aspect_ratio, rng=np.random):
+        """
+        Pick a random illustration out of the ones whose aspect
+        ratio is within the configured tolerance of a given one,
+        widened to the closest ones if there are too few of them.
+        Takes two binary searches over the aspect ratio index
+
+        :param aspect_ratio: Width over height to match
+
+        :type aspect_ratio: float
+
+        :param rng: Random number generator to draw from,
+        defaults to numpy's global generator
+
+        :type rng: numpy.random.RandomState, optional
+
+        :return: Filename of the illustration
+
+        :rtype: str
+        """
+        if self.aspect_index is None or len(self.aspect_index) == 0:
+            return self[rng.randint(0, self.num_valid)]
+
+        ratios = self.aspect_index['aspect_ratio']
+        tolerance = 1 + cfg.illustration_aspect_tolerance
+        low = int(np.searchsorted(ratios, aspect_ratio/tolerance, "left"))
+        high = int(np.searchsorted(ratios, aspect_ratio*tolerance, "right"))
+
+        min_candidates = min(cfg.illustration_aspect_min_candidates,
+                             len(ratios))
+        if high - low < min_candidates:
+            closest = int(np.searchsorted(ratios, aspect_ratio))
+            low = closest - min_candidates//2
+            low = max(0, min(low, len(ratios) - min_candidates))
+            high = low + min_candidates
+
+        return self[int(self.aspect_index['index'][rng.randint(low, high)])]
+
+    def __getstate__(self):
+        return {"catalog_path": self.catalog_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["catalog_path"])
+
+
+def load_illustration_catalog(catalog_path=None, image_dir=None,
+                              names=None):
+    """
+    Open the illustration catalog if it exists and, if a directory
+    is given, was built from the images pages will be created from
+
+    :param catalog_path: Path of the catalog, defaults to
+    the path in the config
+
+    :type catalog_path: str, optional
+
+    :param image_dir: Directory of the illustrations the
+    catalog must have been built from
+
+    :type image_dir: str, optional
+
+    :param names: File names listed in the filtered manifest the
+    catalog must have been built from, None if there is none
+
+    :type names: list, optional
+
+    :return: The catalog or None if it hasn't been built
+    or was built from other images
+
+    :rtype: IllustrationCatalog
+    """
+    if catalog_path is None:
+        catalog_path = cfg.illustration_catalog_path
+
+    if not os.path.isfile(catalog_path):
+        return None
+
+    if image_dir is not None and load_catalog_source(catalog_path) != \
+            get_catalog_source(image_dir, names):
+        print("The image catalog", catalog_path, "was built from other "
+              "images than", image_dir, "so it isn't used. Rerun "
+              "--catalog_images to rebuild it.")
+        return None
+
+    return IllustrationCatalog(catalog_path)
+
+
+def write_filtered_manifest(image_dir, names, manifest_path=None):
+    """
+    Record which illustrations of a directory pages should be
+    created from, so a filtered set doesn't have to be copied or
+    linked into its own directory. The manifest is written under
+    a temporary name and swapped in once complete
+
+    :param image_dir: Directory of the illustrations
+
+    :type image_dir: str
+
+    :param names: File names of the illustrations to use
+
+    :type names: list
+
+    :param manifest_path: Where to write the manifest, defaults to
+    the path in the config
+
+    :type manifest_path: str, optional
+    """
+    if manifest_path is None:
+        manifest_path = cfg.filtered_manifest_path
+
+    manifest = dict(image_dir=os.path.abspath(image_dir),
+                    names=sorted(names))
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def load_filtered_manifest(manifest_path=None):
+    """
+    Read the manifest of a filtered set of illustrations if it exists
+
+    :param manifest_path: Path of the manifest, defaults to
+    the path in the config
+
+    :type manifest_path: str, optional
+
+    :return: The directory of the illustrations and their sorted
+    file names or None if there is no manifest
+
+    :rtype: tuple
+    """
+    if manifest_path is None:
+        manifest_path = cfg.filtered_manifest_path
+
+    if not os.path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    return manifest['image_dir'], manifest['names']
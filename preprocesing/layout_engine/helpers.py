@@ -21,6 +21,29 @@ def crop_image_only_outside(img, tol=0):
 
     :rtype: PIL.Image
     """
+    left, upper, right, lower = get_crop_box(img, tol)
+
+    return img[upper:lower, left:right]
+
+
+def get_crop_box(img, tol=0):
+    """
+    Find the box of an image which is left once the outside
+    where the pixels are black is cropped
+
+    :param img: 2D image data
+
+    :type img: numpy.ndarray
+
+    :param tol: tollerance level, defaults to 0
+
+    :type tol: int, optional
+
+    :return: A (left, upper, right, lower) box as used by
+    PIL.Image.crop
+
+    :rtype: tuple
+    """
     # img is 2D image data
     # tol  is tolerance
     mask = img > tol
@@ -31,7 +54,166 @@ def crop_image_only_outside(img, tol=0):
     col_start, col_end = mask0.argmax(), n-mask0[::-1].argmax()
     row_start, row_end = mask1.argmax(), m-mask1[::-1].argmax()
 
-    return img[row_start:row_end, col_start:col_end]
+    return int(col_start), int(row_start), int(col_end), int(row_end)
+
+
+def get_draft_size(image_size, box, target_size):
+    """
+    Find the smallest size an image can be decoded at so that
+    a box of it still covers a target size once resized to it,
+    as requested from PIL.Image.draft which picks the smallest
+    JPEG DCT scale at least as large
+
+    :param image_size: Width and height of the image at
+    full resolution
+
+    :type image_size: tuple
+
+    :param box: A (left, upper, right, lower) box of the image
+    at full resolution that is resized to the target
+
+    :type box: tuple
+
+    :param target_size: Width and height the box is resized to
+
+    :type target_size: tuple
+
+    :return: Width and height to request
+
+    :rtype: tuple
+    """
+    box_width = max(box[2] - box[0], 1)
+    box_height = max(box[3] - box[1], 1)
+    scale = max(target_size[0]/box_width, target_size[1]/box_height)
+    if scale >= 1:
+        return tuple(image_size)
+
+    return (min(math.ceil(image_size[0]*scale), image_size[0]),
+            min(math.ceil(image_size[1]*scale), image_size[1]))
+
+
+def scale_box(box, from_size, to_size):
+    """
+    Scale a box of an image to the same region of the
+    image at another size, rounding outwards
+
+    :param box: A (left, upper, right, lower) box
+
+    :type box: tuple
+
+    :param from_size: Width and height of the image the box is of
+
+    :type from_size: tuple
+
+    :param to_size: Width and height of the scaled image
+
+    :type to_size: tuple
+
+    :return: The scaled box
+
+    :rtype: tuple
+    """
+    x_scale = to_size[0]/from_size[0]
+    y_scale = to_size[1]/from_size[1]
+
+    return (math.floor(box[0]*x_scale), math.floor(box[1]*y_scale),
+            min(math.ceil(box[2]*x_scale), to_size[0]),
+            min(math.ceil(box[3]*y_scale), to_size[1]))
+
+
+def get_polygon_bbox(polygon, size):
+    """
+    Get the integer bounding box of a polygon clipped
+    to the bounds of an image
+
+    :param polygon: A sequence of xy coordinates
+
+    :type polygon: tuple
+
+    :param size: Width and height of the image
+
+    :type size: tuple
+
+    :return: A (left, upper, right, lower) box with
+    right and lower exclusive or None if the polygon
+    lies outside the image
+
+    :rtype: tuple
+    """
+    xs = [point[0] for point in polygon]
+    ys = [point[1] for point in polygon]
+
+    # Pad by a pixel since the rasterizer can round outwards
+    left = max(math.floor(min(xs)) - 1, 0)
+    upper = max(math.floor(min(ys)) - 1, 0)
+    right = min(math.ceil(max(xs)) + 2, size[0])
+    lower = min(math.ceil(max(ys)) + 2, size[1])
+
+    if left >= right or upper >= lower:
+        return None
+
+    return left, upper, right, lower
+
+
+def shift_polygon(polygon, x_offset, y_offset):
+    """
+    Move a polygon's coordinates so that they are relative
+    to an offset i.e. the corner of a bounding box
+
+    :param polygon: A sequence of xy coordinates
+
+    :type polygon: tuple
+
+    :param x_offset: Amount to move the polygon left by
+
+    :type x_offset: int
+
+    :param y_offset: Amount to move the polygon up by
+
+    :type y_offset: int
+
+    :return: The shifted polygon
+
+    :rtype: tuple
+    """
+    return tuple((point[0] - x_offset, point[1] - y_offset)
+                 for point in polygon)
+
+
+def find_largest_fitting(low, high, fits):
+    """
+    Binary search for the largest integer in a range for which
+    a condition holds, assuming that if it holds for a value
+    it holds for all the smaller ones too
+
+    :param low: Smallest value to try
+
+    :type low: int
+
+    :param high: Largest value to try
+
+    :type high: int
+
+    :param fits: A function of a value returning whether
+    the condition holds
+
+    :type fits: function
+
+    :return: The largest fitting value or None if no
+    value in the range fits
+
+    :rtype: int
+    """
+    best = None
+    while low <= high:
+        middle = (low + high)//2
+        if fits(middle):
+            best = middle
+            low = middle + 1
+        else:
+            high = middle - 1
+
+    return best
 
 
 def invert_for_next(current):
@@ -58,7 +240,7 @@ def invert_for_next(current):
         return "h"
 
 
-def choose(parent):
+def choose(parent, rng=np.random):
     """
     Choose one panel from a parent
     panel's children
@@ -68,17 +250,22 @@ def choose(parent):
 
     :type parent: Panel
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Index of chosen child panel
 
     :rtype: int
     """
 
-    choice_idx = np.random.randint(0, len(parent.children))
+    choice_idx = rng.randint(0, len(parent.children))
 
     return choice_idx
 
 
-def choose_and_return_other(parent):
+def choose_and_return_other(parent, rng=np.random):
     """
     Choose a particular panel to return
     randomly and also return panels
@@ -89,6 +276,11 @@ def choose_and_return_other(parent):
 
     :type parent: Panel
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: A tuple of a chosen child panel index
     and a list the indices of those that weren't
 
@@ -96,7 +288,7 @@ def choose_and_return_other(parent):
     """
 
     choices = list(range(0, len(parent.children)))
-    choice_idx = np.random.choice(choices)
+    choice_idx = rng.choice(choices)
 
     choices.remove(choice_idx)
 
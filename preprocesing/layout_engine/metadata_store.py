@@ -0,0 +1,370 @@
+import os
+import json
+import gzip
+
+from .. import config_file as cfg
+
+shard_prefix = "shard-"
+index_suffix = ".idx"
+
+
+def get_shard_paths(store_dir):
+    """
+    Find the metadata shards of a store in the order
+    they were written
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :return: Paths of the shard files
+
+    :rtype: list
+    """
+    if not os.path.isdir(store_dir):
+        return []
+
+    names = sorted(entry.name for entry in os.scandir(store_dir)
+                   if entry.name.startswith(shard_prefix)
+                   and (entry.name.endswith(".jsonl")
+                        or entry.name.endswith(".jsonl.gz")))
+
+    return [os.path.join(store_dir, name) for name in names]
+
+
+def get_shard_number(shard_path):
+    """
+    Get the number of a shard from its filename
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+
+    :return: The shard's number
+
+    :rtype: int
+    """
+    name = os.path.basename(shard_path)
+    return int(name[len(shard_prefix):].split(".")[0])
+
+
+def iter_shard_index(shard_path):
+    """
+    Read the index of a shard, leaving out a last line cut
+    short by a crash
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+
+    :return: A generator of tuples of a page's name, byte offset
+    and length and where its index line ends
+
+    :rtype: generator
+    """
+    index_path = shard_path+index_suffix
+    if not os.path.isfile(index_path):
+        return
+
+    line_end = 0
+    with open(index_path, "rb") as index_file:
+        for line in index_file:
+            if not line.endswith(b"\n"):
+                return
+            line_end += len(line)
+            name, offset, length = line.decode().rstrip("\n").split("\t")
+            yield name, int(offset), int(length), line_end
+
+
+def repair_shard(shard_path):
+    """
+    Cut a shard and its index back to the last page that was
+    completely written to both, e.g. after the writing process
+    crashed between writing a page and indexing it
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+    """
+    shard_end = 0
+    index_end = 0
+    for _, offset, length, line_end in iter_shard_index(shard_path):
+        shard_end = offset + length
+        index_end = line_end
+
+    index_path = shard_path+index_suffix
+    if not os.path.isfile(index_path):
+        open(index_path, "x").close()
+    if os.path.getsize(index_path) > index_end:
+        os.truncate(index_path, index_end)
+    if os.path.getsize(shard_path) > shard_end:
+        os.truncate(shard_path, shard_end)
+
+
+class MetadataStore(object):
+    """
+    An append only store of page metadata. Pages are written as
+    JSON lines into numbered shard files of a fixed number of pages
+    each, optionally as one gzip member per page. Next to every shard
+    an index file records each page's name, byte offset and length so
+    a single page can be read without scanning its shard.
+
+    A page is only indexed once it has been flushed to its shard
+    and opening a store cuts every shard back to its indexed pages,
+    so a crash never leaves the shards and indices disagreeing.
+
+    Only one process should write to a store at a time, new
+    shards are started after the ones already in the directory
+
+    :param store_dir: Directory to keep the shards in
+
+    :type store_dir: str
+
+    :param shard_size: Number of pages per shard, defaults
+    to the size in the config
+
+    :type shard_size: int, optional
+
+    :param compress: Whether to gzip the pages, defaults to
+    whether the config's metadata format is jsonl.gz
+
+    :type compress: bool, optional
+    """
+    def __init__(self, store_dir, shard_size=None, compress=None):
+
+        if shard_size is None:
+            shard_size = cfg.metadata_shard_size
+
+        if compress is None:
+            compress = cfg.metadata_format == "jsonl.gz"
+
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        self.compress = compress
+
+        shard_paths = get_shard_paths(store_dir)
+        for shard_path in shard_paths:
+            repair_shard(shard_path)
+        if len(shard_paths) > 0:
+            self.next_shard = get_shard_number(shard_paths[-1]) + 1
+        else:
+            self.next_shard = 0
+
+        self.shard_file = None
+        self.index_file = None
+        self.shard_count = 0
+
+    def open_shard(self):
+        """
+        Close the current shard and start the next one
+        """
+        self.close()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        extension = ".jsonl.gz" if self.compress else ".jsonl"
+        shard_path = os.path.join(self.store_dir,
+                                  "{}{:05d}{}".format(shard_prefix,
+                                                      self.next_shard,
+                                                      extension))
+        self.shard_file = open(shard_path, "xb")
+        self.index_file = open(shard_path+index_suffix, "x")
+        self.next_shard += 1
+        self.shard_count = 0
+
+    def append(self, data):
+        """
+        Write a page's metadata to the store
+
+        :param data: A dictionary of the page's data
+        from Page.dump_dict
+
+        :type data: dict
+        """
+        if self.shard_file is None or self.shard_count >= self.shard_size:
+            self.open_shard()
+
+        record = json.dumps(data, separators=(",", ":")).encode() + b"\n"
+        if self.compress:
+            record = gzip.compress(record, mtime=0)
+
+        offset = self.shard_file.tell()
+        self.shard_file.write(record)
+        self.shard_file.flush()
+        self.index_file.write("{}\t{}\t{}\n".format(data['name'],
+                                                    offset,
+                                                    len(record)))
+        self.index_file.flush()
+        self.shard_count += 1
+
+    def close(self):
+        """
+        Flush and close the current shard
+        """
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.index_file.close()
+            self.shard_file = None
+            self.index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def decode_record(shard_path, record):
+    """
+    Decode a page's metadata from its bytes in a shard
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+
+    :param record: The page's bytes
+
+    :type record: bytes
+
+    :return: A dictionary of the page's data
+
+    :rtype: dict
+    """
+    if shard_path.endswith(".gz"):
+        record = gzip.decompress(record)
+
+    return json.loads(record)
+
+
+def iter_metadata_store(store_dir):
+    """
+    Read all the pages of a store shard by shard
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :return: A generator of page metadata dictionaries
+
+    :rtype: generator
+    """
+    for _, data in iter_store_records(store_dir):
+        yield data
+
+
+def iter_store_records(store_dir):
+    """
+    Read all the pages of a store along with where each one
+    is so that it can be read again on its own. Pages are read
+    from where their index says, so a page a crash left out of
+    the index is never paired with another page's location
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :return: A generator of tuples of the shard path, byte offset
+    and length of a page and its metadata dictionary
+
+    :rtype: generator
+    """
+    for shard_path in get_shard_paths(store_dir):
+        with open(shard_path, "rb") as shard_file:
+            for _, offset, length, _ in iter_shard_index(shard_path):
+                shard_file.seek(offset)
+                record = shard_file.read(length)
+                yield ((shard_path, offset, length),
+                       decode_record(shard_path, record))
+
+
+def load_store_index(store_dir):
+    """
+    Load the offset indices of all the shards of a store
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :return: A dictionary of page name to the shard it is in
+    and its byte offset and length there
+
+    :rtype: dict
+    """
+    index = {}
+    for shard_path in get_shard_paths(store_dir):
+        for name, offset, length, _ in iter_shard_index(shard_path):
+            index[name] = (shard_path, offset, length)
+
+    return index
+
+
+def count_store_pages(store_dir):
+    """
+    Count the pages in a store from its indices
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :return: Number of pages
+
+    :rtype: int
+    """
+    count = 0
+    for shard_path in get_shard_paths(store_dir):
+        count += sum(1 for _ in iter_shard_index(shard_path))
+
+    return count
+
+
+def read_store_page(store_dir, name, index=None):
+    """
+    Read a single page's metadata from a store
+
+    :param store_dir: Directory of the metadata store
+
+    :type store_dir: str
+
+    :param name: Name of the page
+
+    :type name: str
+
+    :param index: The store's index from load_store_index
+    to avoid reloading it for every page
+
+    :type index: dict, optional
+
+    :return: A dictionary of the page's data
+
+    :rtype: dict
+    """
+    if index is None:
+        index = load_store_index(store_dir)
+
+    return read_store_record(*index[name])
+
+
+def read_store_record(shard_path, offset, length):
+    """
+    Read a single page's metadata from where it is in a shard
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+
+    :param offset: Byte offset of the page in the shard
+
+    :type offset: int
+
+    :param length: Length of the page in bytes
+
+    :type length: int
+
+    :return: A dictionary of the page's data
+
+    :rtype: dict
+    """
+    with open(shard_path, "rb") as shard_file:
+        shard_file.seek(offset)
+        record = shard_file.read(length)
+
+    return decode_record(shard_path, record)
@@ -1,54 +1,676 @@
 from PIL import Image, ImageDraw
 import numpy as np
 import os
-import concurrent
+import sys
+import json
+import time
+import traceback
+import queue
+import threading
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from tqdm import tqdm
 
 from .page_object_classes import Page
+from .render_cache import (
+    get_cache_stats, summarize_cache_stats, attach_shared_cache
+)
+from .shared_cache import SharedIllustrationCache
+from .metadata_store import (
+    iter_metadata_store, count_store_pages, iter_store_records,
+    read_store_record
+)
+from .render_schedule import (
+    estimate_page_cost, schedule_in_windows, merge_schedule_estimates,
+    measure_tail, report_render_schedule
+)
+from .render_stats import (
+    stage_timer, record_stage, pop_page_timings, RenderStats,
+    report_render_stats
+)
+from .tar_shard_sink import (
+    get_tar_shard_writer, get_completed_pages, remove_incomplete_shards,
+    discard_unfinished_shard
+)
 from .. import config_file as cfg
 
 
 def create_single_page(data):
     """
     This function is used to render a single page from a metadata json file
-    to a target location.
+    or a dictionary of page metadata to a target location.
 
-    :param paths:  a tuple of the page metadata and output path
-    as well as whether or not to save the rendered file i.e. dry run or
-    wet run
+    :param paths:  a tuple of the page metadata, either a dictionary,
+    a JSON filename or where the page is in a metadata store shard,
+    and output path as well as whether or not to save the rendered
+    file i.e. dry run or wet run and optionally the output, either
+    "files" for an image file per page or "tar" for this process's
+    tar shards
 
     :type paths: tuple
+
+    :return: The id of the process that rendered the page,
+    its illustration cache counters, the time spent in each
+    render stage of the page if render timing is enabled and
+    the tar shard the page was written to if any
+
+    :rtype: tuple
     """
     metadata = data[0]
     images_path = data[1]
     dry = data[2]
+    output = data[3] if len(data) > 3 else "files"
 
+    page_started = time.perf_counter()
+    shard = None
     page = Page()
-    page.load_data(metadata)
-    filename = images_path+page.name+cfg.output_format
-    if not os.path.isfile(filename) and not dry:
+    with stage_timer("load_metadata"):
+        if isinstance(metadata, dict):
+            page.load_dict(metadata)
+        elif isinstance(metadata, tuple):
+            page.load_dict(read_store_record(*metadata))
+        else:
+            page.load_data(metadata)
+
+    if output == "tar":
+        if not dry:
+            img = page.render(show=False)
+            writer = get_tar_shard_writer(images_path)
+            with stage_timer("encode_save"):
+                writer.add_page(page.name, img, page.dump_dict())
+            shard = writer.shard_path
+    else:
+        filename = images_path+page.name+cfg.output_format
+        if os.path.isfile(filename):
+            record_stage("skipped", page_started)
+            return os.getpid(), get_cache_stats(), pop_page_timings(), shard
+
+        if not dry:
+            img = page.render(show=False)
+            with stage_timer("encode_save"):
+                img.save(filename)
+
+    record_stage("total", page_started)
+
+    return os.getpid(), get_cache_stats(), pop_page_timings(), shard
+
+
+def create_page_chunk(tasks):
+    """
+    Render a chunk of pages one after the other. A page that
+    fails doesn't stop the rest of the chunk from rendering
+
+    :param tasks: A list of create_single_page arguments
+
+    :type tasks: list
+
+    :return: The results of create_single_page for each page
+    or the traceback of the error if the page failed
+
+    :rtype: list
+    """
+    results = []
+    for task in tasks:
+        try:
+            results.append(create_single_page(task))
+        except Exception:
+            # Don't let the failed page's timings leak into the next
+            pop_page_timings()
+            results.append(traceback.format_exc())
+
+    return results
+
+
+def get_config_values():
+    """
+    Get the settings of the config so that render workers
+    which aren't forked can be given the same ones
+
+    :return: A dictionary of setting name to value
+
+    :rtype: dict
+    """
+    return {
+        name: value
+        for name, value in vars(cfg).items()
+        if not name.startswith("_") and isinstance(
+            value, (bool, int, float, str, tuple, list, dict, type(None)))
+    }
+
+
+def init_render_worker(config_values, shared_cache_args=None):
+    """
+    Set up a render worker process, used as the
+    initializer of the render workers
+
+    :param config_values: Settings of the config to apply
+
+    :type config_values: dict
+
+    :param shared_cache_args: Names of the shared illustration
+    cache's segments and its lock if there is one
+
+    :type shared_cache_args: tuple, optional
+    """
+    for name, value in config_values.items():
+        setattr(cfg, name, value)
+
+    if shared_cache_args is not None:
+        attach_shared_cache(*shared_cache_args)
+
+
+def iter_metadata_files(metadata_dir):
+    """
+    Lazily find the page metadata JSON files in a directory
+
+    :param metadata_dir: Directory of the metadata
+
+    :type metadata_dir: str
+
+    :return: A generator of filenames
+
+    :rtype: generator
+    """
+    with os.scandir(metadata_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json") and entry.is_file():
+                yield entry.name
 
-        img = page.render(show=False)
-        img.save(filename)
 
+def describe_task(task):
+    """
+    Describe which page a create_single_page task renders
+
+    :param task: The create_single_page arguments
+
+    :type task: tuple
+
+    :return: The page's name, JSON filename or where it is in
+    a metadata store shard
+
+    :rtype: str or tuple
+    """
+    metadata = task[0]
+    if isinstance(metadata, dict):
+        return metadata['name']
+    return metadata
+
+
+def write_quarantine(quarantine, images_dir):
+    """
+    Write the pages that failed to render twice and why
+    as JSON lines next to the rendered pages
+
+    :param quarantine: A list of tuples of a create_single_page
+    task and the traceback of its last failure
 
-def render_pages(metadata_dir, images_dir, dry=False):
+    :type quarantine: list
+
+    :param images_dir: The output directory of the rendered pages
+
+    :type images_dir: str
+    """
+    if len(quarantine) == 0:
+        return
+
+    quarantine_path = os.path.join(images_dir, cfg.render_quarantine_file)
+    with open(quarantine_path, "w") as quarantine_file:
+        for task, error in quarantine:
+            quarantine_file.write(json.dumps(
+                dict(page=describe_task(task), error=error)) + "\n")
+
+    print(len(quarantine), "pages failed to render, they are listed in",
+          quarantine_path)
+
+
+def render_pages(metadata_dir, images_dir, dry=False, output="files"):
     """
-    Takes metadata json files and renders page images
+    Takes metadata json files and metadata store shards
+    and renders page images. Pages that fail are retried once
+    and then quarantined instead of stopping the run
 
-    :param metadata_dir: A directory containing all the metadata json files
+    :param metadata_dir: A directory containing all the metadata json
+    files and/or metadata store shards
 
     :type metadata_dir: str
 
     :param images_dir: The output directory for the rendered pages
 
     :type images_dir: str
+
+    :param output: "files" to write an image per page or "tar" to
+    write pages and their metadata into tar shards, skipping pages
+    already in complete shards
+
+    :type output: str, optional
+
+    :return: Summed illustration cache counters of all the workers
+
+    :rtype: dict
     """
+    completed = set()
+    if output == "tar":
+        if not dry:
+            remove_incomplete_shards(images_dir)
+        completed = get_completed_pages(images_dir)
+
+    render_stats = RenderStats() if cfg.render_timing else None
+    quarantine = []
+
+    # Files are found and pages in shards are read as the workers
+    # free up so neither the listing nor the store is ever held
+    # in memory
+    total = sum(1 for _ in iter_metadata_files(metadata_dir))
+    total += count_store_pages(metadata_dir) - len(completed)
+
+    if not cfg.render_cost_scheduling:
+        def get_tasks():
+            for filename in iter_metadata_files(metadata_dir):
+                if filename[:-len(".json")] not in completed:
+                    yield (metadata_dir+filename, images_dir, dry, output)
+                elif render_stats is not None:
+                    render_stats.skip()
+            for data in iter_metadata_store(metadata_dir):
+                if data['name'] not in completed:
+                    yield (data, images_dir, dry, output)
+                elif render_stats is not None:
+                    render_stats.skip()
+
+        worker_stats = render_page_tasks(tqdm(get_tasks(), total=total),
+                                         render_stats=render_stats,
+                                         quarantine=quarantine)
+    else:
+        # Each page's metadata is read to estimate its cost as its
+        # window is planned, pages in shards are handed to the
+        # workers by where they are
+        def get_costed_tasks():
+            for filename in iter_metadata_files(metadata_dir):
+                if filename[:-len(".json")] in completed:
+                    if render_stats is not None:
+                        render_stats.skip()
+                    continue
+                try:
+                    with open(metadata_dir+filename, "rb") as json_file:
+                        cost = estimate_page_cost(json.load(json_file))
+                except ValueError:
+                    # Let the worker fail on it so it's quarantined
+                    cost = cfg.render_cost_weights['page']
+                yield (metadata_dir+filename, images_dir, dry, output), cost
+            for location, data in iter_store_records(metadata_dir):
+                if data['name'] not in completed:
+                    yield ((location, images_dir, dry, output),
+                           estimate_page_cost(data))
+                elif render_stats is not None:
+                    render_stats.skip()
+
+        workers = os.cpu_count() or 1
+        estimates = []
+        finish_times = []
+        chunks = schedule_in_windows(tqdm(get_costed_tasks(), total=total),
+                                     workers, cfg.render_schedule_window,
+                                     estimates)
+        worker_stats = render_page_tasks(
+            chunks=chunks,
+            render_stats=render_stats,
+            finish_times=finish_times,
+            quarantine=quarantine
+        )
+        report_render_schedule(merge_schedule_estimates(estimates, workers),
+                               measure_tail(finish_times, workers))
+
+    write_quarantine(quarantine, images_dir)
+
+    if render_stats is not None:
+        report_render_stats(render_stats)
+
+    return report_cache_stats(worker_stats)
+
+
+def render_page_tasks(tasks=None, max_in_flight=None, render_stats=None,
+                      chunks=None, finish_times=None, quarantine=None):
+    """
+    Render pages in parallel keeping a bounded number of
+    chunks of them waiting to be rendered so that the tasks
+    can be created lazily. Pages that fail are retried once at
+    the end and then quarantined. Pages lost with a crashed worker
+    are retried one at a time so that a page crashing its worker
+    again can't take other pages down with it. If the config gives
+    the shared illustration cache a budget the workers of each pool
+    share one and if it limits the tasks per worker, workers are
+    replaced after rendering that many chunks so their memory
+    can't creep up
+
+    :param tasks: An iterable of create_single_page arguments,
+    each rendered in a chunk of its own
+
+    :type tasks: iterable, optional
+
+    :param max_in_flight: Maximum number of chunks waiting to be
+    rendered, defaults to twice the number of CPUs
+
+    :type max_in_flight: int, optional
+
+    :param render_stats: Collects the render timings of the
+    pages if given
+
+    :type render_stats: RenderStats, optional
+
+    :param chunks: An iterable of lists of create_single_page
+    arguments to hand to a worker together, instead of tasks
+
+    :type chunks: iterable, optional
+
+    :param finish_times: A list to add the time.perf_counter()
+    value each page finished at to
+
+    :type finish_times: list, optional
+
+    :param quarantine: A list to add a tuple of the task and
+    the traceback of each page that failed twice to
+
+    :type quarantine: list, optional
+
+    :return: A dictionary of process id to the illustration cache
+    counters that process reported last
+
+    :rtype: dict
+    """
+    if max_in_flight is None:
+        max_in_flight = 2*(os.cpu_count() or 1)
+
+    # Counters are cumulative per worker so keep the latest of each
+    worker_stats = {}
+    failed = []
+    lost = []
+    # The tar shard each worker is writing and the pages in it,
+    # which are lost if the worker is killed before finishing it
+    open_shards = {}
+    unfinished = []
+
+    def collect(future, chunk):
+        finished = time.perf_counter()
+        try:
+            results = future.result()
+        except Exception:
+            # The worker died, e.g. it crashed or ran out of memory
+            error = traceback.format_exc()
+            lost.extend((task, error) for task in chunk)
+            return
+
+        for task, result in zip(chunk, results):
+            if isinstance(result, str):
+                failed.append((task, result))
+                continue
+            pid, stats, timings, shard = result
+            if shard is not None:
+                # A worker only moves on to a new shard once it
+                # has finished the last one
+                if pid not in open_shards or open_shards[pid][0] != shard:
+                    open_shards[pid] = (shard, [])
+                open_shards[pid][1].append(task)
+            worker_stats[pid] = stats
+            if render_stats is not None:
+                render_stats.add(pid, timings)
+            if finish_times is not None:
+                finish_times.append(finished)
+
+    if chunks is None:
+        chunks = ([task] for task in tasks)
+
+    executor_args = dict(initializer=init_render_worker)
+    max_tasks_per_child = cfg.render_max_tasks_per_child
+    if max_tasks_per_child is not None and sys.version_info < (3, 11):
+        print("Recycling render workers needs Python 3.11 or newer")
+        max_tasks_per_child = None
+    if max_tasks_per_child is not None:
+        # Workers can only be replaced when they aren't forked
+        executor_args['mp_context'] = multiprocessing.get_context("spawn")
+        executor_args['max_tasks_per_child'] = max_tasks_per_child
+    mp_context = executor_args.get('mp_context', multiprocessing)
+    config_values = get_config_values()
+
+    def start_pool():
+        # Each pool gets its own shared cache since a worker killed
+        # along with a crashed one can leave the lock held
+        shared_cache = None
+        shared_cache_args = None
+        if cfg.shared_illustration_cache_bytes > 0:
+            shared_cache = SharedIllustrationCache.create(
+                cfg.shared_illustration_cache_bytes,
+                cfg.shared_illustration_cache_slots,
+                mp_context.Lock()
+            )
+            shared_cache_args = shared_cache.get_attach_args()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            initargs=(config_values, shared_cache_args), **executor_args)
+        return executor, shared_cache
+
+    def stop_pool(executor, shared_cache):
+        executor.shutdown()
+        if shared_cache is not None:
+            shared_cache.close()
+
+        # Workers that exit finish their shards, ones killed with a
+        # broken pool don't so their pages have to be rendered again
+        for shard, tasks in open_shards.values():
+            if discard_unfinished_shard(shard):
+                unfinished.extend(tasks)
+        open_shards.clear()
+
+    def run_and_rerender(chunks, max_in_flight):
+        run(chunks, max_in_flight)
+        while len(unfinished) > 0:
+            print("Rendering", len(unfinished), "pages again that were "
+                  "in tar shards of crashed workers")
+            tasks = list(unfinished)
+            del unfinished[:]
+            run(([task] for task in tasks), max_in_flight)
+
+    def run(chunks, max_in_flight):
+        executor, shared_cache = start_pool()
+        in_flight = {}
+        try:
+            for chunk in chunks:
+                try:
+                    future = executor.submit(create_page_chunk, chunk)
+                except BrokenProcessPool:
+                    # Every page in flight is lost with the pool,
+                    # carry on with a new one
+                    concurrent.futures.wait(in_flight)
+                    for future in list(in_flight):
+                        collect(future, in_flight.pop(future))
+                    stop_pool(executor, shared_cache)
+                    executor, shared_cache = start_pool()
+                    future = executor.submit(create_page_chunk, chunk)
+                in_flight[future] = chunk
+
+                # Wait for a chunk to finish before making more
+                if len(in_flight) >= max_in_flight:
+                    done, _ = concurrent.futures.wait(
+                        in_flight,
+                        return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        collect(future, in_flight.pop(future))
+
+            for future in concurrent.futures.as_completed(list(in_flight)):
+                collect(future, in_flight.pop(future))
+        finally:
+            stop_pool(executor, shared_cache)
+
+    run_and_rerender(chunks, max_in_flight)
+
+    if len(failed) + len(lost) > 0:
+        print("Retrying", len(failed) + len(lost),
+              "pages that failed to render")
+        retries = list(failed)
+        del failed[:]
+        run_and_rerender(([task] for task, _ in retries), max_in_flight)
+
+        # Pages lost with a crashed worker, here or in the retries,
+        # are rendered alone so if one crashes its worker again it
+        # is the only page lost
+        crashed = list(lost)
+        del lost[:]
+        run_and_rerender(([task] for task, _ in crashed), 1)
+        failed.extend(lost)
+
+    if quarantine is not None:
+        quarantine.extend(failed)
+
+    return worker_stats
+
+
+def report_cache_stats(worker_stats):
+    """
+    Print and return the summed illustration cache counters
+    of the render workers
+
+    :param worker_stats: A dictionary of process id to the
+    counters that process reported last
+
+    :type worker_stats: dict
+
+    :return: Summed illustration cache counters
+
+    :rtype: dict
+    """
+    cache_summary = summarize_cache_stats(worker_stats)
+    print("Illustration cache: {hits} hits, {misses} misses, "
+          "{evictions} evictions ({hit_rate:.1%} hit rate) "
+          "across {workers} workers".format(**cache_summary))
+
+    return cache_summary
+
+
+def write_page_metadata(metadata_queue, metadata_dir, errors, store=None):
+    """
+    Write page metadata dictionaries from a queue to JSON files
+    until a None is received. Runs in a thread so that writing
+    doesn't hold up generating or rendering pages
+
+    :param metadata_queue: Queue of page metadata dictionaries
+
+    :type metadata_queue: queue.Queue
+
+    :param metadata_dir: Where to dump the JSON files
+
+    :type metadata_dir: str
+
+    :param errors: A list to put any write errors in since
+    they can't be raised across threads
+
+    :type errors: list
+
+    :param store: A metadata store to append the pages to
+    instead of writing JSON files
+
+    :type store: MetadataStore, optional
+    """
+    while True:
+        data = metadata_queue.get()
+        if data is None:
+            break
+        try:
+            if store is not None:
+                store.append(data)
+            else:
+                with open(metadata_dir+data['name']+".json",
+                          "w+") as json_file:
+                    json.dump(data, json_file, indent=2)
+        except Exception as e:
+            # Keep draining the queue so putting pages on it
+            # can't block forever
+            errors.append(e)
+
+
+def stream_render_pages(pages, metadata_dir, images_dir, dry=False,
+                        max_in_flight=None, store=None, output="files"):
+    """
+    Renders pages as they are created rather than after all their
+    metadata has been dumped. Page metadata is handed straight to the
+    render workers and a bounded number of pages are in flight at once
+    so that creating pages can't run ahead of rendering them.
+    The metadata is still written to JSON files by a background thread.
+    Pages that fail are retried once and then quarantined.
+
+    :param pages: An iterable of Page objects e.g. a generator
+    creating them one by one
+
+    :type pages: iterable
+
+    :param metadata_dir: Where to dump the metadata JSON files
+
+    :type metadata_dir: str
+
+    :param images_dir: The output directory for the rendered pages
+
+    :type images_dir: str
+
+    :param dry: Whether to skip writing metadata and images
+
+    :type dry: bool, optional
+
+    :param max_in_flight: Maximum number of pages waiting to be
+    rendered, defaults to twice the number of CPUs
+
+    :type max_in_flight: int, optional
+
+    :param store: A metadata store to append the pages to
+    instead of writing JSON files
+
+    :type store: MetadataStore, optional
+
+    :param output: "files" to write an image per page or "tar" to
+    write pages and their metadata into tar shards
+
+    :type output: str, optional
+
+    :return: Summed illustration cache counters of all the workers
+
+    :rtype: dict
+    """
+    if output == "tar" and not dry:
+        remove_incomplete_shards(images_dir)
+
+    if max_in_flight is None:
+        max_in_flight = 2*(os.cpu_count() or 1)
+
+    metadata_queue = queue.Queue(maxsize=max_in_flight)
+    write_errors = []
+    writer = threading.Thread(target=write_page_metadata,
+                              args=(metadata_queue,
+                                    metadata_dir,
+                                    write_errors,
+                                    store),
+                              daemon=True)
+    writer.start()
+
+    def get_tasks():
+        for page in pages:
+            data = page.dump_dict()
+            if not dry:
+                metadata_queue.put(data)
+            yield (data, images_dir, dry, output)
+
+    render_stats = RenderStats() if cfg.render_timing else None
+    quarantine = []
+    try:
+        worker_stats = render_page_tasks(get_tasks(),
+                                         max_in_flight,
+                                         render_stats,
+                                         quarantine=quarantine)
+    finally:
+        metadata_queue.put(None)
+        writer.join()
+
+    if len(write_errors) > 0:
+        raise write_errors[0]
+
+    write_quarantine(quarantine, images_dir)
 
-    filenames = [(metadata_dir+filename, images_dir, dry)
-                 for filename in os.listdir(metadata_dir)
-                 if filename.endswith(".json")]
+    if render_stats is not None:
+        report_render_stats(render_stats)
 
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        results = list(tqdm(executor.map(create_single_page, filenames),
-                            total=len(filenames)))
+    return report_cache_stats(worker_stats)
@@ -2,13 +2,14 @@ import numpy as np
 import math
 import time
 from copy import deepcopy
-import random
 from PIL import Image, ImageDraw, ImageFont
 import pyclipper
 import json
 import uuid
 import preprocesing.config_file as cfg
 import os
+import concurrent.futures
+from tqdm import tqdm
 
 from .page_object_classes import Panel, Page, SpeechBubble
 from .helpers import (
@@ -17,11 +18,12 @@ from .helpers import (
                       find_parent_with_multiple_children,
                       move_children_to_line
                       )
+from ..illustration_catalog import IllustrationCatalog
 from .. import config_file as cfg
 
 
 # Creation helpers
-def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
+def draw_n_shifted(n, parent, horizontal_vertical, shifts=[], rng=np.random):
     """
     A function to take a parent Panel and divide it into n
     sub-panel's vertically or horizontally with each panels having
@@ -45,6 +47,11 @@ def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
     :param shifts: Ratios to divide the panel into sub-panels
 
     :type shifts: list
+
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
     """
 
     # if input out of bounds i.e. 1:
@@ -70,7 +77,7 @@ def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
         shifts = []
         for i in range(0, n):
             # Randomly select a size for the new panel's side
-            shift_choice = np.random.randint(choice_min, choice_max)
+            shift_choice = rng.randint(choice_min, choice_max)
             # Change the maximum range acoording to available length
             # of the parent panel's size
             choice_max = choice_max + ((100/n) - shift_choice)
@@ -343,7 +350,7 @@ def draw_n(n, parent, horizontal_vertical):
             parent.add_child(poly)
 
 
-def draw_two_shifted(parent, horizontal_vertical, shift=None):
+def draw_two_shifted(parent, horizontal_vertical, shift=None, rng=np.random):
     """
     Draw two subpanels of a parent panel
 
@@ -359,6 +366,11 @@ def draw_two_shifted(parent, horizontal_vertical, shift=None):
     :param shift: by what ratio should the 2 panels be split, defaults to None
 
     :type shift: float, optional
+
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
     """
 
     # Specify parent panel dimensions
@@ -371,7 +383,7 @@ def draw_two_shifted(parent, horizontal_vertical, shift=None):
     if shift is None:
         shift_min = 25
         shift_max = 75
-        shift = np.random.randint(shift_min, shift_max)
+        shift = rng.randint(shift_min, shift_max)
         shift = shift/100
 
     # If panel is horizontal
@@ -455,7 +467,8 @@ def single_slice_panels(page,
                         horizontal_vertical=None,
                         type_choice=None,
                         skew_side=None,
-                        number_to_slice=0
+                        number_to_slice=0,
+                        rng=np.random
                         ):
     """Slices a panel once at an angle into two new panels
 
@@ -482,6 +495,11 @@ def single_slice_panels(page,
 
     :type number_to_slice: int
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: page with sliced panels
 
     :rtype: Page
@@ -498,11 +516,11 @@ def single_slice_panels(page,
         relevant_panels = [page]
 
     # Shuffle panels for randomness
-    random.shuffle(relevant_panels)
+    rng.shuffle(relevant_panels)
 
     # single slice close
     if type_choice is None:
-        type_choice_prob = np.random.random()
+        type_choice_prob = rng.random()
         if type_choice_prob < cfg.center_side_ratio:
             type_choice = "center"
         else:
@@ -517,7 +535,7 @@ def single_slice_panels(page,
 
         if number_to_slice == 0:
             if len(relevant_panels) > 1:
-                number_to_slice = np.random.randint(1, len(relevant_panels))
+                number_to_slice = rng.randint(1, len(relevant_panels))
             else:
                 number_to_slice = 1
 
@@ -527,7 +545,7 @@ def single_slice_panels(page,
 
             # Decide which direction to cut in
             if horizontal_vertical is None:
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
 
             # Get center line
             # Vertical slice
@@ -539,10 +557,10 @@ def single_slice_panels(page,
 
                 # Skew it left or right
                 if skew_side is None:
-                    skew_side = np.random.choice(["left", "right"])
+                    skew_side = rng.choice(["left", "right"])
 
                 # Skew it by a percentage
-                skew_amount = np.random.randint(20, 100)/100
+                skew_amount = rng.randint(20, 100)/100
                 skew_amount = skew_amount*panel_chosen_coord_length
 
                 # Perform transform
@@ -586,10 +604,10 @@ def single_slice_panels(page,
 
                 # Skew it left or right
                 if skew_side is None:
-                    skew_side = np.random.choice(["down", "up"])
+                    skew_side = rng.choice(["down", "up"])
 
                 # Skew it by a percentage
-                skew_amount = np.random.randint(20, 100)/100
+                skew_amount = rng.randint(20, 100)/100
                 skew_amount = skew_amount*panel_chosen_coord_length
 
                 p1 = panel.get_child(0)
@@ -628,14 +646,14 @@ def single_slice_panels(page,
 
         if number_to_slice == 0:
             if len(relevant_panels) > 1:
-                number_to_slice = np.random.choice([1, 3])
+                number_to_slice = rng.choice([1, 3])
             else:
                 number_to_slice = 1
 
         for panel in relevant_panels[0:number_to_slice]:
 
             if skew_side is None:
-                skew_side = np.random.choice(["tr", "tl", "br", "bl"])
+                skew_side = rng.choice(["tr", "tl", "br", "bl"])
 
             draw_n(2, panel, "h")
             num_panels_added += 1
@@ -650,8 +668,8 @@ def single_slice_panels(page,
             p1.sliced = True
             p2.sliced = True
 
-            cut_y_proportion = np.random.randint(25, 75)/100
-            cut_x_proportion = np.random.randint(25, 75)/100
+            cut_y_proportion = rng.randint(25, 75)/100
+            cut_x_proportion = rng.randint(25, 75)/100
 
             cut_y_length = (panel.x4y4[1] - panel.x1y1[1])*cut_y_proportion
             cut_x_length = (panel.x3y3[0] - panel.x4y4[0])*cut_x_proportion
@@ -714,7 +732,7 @@ def single_slice_panels(page,
     return page
 
 
-def box_transform_panels(page, type_choice=None, pattern=None):
+def box_transform_panels(page, type_choice=None, pattern=None, rng=np.random):
     """
     This function move panel boundaries to transform them
     into trapezoids and rhombuses
@@ -734,13 +752,18 @@ def box_transform_panels(page, type_choice=None, pattern=None):
 
     :type pattern: str, optional
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Transformed Page
 
     :rtype: Page
     """
 
     if type_choice is None:
-        type_choice_prob = np.random.random()
+        type_choice_prob = rng.random()
         if type_choice_prob < cfg.panel_box_trapezoid_ratio:
             type_choice = "trapezoid"
         else:
@@ -754,7 +777,7 @@ def box_transform_panels(page, type_choice=None, pattern=None):
 
             if len(relevant_panels) > 0:
                 if len(relevant_panels) > 1:
-                    num_panels = np.random.randint(1, len(relevant_panels))
+                    num_panels = rng.randint(1, len(relevant_panels))
                 else:
                     num_panels = 1
 
@@ -782,11 +805,11 @@ def box_transform_panels(page, type_choice=None, pattern=None):
 
                     # Choose trapezoid pattern
                     if pattern is None:
-                        trapezoid_pattern = np.random.choice(["A", "V"])
+                        trapezoid_pattern = rng.choice(["A", "V"])
                     else:
                         trapezoid_pattern = pattern
 
-                    movement_proportion = np.random.randint(
+                    movement_proportion = rng.randint(
                                             10,
                                             cfg.trapezoid_movement_limit)
 
@@ -958,7 +981,7 @@ def box_transform_panels(page, type_choice=None, pattern=None):
             if len(relevant_panels) > 0:
 
                 if len(relevant_panels) > 1:
-                    num_panels = np.random.randint(1, len(relevant_panels))
+                    num_panels = rng.randint(1, len(relevant_panels))
                 else:
                     num_panels = 1
 
@@ -984,11 +1007,11 @@ def box_transform_panels(page, type_choice=None, pattern=None):
                             min_height = child.height
 
                     if pattern is None:
-                        rhombus_pattern = np.random.choice(["left", "right"])
+                        rhombus_pattern = rng.choice(["left", "right"])
                     else:
                         rhombus_pattern = pattern
 
-                    movement_proportion = np.random.randint(
+                    movement_proportion = rng.randint(
                                             10,
                                             cfg.rhombus_movement_limit
                                             )
@@ -1133,7 +1156,7 @@ def box_transform_panels(page, type_choice=None, pattern=None):
     return page
 
 
-def box_transform_page(page, direction_list=[]):
+def box_transform_page(page, direction_list=[], rng=np.random):
     """
     This function takes all the first child panels of a page
     and moves them to form a zigzag or a rhombus pattern
@@ -1145,6 +1168,11 @@ def box_transform_page(page, direction_list=[]):
     :param direction_list: A list of directions the page
     should move it's child panel's corner's to
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Transformed page
 
     :rtype: Page
@@ -1159,7 +1187,7 @@ def box_transform_page(page, direction_list=[]):
             p1 = page.get_child(idx)
             p2 = page.get_child(idx+1)
 
-            change_proportion = np.random.randint(
+            change_proportion = rng.randint(
                                     10,
                                     cfg.full_page_movement_proportion_limit
                                     )
@@ -1168,7 +1196,7 @@ def box_transform_page(page, direction_list=[]):
 
             # Randomly move the line between them up or down one side
             if len(direction_list) < 1:
-                direction = np.random.choice(["rup", "lup"])
+                direction = rng.choice(["rup", "lup"])
             else:
                 direction = direction_list[idx]
 
@@ -1265,7 +1293,7 @@ def box_transform_page(page, direction_list=[]):
     return page
 
 
-def add_transforms(page):
+def add_transforms(page, rng=np.random):
     """Adds panel boundary transformations
     to the page
 
@@ -1273,6 +1301,11 @@ def add_transforms(page):
 
     :type page: Page
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Page with transformed panels
 
     :rtype: Page
@@ -1285,18 +1318,18 @@ def add_transforms(page):
     # Slicing panels into multiple panels
     # Works best with large panels
     if "slice" in transform_choice:
-        page = single_slice_panels(page)
+        page = single_slice_panels(page, rng=rng)
 
         # Makes v cuts happen more often 1/4 chance
-        if np.random.random() < cfg.double_slice_chance:
-            page = single_slice_panels(page)
+        if rng.random() < cfg.double_slice_chance:
+            page = single_slice_panels(page, rng=rng)
 
     if "box" in transform_choice:
 
-        if np.random.random() < cfg.box_transform_panel_chance:
-            page = box_transform_panels(page)
+        if rng.random() < cfg.box_transform_panel_chance:
+            page = box_transform_panels(page, rng=rng)
 
-        page = box_transform_page(page)
+        page = box_transform_page(page, rng=rng)
 
     return page
 
@@ -1355,7 +1388,7 @@ def shrink_panels(page):
     return page
 
 
-def remove_panel(page):
+def remove_panel(page, rng=np.random):
     """
     This function randomly removes
     a panel from pages which have
@@ -1365,6 +1398,11 @@ def remove_panel(page):
 
     :type page: Page
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Page with panels removed
 
     :rtype: Page
@@ -1375,7 +1413,7 @@ def remove_panel(page):
     if page.num_panels > cfg.panel_removal_max + 1:
 
         # Remove 1 to n panels
-        remove_number = np.random.choice([1, cfg.panel_removal_max])
+        remove_number = rng.choice([1, cfg.panel_removal_max])
 
         # Remove panel
         for i in range(remove_number):
@@ -1384,7 +1422,7 @@ def remove_panel(page):
     return page
 
 
-def add_background(page, image_dir, image_dir_path):
+def add_background(page, image_dir, image_dir_path, rng=np.random):
     """
     Add a background image to the page
 
@@ -1401,18 +1439,97 @@ def add_background(page, image_dir, image_dir_path):
 
     :type image_dir_path: str
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Page with background
 
     :rtype: Page
     """
 
     image_dir_len = len(image_dir)
-    idx = np.random.randint(0, image_dir_len)
+    idx = rng.randint(0, image_dir_len)
     page.background = image_dir_path + image_dir[idx]
 
     return page
 
 
+def build_speech_bubble_catalog(speech_bubble_files,
+                                speech_bubble_tags,
+                                bubble_manifest=None):
+    """
+    Parse the writing areas and read the size of every speech bubble
+    template once so that creating panels only needs a dictionary
+    lookup per bubble. Templates that can't be read are reported
+    and left out
+
+    :param speech_bubble_files: list of base speech bubble
+    template files
+
+    :type speech_bubble_files: list
+
+    :param speech_bubble_tags: a dataframe of speech bubble
+    writing area labels by imagename
+
+    :type speech_bubble_tags: pandas.DataFrame
+
+    :param bubble_manifest: A speech bubble manifest to take the
+    sizes of the templates from instead of opening them
+
+    :type bubble_manifest: dict, optional
+
+    :return: A dictionary of speech bubble file to a tuple of
+    its writing areas and its width and height
+
+    :rtype: dict
+    """
+    default_area = [{"points": [[10, 10], [90, 10], [90, 90], [10, 90]],
+                     "shape_type": "polygon"}]
+
+    # Index the labels by full name and by filename, keeping the
+    # first row of each like a boolean mask lookup would
+    labels = {}
+    labels_by_filename = {}
+    if 'imagename' in speech_bubble_tags:
+        for imagename, label in zip(speech_bubble_tags['imagename'],
+                                    speech_bubble_tags['label']):
+            labels.setdefault(imagename, label)
+            labels_by_filename.setdefault(os.path.basename(imagename), label)
+
+    catalog = {}
+    for speech_bubble_file in speech_bubble_files:
+        label = labels.get(speech_bubble_file)
+        if label is None:
+            label = labels_by_filename.get(
+                os.path.basename(speech_bubble_file))
+
+        if label is None:
+            writing_areas = default_area
+        else:
+            try:
+                writing_areas = json.loads(label)
+            except (TypeError, ValueError):
+                writing_areas = default_area
+
+        if bubble_manifest and speech_bubble_file in bubble_manifest:
+            size = tuple(bubble_manifest[speech_bubble_file]['size'])
+        else:
+            # Only the header is read to get the size
+            try:
+                with Image.open(speech_bubble_file) as speech_bubble_img:
+                    size = speech_bubble_img.size
+            except (OSError, Image.UnidentifiedImageError) as e:
+                print("Skipping unreadable speech bubble",
+                      speech_bubble_file, "({})".format(e))
+                continue
+
+        catalog[speech_bubble_file] = (writing_areas, size)
+
+    return catalog
+
+
 # Page creators
 def create_single_panel_metadata(panel,
                                  image_dir,
@@ -1421,7 +1538,8 @@ def create_single_panel_metadata(panel,
                                  text_dataset,
                                  speech_bubble_files,
                                  speech_bubble_tags,
-                                 minimum_speech_bubbles=0
+                                 minimum_speech_bubbles=0,
+                                 rng=np.random
                                  ):
     """
     This is a helper function that populates a single panel with
@@ -1432,8 +1550,9 @@ def create_single_panel_metadata(panel,
     :type panel: Panel
 
     :param image_dir: List of images to pick from
+    or an illustration catalog
 
-    :type image_dir: list
+    :type image_dir: list or IllustrationCatalog
 
     :param image_dir_path: Path of images dir to add to
     panels
@@ -1455,21 +1574,33 @@ def create_single_panel_metadata(panel,
 
     :type speech_bubble_files: list
 
-    :param speech_bubble_tags: a list of speech bubble
+    :param speech_bubble_tags: a speech bubble catalog from
+    build_speech_bubble_catalog or a dataframe of speech bubble
     writing area tags by filename
 
-    :type speech_bubble_tags: list
+    :type speech_bubble_tags: dict or pandas.DataFrame
 
     :param minimum_speech_bubbles: Set whether panels
     have a minimum number of speech bubbles, defaults to 0
 
     :type  minimum_speech_bubbles: int
+
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
     """
 
     # Image to be used inside panel
-    image_dir_len = len(image_dir)
-    select_image_idx = np.random.randint(0, image_dir_len)
-    select_image = image_dir[select_image_idx]
+    use_aspect = (cfg.illustration_aspect_matching
+                  and isinstance(image_dir, IllustrationCatalog))
+    if use_aspect and panel.height > 0:
+        select_image = image_dir.choose_by_aspect(panel.width/panel.height,
+                                                  rng=rng)
+    else:
+        image_dir_len = len(image_dir)
+        select_image_idx = rng.randint(0, image_dir_len)
+        select_image = image_dir[select_image_idx]
     panel.image = image_dir_path+select_image
 
     # SPEECH_BUBBLE_SETTINGS에서 말풍선 수 가져오기
@@ -1477,7 +1608,7 @@ def create_single_panel_metadata(panel,
     max_bubbles = cfg.SPEECH_BUBBLE_SETTINGS.get("max_per_panel", cfg.SPEECH_BUBBLE_SETTINGS["max_per_panel"])
     
     # 말풍선 개수 결정 (min_bubbles ~ max_bubbles)
-    num_speech_bubbles = np.random.randint(min_bubbles, max_bubbles + 1)
+    num_speech_bubbles = rng.randint(min_bubbles, max_bubbles + 1)
 
     # Get lengths of datasets
     text_dataset_len = len(text_dataset)
@@ -1496,39 +1627,27 @@ def create_single_panel_metadata(panel,
     for speech_bubble in range(num_speech_bubbles):
 
         # # Select a font
-        # font_idx = np.random.randint(0, font_dataset_len)
+        # font_idx = rng.randint(0, font_dataset_len)
         # font = font_files[font_idx]
 
         # Select a speech bubble and get it's writing areas
-        speech_bubble_file_idx = np.random.randint(
+        speech_bubble_file_idx = rng.randint(
                                     0,
                                     speech_bubble_dataset_len
                                     )
 
         speech_bubble_file = speech_bubble_files[speech_bubble_file_idx]
 
-        # speech_bubble_tags에서 imagename이 정확히 일치하는 항목 찾기
-        if 'imagename' in speech_bubble_tags:
-            # 완전히 일치하는 이름 찾기
-            area_idx = speech_bubble_tags['imagename'] == speech_bubble_file
-            # 일치하는 항목이 없으면 파일명만 비교
-            if not any(area_idx):
-                speech_bubble_filename = os.path.basename(speech_bubble_file)
-                area_idx = speech_bubble_tags['imagename'].apply(lambda x: os.path.basename(x) == speech_bubble_filename)
-            
-            if any(area_idx):
-                speech_bubble_writing_area = speech_bubble_tags[area_idx]['label'].values[0]
-                try:
-                    speech_bubble_writing_area = json.loads(speech_bubble_writing_area)
-                except:
-                    # 기본 영역 사용
-                    speech_bubble_writing_area = [{"points": [[10, 10], [90, 10], [90, 90], [10, 90]], "shape_type": "polygon"}]
-            else:
-                # 일치하는 태그가 없음 - 기본 영역 사용
-                speech_bubble_writing_area = [{"points": [[10, 10], [90, 10], [90, 90], [10, 90]], "shape_type": "polygon"}]
+        if isinstance(speech_bubble_tags, dict):
+            writing_areas, (w, h) = speech_bubble_tags[speech_bubble_file]
         else:
-            # speech_bubble_tags에 imagename 열이 없는 경우 기본 영역 사용
-            speech_bubble_writing_area = [{"points": [[10, 10], [90, 10], [90, 90], [10, 90]], "shape_type": "polygon"}]
+            catalog = build_speech_bubble_catalog([speech_bubble_file],
+                                                  speech_bubble_tags)
+            writing_areas, (w, h) = catalog[speech_bubble_file]
+
+        # Bubbles edit their writing areas when rendered so they
+        # can't share the catalog's
+        speech_bubble_writing_area = deepcopy(writing_areas)
 
         # # Select text for writing areas
         texts = []
@@ -1540,19 +1659,19 @@ def create_single_panel_metadata(panel,
                 texts.append(dummy_text)
             else:
                 # 실제 텍스트 사용
-                text_idx = np.random.randint(0, text_dataset_len)
+                text_idx = rng.randint(0, text_dataset_len)
                 text_indices.append(text_idx)
                 text = text_dataset.iloc[text_idx].to_dict()
                 texts.append(text)
 
         # resize bubble to < 40% of panel area
         max_area = panel.area*cfg.bubble_to_panel_area_max_ratio
-        new_area = np.random.random()*(max_area - max_area*0.375)
+        new_area = rng.random()*(max_area - max_area*0.375)
         new_area = max_area - new_area
 
         # Select location of bubble in panel
-        width_m = np.random.random()
-        height_m = np.random.random()
+        width_m = rng.random()
+        height_m = rng.random()
 
         xy = np.array(panel.coords)
         min_coord = np.min(xy[xy[:, 0] == np.min(xy[:, 0])], 0)
@@ -1565,9 +1684,6 @@ def create_single_panel_metadata(panel,
             y_choice
         ]
 
-        speech_bubble_img = Image.open(speech_bubble_file)
-        w, h = speech_bubble_img.size
-        
         # font 변수가 정의되지 않았으므로 빈 문자열로 설정
         font = ""
         
@@ -1582,6 +1698,7 @@ def create_single_panel_metadata(panel,
                                        location=location,
                                        width=w,
                                        height=h,
+                                       rng=rng,
                                        )
             panel.speech_bubbles.append(speech_bubble)
         except Exception as e:
@@ -1595,7 +1712,8 @@ def populate_panels(page,
                     text_dataset,
                     speech_bubble_files,
                     speech_bubble_tags,
-                    minimum_speech_bubbles=0
+                    minimum_speech_bubbles=0,
+                    rng=np.random
                     ):
     """
     This function takes all the panels and adds backgorund images
@@ -1606,8 +1724,9 @@ def populate_panels(page,
     :type page: Page
 
     :param image_dir: List of images to pick from
+    or an illustration catalog
 
-    :type image_dir: list
+    :type image_dir: list or IllustrationCatalog
 
     :param image_dir_path: Path of images dir to add to
     panels
@@ -1629,16 +1748,22 @@ def populate_panels(page,
 
     :type speech_bubble_files: list
 
-    :param speech_bubble_tags: a list of speech bubble
+    :param speech_bubble_tags: a speech bubble catalog from
+    build_speech_bubble_catalog or a dataframe of speech bubble
     writing area tags by filename
 
-    :type speech_bubble_tags: list
+    :type speech_bubble_tags: dict or pandas.DataFrame
 
     :param minimum_speech_bubbles: Set whether panels
     have a minimum number of speech bubbles, defaults to 0
 
     :type  minimum_speech_bubbles: int
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: Page with populated panels
 
     :rtype: Page
@@ -1653,7 +1778,8 @@ def populate_panels(page,
                                          text_dataset,
                                          speech_bubble_files,
                                          speech_bubble_tags,
-                                         minimum_speech_bubbles
+                                         minimum_speech_bubbles,
+                                         rng=rng
                                          )
     else:
         create_single_panel_metadata(page,
@@ -1663,7 +1789,8 @@ def populate_panels(page,
                                      text_dataset,
                                      speech_bubble_files,
                                      speech_bubble_tags,
-                                     minimum_speech_bubbles
+                                     minimum_speech_bubbles,
+                                     rng=rng
                                      )
     return page
 
@@ -1671,7 +1798,8 @@ def populate_panels(page,
 def get_base_panels(num_panels=0,
                     layout_type=None,
                     type_choice=None,
-                    page_name=None):
+                    page_name=None,
+                    rng=np.random):
     """
     This function creates the base panels for one page
     it specifies how a page should be layed out and
@@ -1696,6 +1824,11 @@ def get_base_panels(num_panels=0,
 
     :type page_name: str, optional
 
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
     :return: A Page object with the panels initalized
 
     :rtype: Page
@@ -1716,7 +1849,7 @@ def get_base_panels(num_panels=0,
     ]
 
     if layout_type is None:
-        layout_type = np.random.choice(["v", "h", "vh"])
+        layout_type = rng.choice(["v", "h", "vh"])
 
     # Panels encapsulated and returned within page
     if page_name is None:
@@ -1728,30 +1861,30 @@ def get_base_panels(num_panels=0,
     if layout_type == "v":
         max_num_panels = 4
         if num_panels < 1:
-            num_panels = np.random.choice([3, 4])
+            num_panels = rng.choice([3, 4])
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
 
-        draw_n_shifted(num_panels, page, "v")
+        draw_n_shifted(num_panels, page, "v", rng=rng)
 
     # If you want only horizontal panels
     elif layout_type == "h":
         max_num_panels = 5
         if num_panels < 1:
-            num_panels = np.random.randint(3, max_num_panels+1)
+            num_panels = rng.randint(3, max_num_panels+1)
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
 
-        draw_n_shifted(num_panels, page, "h")
+        draw_n_shifted(num_panels, page, "h", rng=rng)
 
     # If you want both horizontal and vertical panels
     elif layout_type == "vh":
 
         max_num_panels = 8
         if num_panels < 1:
-            num_panels = np.random.randint(2, max_num_panels+1)
+            num_panels = rng.randint(2, max_num_panels+1)
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
@@ -1760,124 +1893,124 @@ def get_base_panels(num_panels=0,
         if num_panels == 2:
             # Draw 2 rectangles
             # vertically or horizontally
-            horizontal_vertical = np.random.choice(["h", "v"])
-            draw_two_shifted(page, horizontal_vertical)
+            horizontal_vertical = rng.choice(["h", "v"])
+            draw_two_shifted(page, horizontal_vertical, rng=rng)
 
         if num_panels == 3:
             # Draw 2 rectangles
             # Vertically or Horizontally
 
-            horizontal_vertical = np.random.choice(["h", "v"])
-            draw_two_shifted(page, horizontal_vertical)
+            horizontal_vertical = rng.choice(["h", "v"])
+            draw_two_shifted(page, horizontal_vertical, rng=rng)
 
             next_div = invert_for_next(horizontal_vertical)
 
             # Pick one and divide it into 2 rectangles
-            choice_idx = choose(page)
+            choice_idx = choose(page, rng=rng)
             choice = page.get_child(choice_idx)
 
-            draw_two_shifted(choice, next_div)
+            draw_two_shifted(choice, next_div, rng=rng)
 
         if num_panels == 4:
-            horizontal_vertical = np.random.choice(["h", "v"])
+            horizontal_vertical = rng.choice(["h", "v"])
 
             # Possible layouts with 4 panels
             if type_choice is None:
-                type_choice = np.random.choice(["eq", "uneq", "div",
-                                                "trip", "twoonethree"])
+                type_choice = rng.choice(["eq", "uneq", "div",
+                                          "trip", "twoonethree"])
 
             # Draw two rectangles
             if type_choice == "eq":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide each into 2 rectangles equally
                 shift_min = 25
                 shift_max = 75
-                shift = np.random.randint(shift_min, shift_max)
+                shift = rng.randint(shift_min, shift_max)
                 shift = shift/100
 
-                draw_two_shifted(page.get_child(0), next_div, shift)
-                draw_two_shifted(page.get_child(1), next_div, shift)
+                draw_two_shifted(page.get_child(0), next_div, shift, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, shift, rng=rng)
 
             # Draw two rectangles
             elif type_choice == "uneq":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide each into 2 rectangles unequally
-                draw_two_shifted(page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_two_shifted(page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
             elif type_choice == "div":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick one and divide into 2 rectangles
-                choice1_idx = choose(page)
+                choice1_idx = choose(page, rng=rng)
                 choice1 = page.get_child(choice1_idx)
 
-                draw_two_shifted(choice1, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
 
                 # Pick one of these two and divide that into 2 rectangles
-                choice2_idx = choose(choice1)
+                choice2_idx = choose(choice1, rng=rng)
                 choice2 = choice1.get_child(choice2_idx)
 
                 next_div = invert_for_next(next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
             # Draw three rectangles
             elif type_choice == "trip":
                 draw_n(3, page, horizontal_vertical)
 
                 # Pick one and divide it into two
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
             # Draw two rectangles
             elif type_choice == "twoonethree":
 
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
 
                 # Pick one and divide it into 3 rectangles
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_n_shifted(3, choice, next_div)
+                draw_n_shifted(3, choice, next_div, rng=rng)
 
         if num_panels == 5:
 
             # Draw two rectangles
-            horizontal_vertical = np.random.choice(["h", "v"])
+            horizontal_vertical = rng.choice(["h", "v"])
 
             # Possible layouts with 5 panels
             if type_choice is None:
-                type_choice = np.random.choice(["eq", "uneq", "div",
-                                                "twotwothree", "threetwotwo",
-                                                "fourtwoone"])
+                type_choice = rng.choice(["eq", "uneq", "div",
+                                          "twotwothree", "threetwotwo",
+                                          "fourtwoone"])
 
             if type_choice == "eq" or type_choice == "uneq":
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick one and divide it into two then
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
                 # Divide each into 2 rectangles equally
                 if type_choice == "eq":
                     shift_min = 25
                     shift_max = 75
-                    shift = np.random.randint(shift_min, shift_max)
+                    shift = rng.randint(shift_min, shift_max)
                     set_shift = shift/100
                 else:
                     # Divide each into 2 rectangles unequally
@@ -1886,25 +2019,28 @@ def get_base_panels(num_panels=0,
                 next_div = invert_for_next(next_div)
                 draw_two_shifted(choice.get_child(0),
                                  next_div,
-                                 shift=set_shift)
+                                 shift=set_shift,
+                                 rng=rng)
 
                 draw_two_shifted(choice.get_child(1),
                                  next_div,
-                                 shift=set_shift)
+                                 shift=set_shift,
+                                 rng=rng)
 
             # Draw two rectangles
             elif type_choice == "div":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide both equally
-                draw_two_shifted(page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_two_shifted(page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
                 # Pick one of all of them and divide into two
-                page_child_chosen = np.random.choice(page.children)
+                page_child_chosen = rng.choice(page.children)
                 choice_idx, left_choices = choose_and_return_other(
-                                                    page_child_chosen
+                                                    page_child_chosen,
+                                                    rng=rng
                                                     )
 
                 choice = page_child_chosen.get_child(choice_idx)
@@ -1912,23 +2048,25 @@ def get_base_panels(num_panels=0,
                 next_div = invert_for_next(next_div)
                 draw_two_shifted(choice,
                                  horizontal_vertical=next_div,
-                                 shift=0.5
+                                 shift=0.5,
+                                 rng=rng
                                  )
 
             # Draw two rectangles
             elif type_choice == "twotwothree":
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick which one gets 2 and which gets 3
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 # Divide one into 2
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
                 # Divide other into 3
                 draw_n(3, other, next_div)
@@ -1939,42 +2077,43 @@ def get_base_panels(num_panels=0,
                 draw_n(3, page, horizontal_vertical)
                 next_div = invert_for_next(horizontal_vertical)
 
-                choice1_idx, left_choices = choose_and_return_other(page)
-                choice2_idx = np.random.choice(left_choices)
+                choice1_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
+                choice2_idx = rng.choice(left_choices)
                 choice1 = page.get_child(choice1_idx)
                 choice2 = page.get_child(choice2_idx)
 
                 # Pick two and divide each into two
-                draw_two_shifted(choice1, next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
             # Draw 4 rectangles vertically
             elif type_choice == "fourtwoone":
                 draw_n(4, page, horizontal_vertical)
 
                 # Pick one and divide into two
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
         if num_panels == 6:
 
             # Possible layouts with 6 panels
             if type_choice is None:
-                type_choice = np.random.choice(["tripeq", "tripuneq",
-                                                "twofourtwo", "twothreethree",
-                                                "fourtwotwo"])
+                type_choice = rng.choice(["tripeq", "tripuneq",
+                                          "twofourtwo", "twothreethree",
+                                          "fourtwotwo"])
 
-            horizontal_vertical = np.random.choice(["v", "h"])
+            horizontal_vertical = rng.choice(["v", "h"])
 
             # Draw 3 rectangles (V OR H)
             if type_choice == "tripeq" or type_choice == "tripuneq":
-                draw_n_shifted(3, page, horizontal_vertical)
+                draw_n_shifted(3, page, horizontal_vertical, rng=rng)
                 # Split each equally
                 if type_choice == "tripeq":
-                    shift = np.random.randint(25, 75)
+                    shift = rng.randint(25, 75)
                     shift = shift/100
                 # Split each unequally
                 else:
@@ -1982,20 +2121,20 @@ def get_base_panels(num_panels=0,
 
                 next_div = invert_for_next(horizontal_vertical)
                 for panel in page.children:
-                    draw_two_shifted(panel, next_div, shift=shift)
+                    draw_two_shifted(panel, next_div, shift=shift, rng=rng)
 
             # Draw 2 rectangles
             elif type_choice == "twofourtwo":
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
                 # Split into 4 one half 2 in another
                 next_div = invert_for_next(horizontal_vertical)
-                draw_n_shifted(4, page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_n_shifted(4, page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
             # Draw 2 rectangles
             elif type_choice == "twothreethree":
                 # Split 3 in each
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 for panel in page.children:
@@ -2005,7 +2144,7 @@ def get_base_panels(num_panels=0,
                     choice_max = round((100/n)*1.5)
                     choice_min = round((100/n)*0.5)
                     for i in range(0, n):
-                        shift_choice = np.random.randint(
+                        shift_choice = rng.randint(
                                                 choice_min,
                                                 choice_max
                                                 )
@@ -2023,22 +2162,24 @@ def get_base_panels(num_panels=0,
                     draw_n_shifted(3,
                                    panel,
                                    next_div,
-                                   shifts=normalized_shifts
+                                   shifts=normalized_shifts,
+                                   rng=rng
                                    )
 
             # Draw 4 rectangles
             elif type_choice == "fourtwotwo":
-                draw_n_shifted(4, page, horizontal_vertical)
+                draw_n_shifted(4, page, horizontal_vertical, rng=rng)
 
                 # Split two of them
-                choice1_idx, left_choices = choose_and_return_other(page)
-                choice2_idx = np.random.choice(left_choices)
+                choice1_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
+                choice2_idx = rng.choice(left_choices)
                 choice1 = page.get_child(choice1_idx)
                 choice2 = page.get_child(choice2_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice1, next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
         if num_panels == 7:
 
@@ -2047,23 +2188,24 @@ def get_base_panels(num_panels=0,
                      "threethreextwoone", "fourthreextwo"]
 
             if type_choice is None:
-                type_choice = np.random.choice(types)
+                type_choice = rng.choice(types)
 
             # Draw two split 3-4 - HV
             # Draw two rectangles
             if type_choice == "twothreefour":
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
 
                 # Pick one and split one into 4 rectangles
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_n_shifted(4, choice, next_div)
+                draw_n_shifted(4, choice, next_div, rng=rng)
 
                 # Some issue with the function calls and seeding
                 n = 3
@@ -2071,7 +2213,7 @@ def get_base_panels(num_panels=0,
                 choice_max = round((100/n)*1.5)
                 choice_min = round((100/n)*0.5)
                 for i in range(0, n):
-                    shift_choice = np.random.randint(choice_min, choice_max)
+                    shift_choice = rng.randint(choice_min, choice_max)
                     choice_max = choice_max + ((100/n) - shift_choice)
                     shifts.append(shift_choice)
 
@@ -2083,37 +2225,40 @@ def get_base_panels(num_panels=0,
                     normalized_shifts.append(new_shift/100)
 
                 # Pick another and split into 3 rectangles
-                draw_n_shifted(3, other, next_div, shifts=normalized_shifts)
+                draw_n_shifted(3, other, next_div, shifts=normalized_shifts,
+                               rng=rng)
 
             # Draw three rectangles
             elif type_choice == "threethreetwotwo":
                 draw_n(3, page, "h")
 
                 # Pick one and split it into 3 rectangles
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
                 choice = page.get_child(choice_idx)
 
-                draw_n_shifted(3, choice, "v")
+                draw_n_shifted(3, choice, "v", rng=rng)
 
                 # Split the other two into 2 rectangles
-                draw_two_shifted(page.get_child(left_choices[0]), "v")
-                draw_two_shifted(page.get_child(left_choices[1]), "v")
+                draw_two_shifted(page.get_child(left_choices[0]), "v", rng=rng)
+                draw_two_shifted(page.get_child(left_choices[1]), "v", rng=rng)
 
             # Draw 3 rectangles
             elif type_choice == "threefourtwoone":
                 draw_n(3, page, "h")
 
                 # Pick two of three rectangles and let one be
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
                 choice = page.get_child(choice_idx)
-                other_idx = np.random.choice(left_choices)
+                other_idx = rng.choice(left_choices)
                 other = page.get_child(other_idx)
 
                 # Of the picked split one into 4 rectangles
-                draw_n_shifted(4, choice, "v")
+                draw_n_shifted(4, choice, "v", rng=rng)
 
                 # Split the other into 2 rectangles
-                draw_two_shifted(other, "v")
+                draw_two_shifted(other, "v", rng=rng)
 
             # Draw 3 rectangles
             elif type_choice == "threethreextwoone":
@@ -2121,12 +2266,13 @@ def get_base_panels(num_panels=0,
                 draw_n(3, page, "h")
 
                 # Pick two and leave one
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 # Of the picked split one into 3
-                draw_n_shifted(3, choice, "v")
+                draw_n_shifted(3, choice, "v", rng=rng)
 
                 # Some issue with the function calls and seeding
                 n = 3
@@ -2134,7 +2280,7 @@ def get_base_panels(num_panels=0,
                 choice_max = round((100/n)*1.5)
                 choice_min = round((100/n)*0.5)
                 for i in range(0, n):
-                    shift_choice = np.random.randint(choice_min, choice_max)
+                    shift_choice = rng.randint(choice_min, choice_max)
                     choice_max = choice_max + ((100/n) - shift_choice)
                     shifts.append(shift_choice)
 
@@ -2146,22 +2292,24 @@ def get_base_panels(num_panels=0,
                     normalized_shifts.append(new_shift/100)
 
                 # Split the other into 3 as well
-                draw_n_shifted(3, other, "v", shifts=normalized_shifts)
+                draw_n_shifted(3, other, "v", shifts=normalized_shifts,
+                               rng=rng)
 
             # Draw 4 split 3x2 - HV
 
             # Draw 4 rectangles
             elif type_choice == "fourthreextwo":
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
                 draw_n(4, page, horizontal_vertical)
 
                 # Choose one and leave as is
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(
+                                                    page, rng=rng)
 
                 # Divide the rest into two
                 next_div = invert_for_next(horizontal_vertical)
                 for panel in left_choices:
-                    draw_two_shifted(page.get_child(panel), next_div)
+                    draw_two_shifted(page.get_child(panel), next_div, rng=rng)
 
         if num_panels == 8:
 
@@ -2171,7 +2319,7 @@ def get_base_panels(num_panels=0,
                      "threethreefourone"]
 
             if type_choice is None:
-                type_choice = np.random.choice(types)
+                type_choice = rng.choice(types)
 
             # Draw 4 rectangles
             # equal or uneqal 4-4x2
@@ -2182,7 +2330,7 @@ def get_base_panels(num_panels=0,
                 if type_choice == "fourfourxtwoeq":
                     shift_min = 25
                     shift_max = 75
-                    shift = np.random.randint(shift_min, shift_max)
+                    shift = rng.randint(shift_min, shift_max)
                     set_shift = shift/100
                 # Unequal
                 else:
@@ -2191,7 +2339,7 @@ def get_base_panels(num_panels=0,
                 # Drivide each into two
                 for panel in page.children:
 
-                    draw_two_shifted(panel, "v", shift=set_shift)
+                    draw_two_shifted(panel, "v", shift=set_shift, rng=rng)
 
             # Where three rectangles need to be drawn
             if type_choice in types[2:]:
@@ -2201,9 +2349,10 @@ def get_base_panels(num_panels=0,
                 if type_choice == "threethreethreetwo":
 
                     # Choose one and divide it into two
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(
+                                                        page, rng=rng)
                     choice = page.get_child(choice_idx)
-                    draw_two_shifted(choice, "v")
+                    draw_two_shifted(choice, "v", rng=rng)
 
                     # Divide the rest into 3
                     for panel in left_choices:
@@ -2213,7 +2362,7 @@ def get_base_panels(num_panels=0,
                         choice_max = round((100/n)*1.5)
                         choice_min = round((100/n)*0.5)
                         for i in range(0, n):
-                            shift_choice = np.random.randint(
+                            shift_choice = rng.randint(
                                             choice_min,
                                             choice_max
                                             )
@@ -2231,20 +2380,22 @@ def get_base_panels(num_panels=0,
                         draw_n_shifted(3,
                                        page.get_child(panel),
                                        "v",
-                                       shifts=normalized_shifts
+                                       shifts=normalized_shifts,
+                                       rng=rng
                                        )
 
                 # Draw 3 rectangles then
                 elif type_choice == "threefourtwotwo":
 
                     # Choosen one and divide it into 4
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(
+                                                        page, rng=rng)
                     choice = page.get_child(choice_idx)
 
-                    draw_n_shifted(4, choice, "v")
+                    draw_n_shifted(4, choice, "v", rng=rng)
 
                     for panel in left_choices:
-                        draw_two_shifted(page.get_child(panel), "v")
+                        draw_two_shifted(page.get_child(panel), "v", rng=rng)
 
                 # Draw 3 3-4-1 - H
 
@@ -2252,13 +2403,14 @@ def get_base_panels(num_panels=0,
                 elif type_choice == "threethreefourone":
 
                     # Choose two and leave one as is
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(
+                                                        page, rng=rng)
                     choice = page.get_child(choice_idx)
-                    other_idx = np.random.choice(left_choices)
+                    other_idx = rng.choice(left_choices)
                     other = page.get_child(other_idx)
 
                     # Divide one into 3 rectangles
-                    draw_n_shifted(3, choice, "v")
+                    draw_n_shifted(3, choice, "v", rng=rng)
 
                     # Some issue with the function calls and seeding
                     n = 4
@@ -2266,7 +2418,7 @@ def get_base_panels(num_panels=0,
                     choice_max = round((100/n)*1.5)
                     choice_min = round((100/n)*0.5)
                     for i in range(0, n):
-                        shift_choice = np.random.randint(
+                        shift_choice = rng.randint(
                                             choice_min,
                                             choice_max
                                             )
@@ -2282,7 +2434,8 @@ def get_base_panels(num_panels=0,
                         normalized_shifts.append(new_shift/100)
 
                     # Divide the other into 4 rectangles
-                    draw_n_shifted(4, other, "v", shifts=normalized_shifts)
+                    draw_n_shifted(4, other, "v", shifts=normalized_shifts,
+                                   rng=rng)
 
     return page
 
@@ -2292,7 +2445,9 @@ def create_page_metadata(image_dir,
                          font_files,
                          text_dataset,
                          speech_bubble_files,
-                         speech_bubble_tags):
+                         speech_bubble_tags,
+                         rng=np.random,
+                         page_name=None):
     """
     This function creates page metadata for a single page. It includes
     transforms, background addition, random panel removal,
@@ -2300,8 +2455,9 @@ def create_page_metadata(image_dir,
     images and speech bubbles.
 
     :param image_dir: List of images to pick from
+    or an illustration catalog
 
-    :type image_dir: list
+    :type image_dir: list or IllustrationCatalog
 
     :param image_dir_path: Path of images dir to add to
     panels
@@ -2323,10 +2479,20 @@ def create_page_metadata(image_dir,
 
     :type speech_bubble_files: list
 
-    :param speech_bubble_tags: a list of speech bubble
+    :param speech_bubble_tags: a speech bubble catalog from
+    build_speech_bubble_catalog or a dataframe of speech bubble
     writing area tags by filename
 
-    :type speech_bubble_tags: list
+    :type speech_bubble_tags: dict or pandas.DataFrame
+
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
+
+    :param page_name: A specific name for the page
+
+    :type page_name: str, optional
 
     :return: Created Page with all the bells and whistles
 
@@ -2334,7 +2500,7 @@ def create_page_metadata(image_dir,
     """
 
     # Select page type
-    page_type = np.random.choice(
+    page_type = rng.choice(
         list(cfg.vertical_horizontal_ratios.keys()),
         p=list(cfg.vertical_horizontal_ratios.values())
     )
@@ -2342,15 +2508,18 @@ def create_page_metadata(image_dir,
     # Select number of panels on the page
     # between 1 and 8
 
-    number_of_panels = np.random.choice(
+    number_of_panels = rng.choice(
         list(cfg.num_pages_ratios.keys()),
         p=list(cfg.num_pages_ratios.values())
     )
 
-    page = get_base_panels(number_of_panels, page_type)
+    page = get_base_panels(number_of_panels,
+                           page_type,
+                           page_name=page_name,
+                           rng=rng)
 
-    if np.random.random() < cfg.panel_transform_chance:
-        page = add_transforms(page)
+    if rng.random() < cfg.panel_transform_chance:
+        page = add_transforms(page, rng=rng)
 
     page = shrink_panels(page)
     page = populate_panels(page,
@@ -2359,7 +2528,8 @@ def create_page_metadata(image_dir,
                            font_files,
                            text_dataset,
                            speech_bubble_files,
-                           speech_bubble_tags
+                           speech_bubble_tags,
+                           rng=rng
                            )
 
     # 패널이 하나이고 이미지가 있는 경우 배경으로 설정
@@ -2371,7 +2541,254 @@ def create_page_metadata(image_dir,
             # 별도의 패널로 렌더링되지 않도록 함
             page.leaf_children = []
 
-    if np.random.random() < cfg.panel_removal_chance:
-        page = remove_panel(page)
+    if rng.random() < cfg.panel_removal_chance:
+        page = remove_panel(page, rng=rng)
 
     return page
+
+
+def get_page_rng(seed, page_index):
+    """
+    Create the random number generator of one page from a master
+    seed and the page's index. Every page gets its own stream so
+    pages come out the same no matter which process creates them
+    or in which order
+
+    :param seed: Master seed of the whole run
+
+    :type seed: int
+
+    :param page_index: Index of the page within the run
+
+    :type page_index: int
+
+    :return: The page's random number generator
+
+    :rtype: numpy.random.RandomState
+    """
+    state = np.random.SeedSequence([seed, page_index]).generate_state(4)
+    return np.random.RandomState(state)
+
+
+def create_seeded_page_metadata(seed,
+                                page_index,
+                                image_dir,
+                                image_dir_path,
+                                font_files,
+                                text_dataset,
+                                speech_bubble_files,
+                                speech_bubble_tags):
+    """
+    Create the metadata of one page reproducibly from a master
+    seed and the page's index. The page's name is drawn from
+    its random number generator as well
+
+    :param seed: Master seed of the whole run
+
+    :type seed: int
+
+    :param page_index: Index of the page within the run
+
+    :type page_index: int
+
+    :param image_dir: List of images to pick from
+    or an illustration catalog
+
+    :type image_dir: list or IllustrationCatalog
+
+    :param image_dir_path: Path of images dir to add to
+    panels
+
+    :type image_dir_path: str
+
+    :param font_files: list of font files for speech bubble
+    text
+
+    :type font_files: list
+
+    :param text_dataset: A dask dataframe of text to
+    pick to render within speech bubble
+
+    :type text_dataset: pandas.dataframe
+
+    :param speech_bubble_files: list of base speech bubble
+    template files
+
+    :type speech_bubble_files: list
+
+    :param speech_bubble_tags: a speech bubble catalog from
+    build_speech_bubble_catalog or a dataframe of speech bubble
+    writing area tags by filename
+
+    :type speech_bubble_tags: dict or pandas.DataFrame
+
+    :return: Created Page
+
+    :rtype: Page
+    """
+    rng = get_page_rng(seed, page_index)
+    page_name = str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+    return create_page_metadata(image_dir,
+                                image_dir_path,
+                                font_files,
+                                text_dataset,
+                                speech_bubble_files,
+                                speech_bubble_tags,
+                                rng=rng,
+                                page_name=page_name)
+
+
+# Datasets shared by the metadata workers, set once per process
+# so they aren't pickled for every page
+_metadata_inputs = None
+
+
+def init_metadata_worker(inputs):
+    """
+    Store the datasets pages are created from in a
+    metadata worker process
+
+    :param inputs: A tuple of the image_dir, image_dir_path,
+    font_files, text_dataset, speech_bubble_files and
+    speech_bubble_tags arguments of create_page_metadata
+
+    :type inputs: tuple
+    """
+    global _metadata_inputs
+    _metadata_inputs = inputs
+
+
+def create_and_dump_seeded_page(task):
+    """
+    Create one seeded page in a metadata worker and
+    dump it to JSON
+
+    :param task: A tuple of the master seed, the page's index,
+    the metadata directory, whether to run dry and whether to
+    return the page's data for a metadata store instead of
+    dumping it
+
+    :type task: tuple
+
+    :return: The name of the page or its data
+
+    :rtype: str or dict
+    """
+    seed, page_index, metadata_dir, dry, to_store = task
+    page = create_seeded_page_metadata(seed, page_index, *_metadata_inputs)
+    if to_store:
+        return page.dump_dict()
+
+    page.dump_data(metadata_dir, dry=dry)
+
+    return page.name
+
+
+def create_page_metadata_parallel(n,
+                                  seed,
+                                  image_dir,
+                                  image_dir_path,
+                                  font_files,
+                                  text_dataset,
+                                  speech_bubble_files,
+                                  speech_bubble_tags,
+                                  metadata_dir,
+                                  dry=False,
+                                  workers=None,
+                                  store=None):
+    """
+    Concurrently and in parallel create and dump the metadata of
+    n pages. Each page draws from its own random number generator
+    derived from the master seed and the page's index so the
+    output is the same regardless of the number of workers
+
+    :param n: Number of pages to create
+
+    :type n: int
+
+    :param seed: Master seed of the run
+
+    :type seed: int
+
+    :param image_dir: List of images to pick from
+    or an illustration catalog
+
+    :type image_dir: list or IllustrationCatalog
+
+    :param image_dir_path: Path of images dir to add to
+    panels
+
+    :type image_dir_path: str
+
+    :param font_files: list of font files for speech bubble
+    text
+
+    :type font_files: list
+
+    :param text_dataset: A dask dataframe of text to
+    pick to render within speech bubble
+
+    :type text_dataset: pandas.dataframe
+
+    :param speech_bubble_files: list of base speech bubble
+    template files
+
+    :type speech_bubble_files: list
+
+    :param speech_bubble_tags: a speech bubble catalog from
+    build_speech_bubble_catalog or a dataframe of speech bubble
+    writing area tags by filename
+
+    :type speech_bubble_tags: dict or pandas.DataFrame
+
+    :param metadata_dir: Where to dump the JSON files
+
+    :type metadata_dir: str
+
+    :param dry: Whether to skip writing the JSON files
+
+    :type dry: bool, optional
+
+    :param workers: Number of worker processes,
+    defaults to the number of CPUs
+
+    :type workers: int, optional
+
+    :param store: A metadata store to append the pages to in
+    page index order instead of writing JSON files
+
+    :type store: MetadataStore, optional
+
+    :return: Names of the created pages in page index order
+
+    :rtype: list
+    """
+    inputs = (image_dir,
+              image_dir_path,
+              font_files,
+              text_dataset,
+              speech_bubble_files,
+              speech_bubble_tags)
+
+    # The pages are written to a store by this process
+    # since it only has a single writer
+    to_store = store is not None and not dry
+    tasks = [(seed, page_index, metadata_dir, dry, to_store)
+             for page_index in range(n)]
+
+    names = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_metadata_worker,
+            initargs=(inputs,)) as executor:
+        for result in tqdm(executor.map(create_and_dump_seeded_page,
+                                        tasks,
+                                        chunksize=16),
+                           total=n):
+            if to_store:
+                store.append(result)
+                result = result['name']
+            names.append(result)
+
+    return names
@@ -1,11 +1,18 @@
 import numpy as np
 import random
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+import time
+from PIL import Image, ImageDraw, ImageOps
 import json
 import uuid
-from .helpers import crop_image_only_outside
-import cjkwrap
-from .helpers import get_leaf_panels
+from .helpers import (
+    get_leaf_panels, get_polygon_bbox, shift_polygon, find_largest_fitting
+)
+from .render_cache import (
+    load_page_illustration, load_bubble_template, load_font,
+    get_text_size, wrap_text
+)
+from .metadata_store import read_store_page
+from .render_stats import stage_timer, record_stage
 from .. import config_file as cfg
 
 
@@ -342,7 +349,7 @@ class Page(Panel):
         # Size of the page
         self.page_size = cfg.page_size
 
-    def dump_data(self, dataset_path, dry=True):
+    def dump_data(self, dataset_path, dry=True, store=None):
         """
         A method to take all the Page's relevant data
         and create a dictionary out of it so it can be
@@ -357,10 +364,36 @@ class Page(Panel):
 
         :type dry: bool, optional
 
+        :param store: A metadata store to append the page to
+        instead of writing a JSON file
+
+        :type store: MetadataStore, optional
+
         :return: Optional return when running dry of a json data dump
         :rtype: str
         """
 
+        data = self.dump_dict()
+
+        if dry:
+            return json.dumps(data, indent=2)
+        elif store is not None:
+            store.append(data)
+        else:
+            with open(dataset_path+self.name+".json", "w+") as json_file:
+                json.dump(data, json_file, indent=2)
+
+    def dump_dict(self):
+        """
+        A method to take all the Page's relevant data
+        and create a dictionary out of it which can be
+        handed to a renderer directly without going
+        through a JSON file
+
+        :return: A dictionary of the Page's data
+        :rtype: dict
+        """
+
         # Recursively dump children
         if len(self.children) > 0:
             children_rec = [child.dump_data() for child in self.children]
@@ -378,66 +411,87 @@ class Page(Panel):
             speech_bubbles=speech_bubbles
         )
 
-        if not dry:
-            with open(dataset_path+self.name+".json", "w+") as json_file:
-                json.dump(data, json_file, indent=2)
-        else:
-            return json.dumps(data, indent=2)
+        return data
 
-    def load_data(self, filename):
+    def load_data(self, filename, store_dir=None, store_index=None):
 
         """
         This method reverses the dump_data function and
         load's the metadata of the page from the JSON
         file that has been loaded.
 
-        :param filename: JSON filename to load
+        :param filename: JSON filename to load or the page's
+        name when loading from a metadata store
 
         :type filename: str
+
+        :param store_dir: Directory of a metadata store to
+        read the page from
+
+        :type store_dir: str, optional
+
+        :param store_index: The store's index to avoid
+        reloading it for every page
+
+        :type store_index: dict, optional
         """
-        with open(filename, "rb") as json_file:
-
-            data = json.load(json_file)
-
-            self.name = data['name']
-            self.num_panels = int(data['num_panels'])
-            self.page_type = data['page_type']
-            self.background = data['background']
-
-            if len(data['speech_bubbles']) > 0:
-                for speech_bubble in data['speech_bubbles']:
-                    # Line constraints
-                    text_orientation = speech_bubble['text_orientation']
-                    transform_metadata = speech_bubble['transform_metadata']
-                    bubble = SpeechBubble(
-                                texts=speech_bubble['texts'],
-                                text_indices=speech_bubble['text_indices'],
-                                font=speech_bubble['font'],
-                                speech_bubble=speech_bubble['speech_bubble'],
-                                writing_areas=speech_bubble['writing_areas'],
-                                resize_to=speech_bubble['resize_to'],
-                                location=speech_bubble['location'],
-                                width=speech_bubble['width'],
-                                height=speech_bubble['height'],
-                                transforms=speech_bubble['transforms'],
-                                transform_metadata=transform_metadata,
-                                text_orientation=text_orientation
-                                )
-
-                    self.speech_bubbles.append(bubble)
-
-            # Recursively load children
-            if len(data['children']) > 0:
-                for child in data['children']:
-                    panel = Panel(
-                        coords=child['coordinates'],
-                        name=child['name'],
-                        parent=self,
-                        orientation=child['orientation'],
-                        non_rect=child['non_rect']
-                    )
-                    panel.load_data(child)
-                    self.children.append(panel)
+        if store_dir is not None:
+            data = read_store_page(store_dir, filename, store_index)
+        else:
+            with open(filename, "rb") as json_file:
+
+                data = json.load(json_file)
+
+        self.load_dict(data)
+
+    def load_dict(self, data):
+        """
+        This method reverses the dump_dict function and
+        load's the metadata of the page from a dictionary
+
+        :param data: A dictionary of the page's data
+
+        :type data: dict
+        """
+        self.name = data['name']
+        self.num_panels = int(data['num_panels'])
+        self.page_type = data['page_type']
+        self.background = data['background']
+
+        if len(data['speech_bubbles']) > 0:
+            for speech_bubble in data['speech_bubbles']:
+                # Line constraints
+                text_orientation = speech_bubble['text_orientation']
+                transform_metadata = speech_bubble['transform_metadata']
+                bubble = SpeechBubble(
+                            texts=speech_bubble['texts'],
+                            text_indices=speech_bubble['text_indices'],
+                            font=speech_bubble['font'],
+                            speech_bubble=speech_bubble['speech_bubble'],
+                            writing_areas=speech_bubble['writing_areas'],
+                            resize_to=speech_bubble['resize_to'],
+                            location=speech_bubble['location'],
+                            width=speech_bubble['width'],
+                            height=speech_bubble['height'],
+                            transforms=speech_bubble['transforms'],
+                            transform_metadata=transform_metadata,
+                            text_orientation=text_orientation
+                            )
+
+                self.speech_bubbles.append(bubble)
+
+        # Recursively load children
+        if len(data['children']) > 0:
+            for child in data['children']:
+                panel = Panel(
+                    coords=child['coordinates'],
+                    name=child['name'],
+                    parent=self,
+                    orientation=child['orientation'],
+                    non_rect=child['non_rect']
+                )
+                panel.load_data(child)
+                self.children.append(panel)
 
     def render(self, show=False):
         """
@@ -465,11 +519,7 @@ class Page(Panel):
 
         # Set background if needed
         if self.background is not None:
-            bg = Image.open(self.background).convert("L")
-            img_array = np.asarray(bg)
-            crop_array = crop_image_only_outside(img_array)
-            bg = Image.fromarray(crop_array)
-            bg = bg.resize((W, H))
+            bg = load_page_illustration(self.background, (W, H))
             page_img.paste(bg, (0, 0))
 
         # Render panels
@@ -479,43 +529,48 @@ class Page(Panel):
             rect = panel.get_polygon()
 
             # Open the illustration to put within panel
+            bbox = None
             if panel.image is not None:
-                img = Image.open(panel.image)
-
-                # Clean it up by cropping the black areas
-                img_array = np.asarray(img)
-                crop_array = crop_image_only_outside(img_array)
-
-                img = Image.fromarray(crop_array)
-
-                # Resize it to the page's size as a simple
-                # way to crop differnt parts of it
+                # Cropped of its black areas and resized to the page's
+                # size as a simple way to crop differnt parts of it.
+                # Cached per process since panels share illustrations
 
                 # TODO: Figure out how to do different types of
                 # image crops for smaller panels
-                w_rev_ratio = cfg.page_width/img.size[0]
-                h_rev_ratio = cfg.page_height/img.size[1]
+                img = load_page_illustration(panel.image, (W, H))
 
-                img = img.resize(
-                    (round(img.size[0]*w_rev_ratio),
-                     round(img.size[1]*h_rev_ratio))
-                )
+                # Only composite within the panel's bounding box
+                # rather than through a full page mask
+                bbox = get_polygon_bbox(rect, (W, H))
 
-                # Create a mask for the panel illustration
-                mask = Image.new("L", cfg.page_size, 0)
-                draw_mask = ImageDraw.Draw(mask)
+            if bbox is not None:
+                left, upper, right, lower = bbox
+                with stage_timer("panel_crop"):
+                    img = img.crop(bbox)
 
-                # On the mask draw and therefore cut out the panel's
-                # area so that the illustration can be fit into
-                # the page itself
-                draw_mask.polygon(rect, fill=255)
+                # Create a mask for the panel illustration
+                # spanning only the rows of the panel. The polygon
+                # is shifted vertically only since shifting the x
+                # coordinates changes how Pillow rounds the edges
+                with stage_timer("mask"):
+                    mask = Image.new("L", (W, lower - upper), 0)
+                    draw_mask = ImageDraw.Draw(mask)
+
+                    # On the mask draw and therefore cut out the panel's
+                    # area so that the illustration can be fit into
+                    # the page itself
+                    draw_mask.polygon(shift_polygon(rect, 0, upper),
+                                      fill=255)
+                    mask = mask.crop((left, 0, right, lower - upper))
 
             # Draw outline
-            draw_rect.line(rect, fill="black", width=cfg.boundary_width)
+            with stage_timer("outline"):
+                draw_rect.line(rect, fill="black", width=cfg.boundary_width)
 
             # Paste illustration onto the page
-            if panel.image is not None:
-                page_img.paste(img, (0, 0), mask)
+            if bbox is not None:
+                with stage_timer("paste"):
+                    page_img.paste(img, (left, upper), mask)
 
         # If it's a single panel page
         if self.num_panels < 2:
@@ -528,6 +583,7 @@ class Page(Panel):
             # For each bubble
             for sb in panel.speech_bubbles:
                 states, bubble, mask, location = sb.render()
+                paste_started = time.perf_counter()
                 # Slightly shift mask so that you get outline for bubbles
                 new_mask_width = mask.size[0]+cfg.bubble_mask_x_increase
                 new_mask_height = mask.size[1]+cfg.bubble_mask_y_increase
@@ -541,6 +597,7 @@ class Page(Panel):
                 # Uses a mask so that the "L" type bubble is cropped
                 bubble_mask = bubble_mask.crop(crop_dims)
                 page_img.paste(bubble, location, bubble_mask)
+                record_stage("bubble_paste", paste_started)
 
         if show:
             page_img.show()
@@ -548,6 +605,35 @@ class Page(Panel):
             return page_img
 
 
+def transform_bubble_and_mask(transform, bubble, mask):
+    """
+    Apply an image transform to a speech bubble and its mask,
+    only doing it once while they are still the same image
+
+    :param transform: A function taking an image and
+    returning a new transformed image
+
+    :type transform: function
+
+    :param bubble: The speech bubble
+
+    :type bubble: PIL.Image
+
+    :param mask: The speech bubble's mask
+
+    :type mask: PIL.Image
+
+    :return: The transformed bubble and mask
+
+    :rtype: tuple
+    """
+    new_bubble = transform(bubble)
+    if mask is bubble:
+        return new_bubble, new_bubble
+
+    return new_bubble, transform(mask)
+
+
 class SpeechBubble(object):
     """
     A class to represent the metadata to render a speech bubble
@@ -608,6 +694,11 @@ class SpeechBubble(object):
     is written left to right ot top to bottom
 
     :type text_orientation: str, optional
+
+    :param rng: Random number generator to draw from,
+    defaults to numpy's global generator
+
+    :type rng: numpy.random.RandomState, optional
     """
     def __init__(self,
                  texts,
@@ -621,7 +712,8 @@ class SpeechBubble(object):
                  height,
                  transforms=None,
                  transform_metadata=None,
-                 text_orientation=None):
+                 text_orientation=None,
+                 rng=np.random):
         """
         Constructor method
         """
@@ -652,27 +744,27 @@ class SpeechBubble(object):
                 "stretch y",
                 ]
             # 1 in 50 chance of no transformation
-            if np.random.rand() < 0.98:
-                self.transforms = list(np.random.choice(
+            if rng.rand() < 0.98:
+                self.transforms = list(rng.choice(
                                             possible_transforms,
                                             2
                                             )
                                        )
 
                 # 1 in 20 chance of inversion
-                if np.random.rand() < 0.05:
+                if rng.rand() < 0.05:
                     self.transforms.append("invert")
 
                 if "stretch x" in self.transforms:
                     # Up to 30% stretching
-                    factor = np.random.random()*0.3
+                    factor = rng.random()*0.3
                     self.transform_metadata["stretch_x_factor"] = factor
                 if "stretch y" in self.transforms:
-                    factor = np.random.random()*0.3
+                    factor = rng.random()*0.3
                     self.transform_metadata["stretch_y_factor"] = factor
 
                 if "rotate" in self.transforms:
-                    rotation = np.random.randint(10, 30)
+                    rotation = rng.randint(10, 30)
                     self.transform_metadata["rotation_amount"] = rotation
 
             else:
@@ -682,7 +774,7 @@ class SpeechBubble(object):
 
         if text_orientation is None:
             # 1 in 100 chance
-            if np.random.random() < 0.01:
+            if rng.random() < 0.01:
                 self.text_orientation = "ltr"
             else:
                 self.text_orientation = "ttb"
@@ -691,9 +783,9 @@ class SpeechBubble(object):
 
         min_font_size = cfg.min_font_size
         max_font_size = cfg.max_font_size
-        self.font_size = np.random.randint(min_font_size,
-                                           max_font_size
-                                           )
+        self.font_size = rng.randint(min_font_size,
+                                     max_font_size
+                                     )
 
     def dump_data(self):
         """
@@ -724,6 +816,79 @@ class SpeechBubble(object):
 
         return data
 
+    def fit_text(self, text, size, first_line_length, line_length,
+                 max_extent):
+        """
+        Wrap a text into lines and find the largest font size, no
+        larger than the bubble's current one, at which the lines fit
+        into a writing area. Font sizes are binary searched rather
+        than tried one by one and if even the smallest font size
+        doesn't fit lines are dropped from the end.
+        The bubble's font size is set to the one found
+
+        :param text: The text to fit
+
+        :type text: str
+
+        :param size: Width and height of the text at the
+        current font size
+
+        :type size: tuple
+
+        :param first_line_length: Length lines are wrapped at
+        for the current font size
+
+        :type first_line_length: float
+
+        :param line_length: Length lines are wrapped at
+        for smaller font sizes
+
+        :type line_length: float
+
+        :param max_extent: How far the lines can stack up
+
+        :type max_extent: float
+
+        :return: The lines of text and the width and height
+        of the text at the font size found
+
+        :rtype: tuple
+        """
+        text_segments = [text]
+        max_chars = int((first_line_length//(size[0]/len(text))))
+        if size[0] > first_line_length and max_chars > 1:
+            # Using specialized wrapping library
+            text_segments = list(wrap_text(text, max_chars))
+
+        def get_layout(font_size):
+            font_text_size = get_text_size(self.font, font_size, text)
+            max_chars = int((line_length//(font_text_size[0]/len(text))))
+            if max_chars > 1:
+                return list(wrap_text(text, max_chars)), font_text_size
+
+            return list(text_segments), font_text_size
+
+        def fits(font_size):
+            segments, font_text_size = get_layout(font_size)
+            return len(segments)*font_text_size[1] <= max_extent
+
+        # Reduce font or remove words till text fits
+        too_big = len(text_segments)*size[1] > max_extent
+        if too_big and self.font_size > cfg.min_font_size:
+            font_size = find_largest_fitting(cfg.min_font_size,
+                                             self.font_size - 1,
+                                             fits)
+            if font_size is None:
+                font_size = cfg.min_font_size
+
+            self.font_size = font_size
+            text_segments, size = get_layout(font_size)
+
+        while len(text_segments)*size[1] > max_extent:
+            text_segments.pop()
+
+        return text_segments, size
+
     def render(self):
         """
         A function to render this speech bubble
@@ -734,17 +899,20 @@ class SpeechBubble(object):
         :rtype: tuple
         """
 
-        bubble = Image.open(self.speech_bubble).convert("L")
-        mask = bubble.copy()
+        with stage_timer("bubble_open"):
+            bubble = load_bubble_template(self.speech_bubble)
+        transform_started = time.perf_counter()
+
+        # The mask is the same image as the bubble until the bubble
+        # is inverted or written in so transforms are done once.
+        # Every transform makes a new image so the cached
+        # template is never changed
+        mask = bubble
 
         # Get bubble dimensions regardless of text setting
         w_bubble, h_bubble = bubble.size
         cx, cy = w_bubble/2, h_bubble/2 
 
-        # Only load font if text is enabled (drawing text is handled later)
-        if cfg.TEXT_SETTINGS.get("enabled", False):
-            font = ImageFont.truetype(self.font, self.font_size)
-
         # States is used to indicate whether this bubble is
         # inverted or not to the page render function
         states = []
@@ -756,8 +924,8 @@ class SpeechBubble(object):
                 bubble = ImageOps.invert(bubble)
 
             elif transform == "flip vertical":
-                bubble = ImageOps.flip(bubble)
-                mask = ImageOps.flip(mask)
+                bubble, mask = transform_bubble_and_mask(ImageOps.flip,
+                                                         bubble, mask)
                 # TODO: vertically flip box coordinates
                 if cfg.TEXT_SETTINGS.get("enabled", False): # Only process writing_areas if text is enabled
                     new_writing_areas = []
@@ -777,8 +945,8 @@ class SpeechBubble(object):
                 states.append("vflip")
 
             elif transform == "flip horizontal":
-                bubble = ImageOps.mirror(bubble)
-                mask = ImageOps.mirror(mask)
+                bubble, mask = transform_bubble_and_mask(ImageOps.mirror,
+                                                         bubble, mask)
                 if cfg.TEXT_SETTINGS.get("enabled", False): # Only process writing_areas if text is enabled
                     new_writing_areas = []
                     for area in self.writing_areas:
@@ -802,8 +970,9 @@ class SpeechBubble(object):
                 new_size = (round(w_bubble*(1+stretch_factor)), h_bubble)
                 # Reassign for resizing later
                 w_bubble, h_bubble = new_size
-                bubble = bubble.resize(new_size)
-                mask = mask.resize(new_size)
+                bubble, mask = transform_bubble_and_mask(
+                    lambda img: img.resize(new_size), bubble, mask
+                )
 
                 if cfg.TEXT_SETTINGS.get("enabled", False): # Only process writing_areas if text is enabled
                     new_writing_areas = []
@@ -825,8 +994,9 @@ class SpeechBubble(object):
 
                 # Reassign for resizing later
                 w_bubble, h_bubble = new_size
-                bubble = bubble.resize(new_size)
-                mask = mask.resize(new_size)
+                bubble, mask = transform_bubble_and_mask(
+                    lambda img: img.resize(new_size), bubble, mask
+                )
 
                 if cfg.TEXT_SETTINGS.get("enabled", False): # Only process writing_areas if text is enabled
                     new_writing_areas = []
@@ -845,6 +1015,9 @@ class SpeechBubble(object):
         # Write text into bubble
         # Only draw text if text is enabled
         if cfg.TEXT_SETTINGS.get("enabled", False):
+            # Text is drawn in place so it needs a copy
+            # of its own that the mask doesn't share
+            bubble = bubble.copy()
             write = ImageDraw.Draw(bubble)
             if "inverted" in states:
                 fill_type = "white"
@@ -875,79 +1048,27 @@ class SpeechBubble(object):
 
                 text = self.texts[i]['Japanese']
                 text = text+text+text+text+text
-                text_segments = [text]
-                size = font.getsize(text)
+                size = get_text_size(self.font, self.font_size, text)
 
                 if self.text_orientation == "ttb":
-
-                    # Setup vertical wrapping
-                    avg_height = size[0]/len(text)
-
-                    # Maximum chars in line
-                    max_chars = int((px_height//avg_height))
-                    if size[0] > px_height:
-                        # Using specialized wrapping library
-                        if max_chars > 1:
-                            text_segments = cjkwrap.wrap(text, width=max_chars)
-
+                    # Lines run down the area so they wrap at its
+                    # height and stack up across its width
+                    text_segments, size = self.fit_text(text,
+                                                        size,
+                                                        px_height,
+                                                        max_y,
+                                                        px_width)
                     text_max_w = len(text_segments)*size[1]
 
-                    is_fit = False
-
-                    # Horizontal wrapping
-                    # Reduce font or remove words till text fits
-                    while not is_fit:
-                        if text_max_w > px_width:
-                            if self.font_size > cfg.min_font_size:
-                                self.font_size -= 1
-                                font = ImageFont.truetype(self.font,
-                                                          self.font_size)
-                                size = font.getsize(text)
-                                avg_height = size[0]/len(text)
-                                max_chars = int((max_y//avg_height))
-                                if max_chars > 1:
-                                    text_segments = cjkwrap.wrap(text,
-                                                                 width=max_chars)
-
-                                text_max_w = len(text_segments)*size[1]
-                            else:
-                                text_segments.pop()
-                                text_max_w = len(text_segments)*size[1]
-                        else:
-                            is_fit = True
-
                 # if text left to right
                 else:
-                    pass
-                    # Setup horizontal wrapping
-                    avg_width = size[0]/len(text)
-                    max_chars = int((px_width//avg_width))
-                    if size[0] > px_width:
-                        # Using specialized wrapping library
-                        if max_chars > 1:
-                            text_segments = cjkwrap.wrap(text, width=max_chars)
-
-                    # Setup vertical wrapping
-                    text_max_h = len(text_segments)*size[1]
-                    is_fit = False
-                    while not is_fit:
-                        if text_max_h > px_height:
-                            if self.font_size > cfg.min_font_size:
-                                self.font_size -= 1
-                                font = ImageFont.truetype(self.font,
-                                                          self.font_size)
-                                size = font.getsize(text)
-                                avg_width = size[0]/len(text)
-                                max_chars = int((px_width//avg_width))
-                                if max_chars > 1:
-                                    text_segments = cjkwrap.wrap(text,
-                                                                 width=max_chars)
-                                text_max_h = len(text_segments)*size[1]
-                            else:
-                                text_segments.pop()
-                                text_max_h = len(text_segments)*size[1]
-                        else:
-                            is_fit = True
+                    text_segments, size = self.fit_text(text,
+                                                        size,
+                                                        px_width,
+                                                        px_width,
+                                                        px_height)
+
+                font = load_font(self.font, self.font_size)
 
                 # Center bubble x axis
                 cbx = og_x + (px_width/2)
@@ -961,7 +1082,9 @@ class SpeechBubble(object):
 
                         ry = y
                     else:
-                        seg_size = font.getsize(text)
+                        seg_size = get_text_size(self.font,
+                                                 self.font_size,
+                                                 text)
                         rx = cbx - seg_size[0]/2
                         ry = ((cby + (len(text_segments)*size[1])/2) -
                               ((len(text_segments) - i)*size[1]))
@@ -981,8 +1104,9 @@ class SpeechBubble(object):
             aspect_ratio = h_bubble/w_bubble
         new_height = round(np.sqrt(self.resize_to/aspect_ratio))
         new_width = round(new_height * aspect_ratio)
-        bubble = bubble.resize((new_width, new_height))
-        mask = mask.resize((new_width, new_height))
+        bubble, mask = transform_bubble_and_mask(
+            lambda img: img.resize((new_width, new_height)), bubble, mask
+        )
 
         # Make sure bubble doesn't bleed the page
         x1, y1 = self.location
@@ -1000,7 +1124,10 @@ class SpeechBubble(object):
         # TODO: Fix issue of bad crops with rotation
         if "rotate" in self.transforms:
             rotation = self.transform_metadata['rotation_amount']
-            bubble = bubble.rotate(rotation)
-            mask = mask.rotate(rotation)
+            bubble, mask = transform_bubble_and_mask(
+                lambda img: img.rotate(rotation), bubble, mask
+            )
+
+        record_stage("bubble_transform", transform_started)
 
         return states, bubble, mask, self.location
@@ -0,0 +1,448 @@
+import os
+import functools
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageFont
+import cjkwrap
+
+from .helpers import crop_image_only_outside, get_draft_size, scale_box
+from .render_stats import stage_timer
+from .shared_cache import SharedIllustrationCache
+from ..crop_box_index import load_crop_box_index
+from ..packed_store import PackedIllustrationStore
+from .. import config_file as cfg
+
+
+class IllustrationCache(object):
+    """
+    A least recently used cache of illustrations that have already
+    been decoded, cropped and resized to the page. The cache is
+    bounded by the number of bytes held rather than the number of
+    entries since illustrations can vary a lot in size.
+
+    :param max_bytes: Maximum number of bytes of image data to keep,
+    0 disables the cache
+
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Constructor method
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get an array from the cache and mark it as recently used
+
+        :param key: Key the array was stored under
+
+        :type key: hashable
+
+        :return: The cached array or None if it is not cached
+
+        :rtype: numpy.ndarray
+        """
+        array = self.entries.get(key)
+        if array is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """
+        Add an array to the cache evicting the least recently used
+        arrays until it fits within the byte budget
+
+        :param key: Key to store the array under
+
+        :type key: hashable
+
+        :param array: Array to store, it is made read only since
+        it is shared between every page that uses it
+
+        :type array: numpy.ndarray
+        """
+        if array.nbytes > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.current_bytes -= self.entries.pop(key).nbytes
+
+        while self.current_bytes + array.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+        array.setflags(write=False)
+        self.entries[key] = array
+        self.current_bytes += array.nbytes
+
+    def clear(self):
+        """
+        Remove every entry from the cache and reset the counters
+        """
+        self.entries.clear()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Return the counters of this cache
+
+        :return: A dictionary of hits, misses, evictions, entries
+        and bytes used
+
+        :rtype: dict
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self.entries),
+            bytes=self.current_bytes
+        )
+
+
+# One cache per process, each render worker gets its own
+_illustration_cache = None
+
+
+def get_illustration_cache():
+    """
+    Get this process's illustration cache creating it
+    on first use
+
+    :return: The illustration cache of this process
+
+    :rtype: IllustrationCache
+    """
+    global _illustration_cache
+    if _illustration_cache is None:
+        _illustration_cache = IllustrationCache(
+            cfg.illustration_cache_max_bytes
+        )
+    return _illustration_cache
+
+
+# The cache shared by the render workers, if rendering with one
+_shared_cache = None
+
+
+def attach_shared_cache(arena_name, index_name, lock):
+    """
+    Attach a render worker to the shared illustration cache,
+    used as the initializer of the render workers
+
+    :param arena_name: Name of the cache's pixel segment
+
+    :type arena_name: str
+
+    :param index_name: Name of the cache's index segment
+
+    :type index_name: str
+
+    :param lock: Lock shared by every process using the cache
+
+    :type lock: multiprocessing.Lock
+    """
+    global _shared_cache
+    _shared_cache = SharedIllustrationCache.attach(arena_name, index_name,
+                                                   lock)
+
+
+def get_cache_stats():
+    """
+    Get this process's illustration cache counters, including
+    those of the shared cache if it is attached to one
+
+    :return: A dictionary of hits, misses, evictions, entries
+    and bytes used
+
+    :rtype: dict
+    """
+    stats = get_illustration_cache().stats()
+    if _shared_cache is not None:
+        shared_stats = _shared_cache.stats()
+        # Only lookups the shared cache missed reach the local one
+        stats["hits"] += shared_stats["hits"]
+        stats["entries"] += shared_stats["entries"]
+        stats["bytes"] += shared_stats["bytes"]
+    return stats
+
+
+# Crop boxes by absolute image path, loaded once per process
+_crop_box_index = None
+
+
+def get_crop_box_index():
+    """
+    Get this process's crop box index loading it on first use
+
+    :return: The crop box index, empty if it hasn't been built
+
+    :rtype: CropBoxIndex
+    """
+    global _crop_box_index
+    if _crop_box_index is None:
+        _crop_box_index = load_crop_box_index(cfg.crop_box_index_path)
+    return _crop_box_index
+
+
+# Packed illustrations, mapped once per process
+_packed_store = None
+
+
+def get_packed_store():
+    """
+    Get this process's packed illustration store opening it
+    on first use
+
+    :return: The packed store, empty if it hasn't been built
+
+    :rtype: PackedIllustrationStore
+    """
+    global _packed_store
+    if _packed_store is None:
+        _packed_store = PackedIllustrationStore(cfg.packed_store_dir)
+    return _packed_store
+
+
+def decode_page_illustration(path, size):
+    """
+    Open an illustration, crop the black areas around it and
+    resize it to the size of the page. With packed rendering
+    on, illustrations in the packed store are read from it
+
+    :param path: Path to the illustration
+
+    :type path: str
+
+    :param size: Width and height to resize the illustration to
+
+    :type size: tuple
+
+    :return: The grayscale illustration
+
+    :rtype: numpy.ndarray
+    """
+    # Packed illustrations are already cropped so they only
+    # need to be resized
+    if cfg.packed_rendering:
+        with stage_timer("open"):
+            img = get_packed_store().get(os.path.abspath(path))
+        if img is not None:
+            with stage_timer("resize"):
+                img = img.resize(size)
+            return np.asarray(img)
+
+    with stage_timer("open"):
+        img = Image.open(path)
+        full_size = img.size
+        indexed = get_crop_box_index().get(os.path.abspath(path))
+        if indexed is not None and indexed[0] != full_size:
+            indexed = None
+
+        # Let the JPEG decoder skip the detail resizing would throw
+        # away, only the indexed crop box has to cover the page
+        if cfg.draft_decode and img.format == "JPEG":
+            box = indexed[1] if indexed is not None else (0, 0) + full_size
+            img.draft("L", get_draft_size(full_size, box, size))
+        img = img.convert("L")
+
+    # Clean it up by cropping the black areas, looking up
+    # the box if it was indexed for an image of this size
+    with stage_timer("crop"):
+        if indexed is not None:
+            img = img.crop(scale_box(indexed[1], full_size, img.size))
+        else:
+            img_array = np.asarray(img)
+            crop_array = crop_image_only_outside(img_array)
+            img = Image.fromarray(crop_array)
+
+    # Resize it to the page's size as a simple
+    # way to crop differnt parts of it
+    with stage_timer("resize"):
+        img = img.resize(size)
+
+    return np.asarray(img)
+
+
+def load_page_illustration(path, size=None):
+    """
+    Get an illustration cropped and resized to the page from
+    the shared cache or this process's cache, decoding it on a
+    miss. Decoded illustrations are published to the shared
+    cache and only kept locally once it is full
+
+    :param path: Path to the illustration
+
+    :type path: str
+
+    :param size: Width and height to resize the illustration to,
+    defaults to the page size
+
+    :type size: tuple, optional
+
+    :return: The illustration as an "L" image
+
+    :rtype: PIL.Image
+    """
+    if size is None:
+        size = cfg.page_size
+    size = tuple(size)
+
+    key = (path, size)
+    if _shared_cache is not None:
+        array = _shared_cache.get(key)
+        if array is not None:
+            return Image.fromarray(array)
+
+    cache = get_illustration_cache()
+    array = cache.get(key)
+    if array is None:
+        array = decode_page_illustration(path, size)
+        shared_array = None
+        if _shared_cache is not None:
+            shared_array = _shared_cache.put(key, array)
+        if shared_array is not None:
+            array = shared_array
+        else:
+            cache.put(key, array)
+
+    return Image.fromarray(array)
+
+
+# Decoded speech bubble templates of this process. There are
+# only about a hundred templates so they are all kept
+_bubble_templates = {}
+
+
+def load_bubble_template(path):
+    """
+    Get a speech bubble template as an "L" image from this
+    process's cache, decoding it on first use. The image is
+    shared by every bubble made from the template so it must
+    not be changed in place
+
+    :param path: Path to the speech bubble template
+
+    :type path: str
+
+    :return: The template
+
+    :rtype: PIL.Image
+    """
+    template = _bubble_templates.get(path)
+    if template is None:
+        with Image.open(path) as img:
+            template = img.convert("L")
+        _bubble_templates[path] = template
+
+    return template
+
+
+@functools.lru_cache(maxsize=256)
+def load_font(path, size):
+    """
+    Get a font at a size from this process's cache,
+    loading it on a miss
+
+    :param path: Path to the font file
+
+    :type path: str
+
+    :param size: Font size
+
+    :type size: int
+
+    :return: The font
+
+    :rtype: PIL.ImageFont.FreeTypeFont
+    """
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=16384)
+def get_text_size(path, size, text):
+    """
+    Get the width and height of a text in a font at a size,
+    memoized per process
+
+    :param path: Path to the font file
+
+    :type path: str
+
+    :param size: Font size
+
+    :type size: int
+
+    :param text: Text to measure
+
+    :type text: str
+
+    :return: The width and height of the text
+
+    :rtype: tuple
+    """
+    return load_font(path, size).getsize(text)
+
+
+@functools.lru_cache(maxsize=16384)
+def wrap_text(text, width):
+    """
+    Wrap a text into lines of at most width characters,
+    memoized per process
+
+    :param text: Text to wrap
+
+    :type text: str
+
+    :param width: Maximum number of characters in a line
+
+    :type width: int
+
+    :return: The lines
+
+    :rtype: tuple
+    """
+    return tuple(cjkwrap.wrap(text, width=width))
+
+
+def summarize_cache_stats(worker_stats):
+    """
+    Add up the latest illustration cache counters of each
+    render worker
+
+    :param worker_stats: A dictionary of process id to the
+    counters that process reported last
+
+    :type worker_stats: dict
+
+    :return: Summed counters and the overall hit rate
+
+    :rtype: dict
+    """
+    summary = dict(hits=0, misses=0, evictions=0, entries=0, bytes=0)
+    for stats in worker_stats.values():
+        for key in summary:
+            summary[key] += stats[key]
+
+    lookups = summary["hits"] + summary["misses"]
+    summary["hit_rate"] = summary["hits"]/lookups if lookups > 0 else 0.0
+    summary["workers"] = len(worker_stats)
+
+    return summary
@@ -0,0 +1,298 @@
+import heapq
+import itertools
+
+from .. import config_file as cfg
+
+
+def estimate_page_cost(data, weights=None):
+    """
+    Estimate how long a page takes to render relative to other
+    pages from its metadata, as a weighted sum of its panels,
+    speech bubbles and background
+
+    :param data: A dictionary of the page's data
+
+    :type data: dict
+
+    :param weights: Cost of a page, a panel, a speech bubble
+    and a background, defaults to the weights in the config
+
+    :type weights: dict, optional
+
+    :return: The estimated cost
+
+    :rtype: float
+    """
+    if weights is None:
+        weights = cfg.render_cost_weights
+
+    cost = weights['page']
+    cost += weights['panel']*int(data.get('num_panels', 1))
+    cost += weights['bubble']*len(data.get('speech_bubbles', []))
+    if data.get('background') is not None:
+        cost += weights['background']
+
+    return cost
+
+
+def schedule_longest_first(costs):
+    """
+    Order pages longest first so that the pages left at the end
+    of a run are the short ones and workers finish close together
+
+    :param costs: Estimated cost of each page
+
+    :type costs: list
+
+    :return: Indices of the pages in the order to render them
+
+    :rtype: list
+    """
+    return sorted(range(len(costs)), key=lambda idx: -costs[idx])
+
+
+def chunk_by_cost(costs, workers, chunks_per_worker=4):
+    """
+    Split pages in dispatch order into chunks each worth about a
+    fraction of the cost that is still left, so chunks start large
+    to cut down on dispatching and shrink to single pages at the
+    end to balance the last of the work
+
+    :param costs: Estimated cost of each page in dispatch order
+
+    :type costs: list
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :param chunks_per_worker: How many chunks each worker should
+    get out of the remaining cost, defaults to 4
+
+    :type chunks_per_worker: int, optional
+
+    :return: Number of pages in each chunk
+
+    :rtype: list
+    """
+    remaining = float(sum(costs))
+    chunk_sizes = []
+    idx = 0
+    while idx < len(costs):
+        target = remaining/(chunks_per_worker*workers)
+        size = 0
+        chunk_cost = 0.0
+        while idx + size < len(costs) and (size == 0 or
+                                           chunk_cost < target):
+            chunk_cost += costs[idx + size]
+            size += 1
+        chunk_sizes.append(size)
+        remaining -= chunk_cost
+        idx += size
+
+    return chunk_sizes
+
+
+def simulate_makespan(costs, workers, chunk_sizes=None):
+    """
+    Estimate when the last worker finishes if chunks of pages are
+    handed to whichever worker frees up first in the given order
+
+    :param costs: Estimated cost of each page in dispatch order
+
+    :type costs: list
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :param chunk_sizes: Number of pages in each chunk, defaults
+    to a page per chunk
+
+    :type chunk_sizes: list, optional
+
+    :return: The estimated makespan in cost units
+
+    :rtype: float
+    """
+    if chunk_sizes is None:
+        chunk_sizes = [1]*len(costs)
+
+    finish_times = [0.0]*workers
+    idx = 0
+    for size in chunk_sizes:
+        free_at = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, free_at + sum(costs[idx:idx + size]))
+        idx += size
+
+    return max(finish_times)
+
+
+def plan_render_schedule(costs, workers):
+    """
+    Plan a longest first, cost chunked schedule for rendering
+    pages and estimate how much it shortens the tail of the run,
+    the time past a perfectly balanced finish, compared to
+    rendering the pages a page at a time in their listed order
+
+    :param costs: Estimated cost of each page in listed order
+
+    :type costs: list
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :return: The order to render the pages in, the number of
+    pages in each chunk and the estimated tails
+
+    :rtype: tuple
+    """
+    order = schedule_longest_first(costs)
+    scheduled_costs = [costs[idx] for idx in order]
+    chunk_sizes = chunk_by_cost(scheduled_costs, workers)
+
+    balanced = sum(costs)/workers
+    listed_tail = simulate_makespan(costs, workers) - balanced
+    scheduled_tail = simulate_makespan(scheduled_costs, workers,
+                                       chunk_sizes) - balanced
+    estimate = dict(
+        pages=len(costs),
+        chunks=len(chunk_sizes),
+        workers=workers,
+        listed_tail=listed_tail,
+        scheduled_tail=scheduled_tail
+    )
+
+    return order, chunk_sizes, estimate
+
+
+def schedule_in_windows(costed_tasks, workers, window, estimates=None):
+    """
+    Plan a schedule over a bounded window of pages at a time so
+    that pages are read as the workers free up rather than all
+    before rendering starts. Each window is rendered longest first
+    in cost based chunks, the last pages of a window overlap with
+    the first of the next so only the last window's tail is idle
+
+    :param costed_tasks: An iterable of tuples of a task and the
+    estimated cost of its page
+
+    :type costed_tasks: iterable
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :param window: Number of pages planned together
+
+    :type window: int
+
+    :param estimates: A list to add each window's estimated
+    tails from plan_render_schedule to
+
+    :type estimates: list, optional
+
+    :return: A generator of chunks, lists of tasks to hand
+    to a worker together
+
+    :rtype: generator
+    """
+    costed_tasks = iter(costed_tasks)
+    while True:
+        batch = list(itertools.islice(costed_tasks, window))
+        if len(batch) == 0:
+            break
+
+        order, chunk_sizes, estimate = plan_render_schedule(
+            [cost for _, cost in batch], workers)
+        if estimates is not None:
+            estimates.append(estimate)
+
+        idx = 0
+        for size in chunk_sizes:
+            yield [batch[order_idx][0] for order_idx in order[idx:idx + size]]
+            idx += size
+
+
+def merge_schedule_estimates(estimates, workers):
+    """
+    Combine the estimates of the windows of a run. The tails are
+    the last window's since every earlier window's tail is filled
+    by the pages of the next one
+
+    :param estimates: The estimate of each window in order
+
+    :type estimates: list
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :return: The estimated tails of the run
+
+    :rtype: dict
+    """
+    return dict(
+        pages=sum(estimate['pages'] for estimate in estimates),
+        chunks=sum(estimate['chunks'] for estimate in estimates),
+        windows=len(estimates),
+        workers=workers,
+        listed_tail=estimates[-1]['listed_tail'] if estimates else 0.0,
+        scheduled_tail=estimates[-1]['scheduled_tail'] if estimates else 0.0
+    )
+
+
+def measure_tail(finish_times, workers):
+    """
+    Measure how long a run went on with workers idle for lack
+    of pages, from when fewer pages than workers were left
+    unfinished until the last page finished
+
+    :param finish_times: time.perf_counter() value each
+    page finished at
+
+    :type finish_times: list
+
+    :param workers: Number of render workers
+
+    :type workers: int
+
+    :return: The tail in seconds
+
+    :rtype: float
+    """
+    if len(finish_times) <= workers:
+        return 0.0
+
+    finish_times = sorted(finish_times)
+    return finish_times[-1] - finish_times[-workers]
+
+
+def report_render_schedule(estimate, measured_tail=None):
+    """
+    Print how much scheduling shortened the tail of a run
+
+    :param estimate: The estimated tails from plan_render_schedule
+
+    :type estimate: dict
+
+    :param measured_tail: Seconds the run went on with idle
+    workers at the end
+
+    :type measured_tail: float, optional
+    """
+    listed_tail = estimate['listed_tail']
+    scheduled_tail = estimate['scheduled_tail']
+    shrink = 1 - scheduled_tail/listed_tail if listed_tail > 0 else 0.0
+
+    windows = estimate.get('windows', 1)
+    print("Scheduled {pages} pages longest first in {chunks} chunks "
+          "across {workers} workers".format(**estimate)
+          + (" in {} windows".format(windows) if windows > 1 else ""))
+    print("Estimated tail past a balanced finish: {:.1f} -> {:.1f} page "
+          "costs ({:.0%} shorter than in listed order)".format(
+              listed_tail, scheduled_tail, shrink))
+    if measured_tail is not None:
+        print("Measured tail with idle workers: {:.2f}s".format(
+            measured_tail))
@@ -0,0 +1,206 @@
+import os
+import time
+import json
+import contextlib
+import numpy as np
+
+from .. import config_file as cfg
+
+# Seconds spent in each stage while rendering this process's
+# current page, only recorded when render timing is enabled
+_page_timings = {}
+
+
+def record_stage(stage, started):
+    """
+    Add the time since started to a render stage of the current page
+
+    :param stage: Name of the stage
+
+    :type stage: str
+
+    :param started: time.perf_counter() value the stage began at
+
+    :type started: float
+    """
+    if cfg.render_timing:
+        elapsed = time.perf_counter() - started
+        _page_timings[stage] = _page_timings.get(stage, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """
+    Time the code within the with block as a render stage
+    of the current page
+
+    :param stage: Name of the stage
+
+    :type stage: str
+    """
+    if not cfg.render_timing:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, started)
+
+
+def pop_page_timings():
+    """
+    Get the stage timings of the page this process just
+    rendered and start timing the next one
+
+    :return: A dictionary of stage name to seconds, empty
+    if render timing is disabled
+
+    :rtype: dict
+    """
+    global _page_timings
+    timings = _page_timings
+    _page_timings = {}
+
+    return timings
+
+
+class RenderStats(object):
+    """
+    Collects the stage timings of every rendered page across
+    the render workers and summarizes them. Pages skipped since
+    they were already rendered are only counted, so they don't
+    inflate the throughput
+    """
+    def __init__(self):
+
+        self.started = time.perf_counter()
+        self.stage_times = {}
+        self.worker_pages = {}
+        self.worker_seconds = {}
+        self.skipped = 0
+
+    def add(self, pid, timings):
+        """
+        Add the timings of one rendered page
+
+        :param pid: Id of the process that rendered the page
+
+        :type pid: int
+
+        :param timings: A dictionary of stage name to seconds
+        from pop_page_timings, where the "total" stage spans
+        the whole page or the "skipped" stage a page that was
+        already rendered
+
+        :type timings: dict
+        """
+        if "skipped" in timings:
+            self.skip()
+            return
+
+        for stage, seconds in timings.items():
+            self.stage_times.setdefault(stage, []).append(seconds)
+
+        self.worker_pages[pid] = self.worker_pages.get(pid, 0) + 1
+        self.worker_seconds[pid] = (self.worker_seconds.get(pid, 0.0)
+                                    + timings.get("total", 0.0))
+
+    def skip(self, count=1):
+        """
+        Count pages that weren't rendered since they already were
+
+        :param count: Number of skipped pages
+
+        :type count: int, optional
+        """
+        self.skipped += count
+
+    def summary(self):
+        """
+        Summarize the timings per stage and per worker
+
+        :return: A dictionary with the number of rendered and
+        skipped pages, the wall time, rendered pages per second,
+        each stage's count, total, mean,
+        p50 and p95 seconds per page and each worker's number of
+        pages and total seconds spent on them
+
+        :rtype: dict
+        """
+        seconds = time.perf_counter() - self.started
+        pages = sum(self.worker_pages.values())
+
+        stages = {}
+        for stage, times in sorted(self.stage_times.items()):
+            times = np.array(times)
+            stages[stage] = {
+                "count": len(times),
+                "total": float(times.sum()),
+                "mean": float(times.mean()),
+                "p50": float(np.percentile(times, 50)),
+                "p95": float(np.percentile(times, 95))
+            }
+
+        workers = {
+            str(pid): {
+                "pages": self.worker_pages[pid],
+                "seconds": self.worker_seconds[pid]
+            }
+            for pid in sorted(self.worker_pages)
+        }
+
+        return {
+            "pages": pages,
+            "skipped": self.skipped,
+            "seconds": seconds,
+            "pages_per_sec": pages/seconds if seconds > 0 else 0.0,
+            "stages": stages,
+            "workers": workers
+        }
+
+
+def report_render_stats(render_stats, report_path=None):
+    """
+    Print the summary of the render timings and
+    optionally dump it to a JSON file
+
+    :param render_stats: The timings collected while rendering
+
+    :type render_stats: RenderStats
+
+    :param report_path: JSON file to write the summary to,
+    defaults to the path in the config
+
+    :type report_path: str, optional
+
+    :return: The summary
+
+    :rtype: dict
+    """
+    if report_path is None:
+        report_path = cfg.render_timing_path
+
+    summary = render_stats.summary()
+    print("Rendered {pages} pages in {seconds:.1f}s "
+          "({pages_per_sec:.2f} pages/sec) across {workers} workers, "
+          "skipped {skipped} already rendered".format(
+              pages=summary['pages'],
+              seconds=summary['seconds'],
+              pages_per_sec=summary['pages_per_sec'],
+              workers=len(summary['workers']),
+              skipped=summary['skipped']))
+
+    for stage, stats in summary['stages'].items():
+        print("  {:<18} p50 {:8.2f}ms  p95 {:8.2f}ms  total {:8.2f}s".format(
+            stage, stats['p50']*1000, stats['p95']*1000, stats['total']))
+
+    if report_path:
+        report_dir = os.path.dirname(report_path)
+        if report_dir:
+            os.makedirs(report_dir, exist_ok=True)
+        with open(report_path, "w+") as json_file:
+            json.dump(summary, json_file, indent=2)
+
+    return summary
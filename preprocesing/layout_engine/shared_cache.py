@@ -0,0 +1,314 @@
+import hashlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Per slot of the index: a 64 bit hash of the key, 0 for empty
+# slots, and where in the arena the illustration's pixels are
+INDEX_DTYPE = np.dtype([
+    ("key", np.uint64),
+    ("offset", np.int64),
+    ("width", np.int32),
+    ("height", np.int32)
+])
+
+# Bytes used in the arena and number of entries, before the slots
+HEADER_BYTES = 16
+
+
+def hash_key(key):
+    """
+    Hash a cache key to the 64 bit number stored in the index
+
+    :param key: Key to hash, its repr must identify it
+
+    :type key: hashable
+
+    :return: A non zero hash
+
+    :rtype: int
+    """
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "little") or 1
+
+
+def open_shared_memory(name):
+    """
+    Attach to an existing shared memory segment without this
+    process taking ownership of it, so that a worker exiting
+    doesn't unlink a segment the other workers still use
+
+    :param name: Name of the segment
+
+    :type name: str
+
+    :return: The segment
+
+    :rtype: multiprocessing.shared_memory.SharedMemory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with the
+        # resource tracker, which the workers share with the process
+        # that created it so it is already registered there
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedIllustrationCache(object):
+    """
+    A cache of decoded, cropped and page resized illustrations
+    that every render worker can read. The pixels are kept back
+    to back in one shared memory arena with a small open addressing
+    hash index in a second segment. The first worker to decode an
+    illustration publishes it and the others map it without copying.
+    Entries are never evicted since other workers may be using them,
+    illustrations that don't fit the budget any more are not published
+    so memory stays bounded by the budget however many workers there
+    are.
+
+    The process that creates the cache owns the segments and must
+    unlink them, workers attach with the names and lock from
+    get_attach_args
+
+    :param arena: Segment holding the pixels
+
+    :type arena: multiprocessing.shared_memory.SharedMemory
+
+    :param index: Segment holding the header and the index
+
+    :type index: multiprocessing.shared_memory.SharedMemory
+
+    :param lock: Lock shared by every process using the cache
+
+    :type lock: multiprocessing.Lock
+
+    :param owner: Whether this process created the segments
+
+    :type owner: bool, optional
+    """
+    def __init__(self, arena, index, lock, owner=False):
+        """
+        Constructor method
+        """
+        self.arena = arena
+        self.index = index
+        self.lock = lock
+        self.owner = owner
+
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=index.buf)
+        num_slots = (index.size - HEADER_BYTES)//INDEX_DTYPE.itemsize
+        self.slots = np.ndarray((num_slots,), dtype=INDEX_DTYPE,
+                                buffer=index.buf, offset=HEADER_BYTES)
+        self.pixels = np.ndarray((arena.size,), dtype=np.uint8,
+                                 buffer=arena.buf)
+
+        # Counters of this process only
+        self.hits = 0
+        self.misses = 0
+        self.entries = 0
+        self.bytes = 0
+
+    @classmethod
+    def create(cls, max_bytes, num_slots, lock):
+        """
+        Create the shared memory segments of a new, empty cache
+
+        :param max_bytes: Bytes of pixels the cache holds at most
+
+        :type max_bytes: int
+
+        :param num_slots: Number of slots in the index, at most
+        three quarters of them are filled
+
+        :type num_slots: int
+
+        :param lock: Lock shared by every process using the cache
+
+        :type lock: multiprocessing.Lock
+
+        :return: The cache, owned by this process
+
+        :rtype: SharedIllustrationCache
+        """
+        arena = shared_memory.SharedMemory(create=True, size=max_bytes)
+        index = shared_memory.SharedMemory(
+            create=True,
+            size=HEADER_BYTES + num_slots*INDEX_DTYPE.itemsize
+        )
+        cache = cls(arena, index, lock, owner=True)
+        cache.header[:] = 0
+        cache.slots[:] = np.zeros(1, dtype=INDEX_DTYPE)
+        return cache
+
+    @classmethod
+    def attach(cls, arena_name, index_name, lock):
+        """
+        Attach to a cache another process created
+
+        :param arena_name: Name of the pixel segment
+
+        :type arena_name: str
+
+        :param index_name: Name of the index segment
+
+        :type index_name: str
+
+        :param lock: Lock shared by every process using the cache
+
+        :type lock: multiprocessing.Lock
+
+        :return: The cache
+
+        :rtype: SharedIllustrationCache
+        """
+        return cls(open_shared_memory(arena_name),
+                   open_shared_memory(index_name),
+                   lock)
+
+    def get_attach_args(self):
+        """
+        Get the arguments workers attach to this cache with
+
+        :return: The names of the segments and the lock
+
+        :rtype: tuple
+        """
+        return self.arena.name, self.index.name, self.lock
+
+    def find_slot(self, key_hash):
+        """
+        Find the slot of a key or the empty slot it would go in,
+        the lock must be held
+
+        :param key_hash: Hash of the key
+
+        :type key_hash: int
+
+        :return: Index of the slot
+
+        :rtype: int
+        """
+        num_slots = len(self.slots)
+        slot = key_hash % num_slots
+        while True:
+            stored = int(self.slots[slot]['key'])
+            if stored == key_hash or stored == 0:
+                return slot
+            slot = (slot + 1) % num_slots
+
+    def view(self, slot):
+        """
+        Get a read only array of the pixels of an entry
+
+        :param slot: Index of the entry's slot
+
+        :type slot: int
+
+        :return: The illustration
+
+        :rtype: numpy.ndarray
+        """
+        entry = self.slots[slot]
+        offset = int(entry['offset'])
+        width, height = int(entry['width']), int(entry['height'])
+        array = self.pixels[offset:offset + width*height]
+        array = array.reshape(height, width)
+        array.setflags(write=False)
+        return array
+
+    def get(self, key):
+        """
+        Get an illustration if any process has published it
+
+        :param key: Key of the illustration
+
+        :type key: hashable
+
+        :return: The illustration sharing the arena's memory
+        or None if it hasn't been published
+
+        :rtype: numpy.ndarray
+        """
+        key_hash = hash_key(key)
+        with self.lock:
+            slot = self.find_slot(key_hash)
+            found = int(self.slots[slot]['key']) == key_hash
+
+        if not found:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.view(slot)
+
+    def put(self, key, array):
+        """
+        Publish a 2D uint8 illustration so that the other
+        workers can use it
+
+        :param key: Key of the illustration
+
+        :type key: hashable
+
+        :param array: The illustration
+
+        :type array: numpy.ndarray
+
+        :return: The published illustration sharing the arena's
+        memory, or None if there is no room left for it
+
+        :rtype: numpy.ndarray
+        """
+        key_hash = hash_key(key)
+        height, width = array.shape
+        with self.lock:
+            slot = self.find_slot(key_hash)
+
+            # Another worker decoded it at the same time
+            if int(self.slots[slot]['key']) == key_hash:
+                return self.view(slot)
+
+            used, count = int(self.header[0]), int(self.header[1])
+            if (used + array.nbytes > len(self.pixels)
+                    or 4*(count + 1) > 3*len(self.slots)):
+                return None
+
+            self.pixels[used:used + array.nbytes] = array.reshape(-1)
+            self.slots[slot] = (key_hash, used, width, height)
+            self.header[0] = used + array.nbytes
+            self.header[1] = count + 1
+
+        self.entries += 1
+        self.bytes += array.nbytes
+        return self.view(slot)
+
+    def stats(self):
+        """
+        Return the counters of this process, summing them over
+        every worker gives the totals of the cache
+
+        :return: A dictionary of hits, misses and the entries
+        and bytes this process published
+
+        :rtype: dict
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            entries=self.entries,
+            bytes=self.bytes
+        )
+
+    def close(self):
+        """
+        Detach from the segments, unlinking them if
+        this process created them
+        """
+        # The arrays have to go before the buffers are released
+        self.header = self.slots = self.pixels = None
+        for segment in [self.arena, self.index]:
+            segment.close()
+            if self.owner:
+                segment.unlink()
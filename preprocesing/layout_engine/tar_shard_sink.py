@@ -0,0 +1,261 @@
+import os
+import io
+import json
+import uuid
+import tarfile
+from multiprocessing import util
+from PIL import Image
+
+from .. import config_file as cfg
+
+tar_suffix = ".tar"
+tmp_suffix = ".tar.tmp"
+index_suffix = ".idx.json"
+
+
+class TarShardWriter(object):
+    """
+    Writes rendered pages and their metadata into tar shards of a
+    fixed number of pages in the WebDataset layout, i.e. every page
+    is a group of members sharing its name as the key.
+
+    A shard is written under a temporary name and only renamed to
+    its final name once it is full or the writer is closed and its
+    index has been written, so a finished .tar is always complete
+
+    :param shard_dir: Directory to write the shards to
+
+    :type shard_dir: str
+
+    :param shard_size: Number of pages per shard, defaults
+    to the size in the config
+
+    :type shard_size: int, optional
+    """
+    def __init__(self, shard_dir, shard_size=None):
+
+        if shard_size is None:
+            shard_size = cfg.tar_shard_size
+
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+
+        # Every writer gets its own prefix so workers of
+        # the same or later runs never share a shard
+        self.prefix = "pages-" + uuid.uuid4().hex[:12]
+        self.next_shard = 0
+
+        self.tar = None
+        self.shard_path = None
+        self.members = []
+        self.pages = []
+
+    def open_shard(self):
+        """
+        Start writing the next shard
+        """
+        self.shard_path = os.path.join(
+            self.shard_dir,
+            "{}-{:05d}".format(self.prefix, self.next_shard)
+        )
+        self.tar = tarfile.open(self.shard_path+tmp_suffix, "w")
+        self.next_shard += 1
+        self.members = []
+        self.pages = []
+
+    def add_member(self, name, content):
+        """
+        Add a file to the current shard and record
+        where its content starts
+
+        :param name: Name of the member
+
+        :type name: str
+
+        :param content: Bytes of the member
+
+        :type content: bytes
+        """
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        self.tar.addfile(info, io.BytesIO(content))
+
+        # The content ends the archive padded to whole blocks
+        blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            blocks += 1
+        offset = self.tar.offset - blocks*tarfile.BLOCKSIZE
+        self.members.append([name, offset, info.size])
+
+    def add_page(self, name, img, data):
+        """
+        Add a rendered page and its metadata to the current shard
+
+        :param name: Name of the page
+
+        :type name: str
+
+        :param img: The rendered page
+
+        :type img: PIL.Image
+
+        :param data: A dictionary of the page's data
+
+        :type data: dict
+        """
+        if self.tar is None:
+            self.open_shard()
+
+        extension = cfg.output_format
+        image_bytes = io.BytesIO()
+        img.save(image_bytes,
+                 format=Image.registered_extensions()[extension])
+
+        self.add_member(name+extension, image_bytes.getvalue())
+        self.add_member(name+".json", json.dumps(data).encode())
+        self.pages.append(name)
+
+        if len(self.pages) >= self.shard_size:
+            self.close()
+
+    def close(self):
+        """
+        Finish the current shard by writing its index
+        and giving it its final name
+        """
+        if self.tar is None:
+            return
+
+        self.tar.close()
+        self.tar = None
+
+        with open(self.shard_path+index_suffix, "w+") as index_file:
+            json.dump({"pages": self.pages, "members": self.members},
+                      index_file)
+        os.replace(self.shard_path+tmp_suffix, self.shard_path+tar_suffix)
+
+
+# The writer of this process
+_tar_shard_writer = None
+
+
+def get_tar_shard_writer(shard_dir):
+    """
+    Get this process's tar shard writer, creating it on first use.
+    The writer's last shard is finished when the process exits
+
+    :param shard_dir: Directory to write the shards to
+
+    :type shard_dir: str
+
+    :return: The process's writer
+
+    :rtype: TarShardWriter
+    """
+    global _tar_shard_writer
+    if _tar_shard_writer is None or _tar_shard_writer.shard_dir != shard_dir:
+        if _tar_shard_writer is not None:
+            _tar_shard_writer.close()
+        _tar_shard_writer = TarShardWriter(shard_dir)
+        util.Finalize(_tar_shard_writer,
+                      _tar_shard_writer.close,
+                      exitpriority=10)
+
+    return _tar_shard_writer
+
+
+def get_tar_shard_paths(shard_dir):
+    """
+    Find the complete tar shards of a directory
+
+    :param shard_dir: Directory of the shards
+
+    :type shard_dir: str
+
+    :return: Paths of the complete shards in name order
+
+    :rtype: list
+    """
+    if not os.path.isdir(shard_dir):
+        return []
+
+    names = sorted(entry.name for entry in os.scandir(shard_dir)
+                   if entry.name.endswith(tar_suffix))
+
+    return [os.path.join(shard_dir, name) for name in names]
+
+
+def load_tar_shard_index(shard_path):
+    """
+    Load the index of a tar shard
+
+    :param shard_path: Path of the shard
+
+    :type shard_path: str
+
+    :return: A dictionary of the page names in the shard in order
+    and each member's name, data offset and size
+
+    :rtype: dict
+    """
+    index_path = shard_path[:-len(tar_suffix)]+index_suffix
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def get_completed_pages(shard_dir):
+    """
+    Get the names of the pages that are in complete shards
+    so a rerun can skip rendering them
+
+    :param shard_dir: Directory of the shards
+
+    :type shard_dir: str
+
+    :return: Names of the completed pages
+
+    :rtype: set
+    """
+    completed = set()
+    for shard_path in get_tar_shard_paths(shard_dir):
+        completed.update(load_tar_shard_index(shard_path)['pages'])
+
+    return completed
+
+
+def discard_unfinished_shard(shard_path):
+    """
+    Delete a shard if it was never finished, e.g. because its
+    worker was killed, so its pages can be rendered again
+
+    :param shard_path: Path of the shard without its suffix
+
+    :type shard_path: str
+
+    :return: Whether the shard was unfinished
+
+    :rtype: bool
+    """
+    if os.path.isfile(shard_path+tar_suffix):
+        return False
+
+    if os.path.isfile(shard_path+tmp_suffix):
+        os.remove(shard_path+tmp_suffix)
+    return True
+
+
+def remove_incomplete_shards(shard_dir):
+    """
+    Delete shards a previous run didn't finish. Their pages
+    aren't in any complete shard so they will be rendered again
+
+    :param shard_dir: Directory of the shards
+
+    :type shard_dir: str
+    """
+    if not os.path.isdir(shard_dir):
+        return
+
+    for entry in os.scandir(shard_dir):
+        if entry.name.endswith(tmp_suffix):
+            os.remove(entry.path)
@@ -0,0 +1,350 @@
+import os
+import itertools
+import concurrent.futures
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from .layout_engine.helpers import get_crop_box, get_draft_size
+from .crop_box_index import find_indexed_name
+from . import config_file as cfg
+
+
+def get_blob_path(store_dir, blob):
+    """
+    Get the path of one of a packed store's blobs
+
+    :param store_dir: Directory of the packed store
+
+    :type store_dir: str
+
+    :param blob: Number of the blob
+
+    :type blob: int
+
+    :return: Path of the blob
+
+    :rtype: str
+    """
+    return os.path.join(store_dir, "blob-{:05d}.bin".format(blob))
+
+
+def get_index_path(store_dir):
+    """
+    Get the path of a packed store's index
+
+    :param store_dir: Directory of the packed store
+
+    :type store_dir: str
+
+    :return: Path of the index
+
+    :rtype: str
+    """
+    return os.path.join(store_dir, "index.npz")
+
+
+def pack_single_image(task):
+    """
+    Decode one illustration to grayscale, crop the black areas
+    around it and scale it down to just cover a maximum size
+
+    :param task: A tuple of the illustration's path and the size
+    to cover or None to keep the cropped resolution
+
+    :type task: tuple
+
+    :return: The width and height of the packed illustration and
+    its pixels or None if it can't be read
+
+    :rtype: tuple
+    """
+    image_path, max_size = task
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert("L")
+    except (OSError, ValueError):
+        return None
+
+    img = img.crop(get_crop_box(np.asarray(img)))
+    if img.width == 0 or img.height == 0:
+        return None
+
+    if max_size is not None:
+        size = get_draft_size(img.size, (0, 0) + img.size, max_size)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+
+    return img.width, img.height, img.tobytes()
+
+
+def pack_image_chunk(tasks):
+    """
+    Pack a chunk of illustrations one after the other in a worker,
+    noting when each one was last changed before reading it
+
+    :param tasks: A list of pack_single_image arguments
+
+    :type tasks: list
+
+    :return: The path, modification time in nanoseconds and
+    pack_single_image result of each illustration
+
+    :rtype: list
+    """
+    results = []
+    for task in tasks:
+        try:
+            mtime = os.stat(task[0]).st_mtime_ns
+        except OSError:
+            results.append((task[0], 0, None))
+            continue
+        results.append((task[0], mtime, pack_single_image(task)))
+
+    return results
+
+
+def build_packed_store(image_dir, store_dir=None, max_size=None,
+                       blob_max_bytes=None, chunksize=8,
+                       max_in_flight=None):
+    """
+    Concurrently and in parallel crop every illustration in a
+    directory and pack their grayscale pixels back to back into
+    large binary blobs, along with an index of each one's blob,
+    offset, shape and modification time. Only a bounded number of
+    chunks of illustrations are packed at once so their pixels
+    don't pile up waiting to be written. Blobs and the index are
+    written under temporary names and swapped in once complete
+
+    :param image_dir: Directory of BW illustrations
+
+    :type image_dir: str
+
+    :param store_dir: Directory to write the store to, defaults
+    to the directory in the config
+
+    :type store_dir: str, optional
+
+    :param max_size: Size the illustrations are scaled down to
+    cover, defaults to the size in the config
+
+    :type max_size: tuple, optional
+
+    :param blob_max_bytes: Bytes after which a new blob is started,
+    defaults to the limit in the config
+
+    :type blob_max_bytes: int, optional
+
+    :param chunksize: Number of illustrations sent to a worker at once
+
+    :type chunksize: int, optional
+
+    :param max_in_flight: Maximum number of chunks being packed,
+    defaults to twice the number of CPUs
+
+    :type max_in_flight: int, optional
+
+    :return: The number of packed illustrations and blobs
+
+    :rtype: tuple
+    """
+    if store_dir is None:
+        store_dir = cfg.packed_store_dir
+    if max_size is None and cfg.packed_max_size is not None:
+        max_size = tuple(cfg.packed_max_size)
+    if blob_max_bytes is None:
+        blob_max_bytes = cfg.packed_blob_max_bytes
+    if max_in_flight is None:
+        max_in_flight = 2*(os.cpu_count() or 1)
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    names = sorted(entry.name for entry in os.scandir(image_dir)
+                   if entry.is_file())
+    tasks = ((os.path.join(image_dir, name), max_size) for name in names)
+
+    packed_names = []
+    locations = []
+    blob = 0
+    offset = 0
+    blob_file = open(get_blob_path(store_dir, blob) + ".tmp", "wb")
+    progress = tqdm(total=len(names))
+    in_flight = set()
+
+    def collect(future):
+        nonlocal blob, offset, blob_file
+        in_flight.remove(future)
+        results = future.result()
+        for image_path, mtime, result in results:
+            if result is None:
+                continue
+            width, height, pixels = result
+
+            if offset > 0 and offset + len(pixels) > blob_max_bytes:
+                blob_file.close()
+                blob += 1
+                offset = 0
+                blob_file = open(get_blob_path(store_dir, blob) + ".tmp",
+                                 "wb")
+
+            blob_file.write(pixels)
+            packed_names.append(os.path.basename(image_path))
+            locations.append((blob, offset, width, height, mtime))
+            offset += len(pixels)
+        progress.update(len(results))
+
+    print("Packing", len(names), "images into", store_dir)
+    try:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            while True:
+                chunk = list(itertools.islice(tasks, chunksize))
+                if len(chunk) == 0:
+                    break
+                in_flight.add(executor.submit(pack_image_chunk, chunk))
+
+                # Write a packed chunk before packing any more
+                if len(in_flight) >= max_in_flight:
+                    done, _ = concurrent.futures.wait(
+                        in_flight,
+                        return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        collect(future)
+
+            for future in concurrent.futures.as_completed(list(in_flight)):
+                collect(future)
+    finally:
+        blob_file.close()
+        progress.close()
+
+    for number in range(blob + 1):
+        blob_path = get_blob_path(store_dir, number)
+        os.replace(blob_path + ".tmp", blob_path)
+
+    # Blobs left over from a previous, larger store
+    number = blob + 1
+    while os.path.isfile(get_blob_path(store_dir, number)):
+        os.remove(get_blob_path(store_dir, number))
+        number += 1
+
+    index_path = get_index_path(store_dir)
+    # Chunks finish in any order but the index is kept
+    # in name order so it can be searched
+    packed_names = np.array(packed_names, dtype=str)
+    order = np.argsort(packed_names, kind="stable")
+    locations = np.array(locations, dtype=np.int64).reshape(-1, 5)[order]
+    with open(index_path + ".tmp", "wb") as index_file:
+        np.savez(
+            index_file,
+            image_dir=np.array(os.path.abspath(image_dir)),
+            names=packed_names[order],
+            blobs=locations[:, 0].astype(np.int32),
+            offsets=locations[:, 1],
+            shapes=locations[:, 2:4].astype(np.int32),
+            mtimes=locations[:, 4]
+        )
+    os.replace(index_path + ".tmp", index_path)
+
+    print("Packed", len(packed_names), "images into", blob + 1, "blobs")
+
+    return len(packed_names), blob + 1
+
+
+class PackedIllustrationStore(object):
+    """
+    A read only view of a packed store. The blobs are memory
+    mapped once and illustrations are handed out as images
+    backed directly by the mapping, so getting one doesn't
+    decode anything. The index is kept as its sorted columns
+    and an illustration changed since it was packed is left
+    for its file to be decoded instead
+
+    :param store_dir: Directory of the packed store, defaults
+    to the directory in the config
+
+    :type store_dir: str, optional
+    """
+    def __init__(self, store_dir=None):
+
+        if store_dir is None:
+            store_dir = cfg.packed_store_dir
+
+        self.store_dir = store_dir
+        self.image_dir = None
+        self.names = np.array([], dtype=str)
+        self.blobs = {}
+
+        index_path = get_index_path(store_dir)
+        if not os.path.isfile(index_path):
+            return
+
+        with np.load(index_path) as index:
+            # Stores packed before modification times were
+            # recorded can't tell stale illustrations apart
+            if 'mtimes' not in index.files:
+                print("Ignoring the packed store in", store_dir,
+                      "since it was built without modification times,",
+                      "rebuild it with --pack_images")
+                return
+
+            self.image_dir = str(index['image_dir'])
+            self.names = index['names']
+            self.blob_numbers = index['blobs']
+            self.offsets = index['offsets']
+            self.shapes = index['shapes']
+            self.mtimes = index['mtimes']
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_blob(self, blob):
+        """
+        Get a blob mapping it on first use
+
+        :param blob: Number of the blob
+
+        :type blob: int
+
+        :return: The blob's bytes
+
+        :rtype: numpy.memmap
+        """
+        mapped = self.blobs.get(blob)
+        if mapped is None:
+            mapped = np.memmap(get_blob_path(self.store_dir, blob),
+                               dtype=np.uint8, mode="r")
+            self.blobs[blob] = mapped
+        return mapped
+
+    def get(self, path):
+        """
+        Get a packed illustration
+
+        :param path: Absolute path of the original illustration
+
+        :type path: str
+
+        :return: The cropped illustration as an "L" image sharing
+        the blob's memory or None if it isn't packed or its file
+        changed since it was
+
+        :rtype: PIL.Image
+        """
+        position = find_indexed_name(self.image_dir, self.names, path)
+        if position is None:
+            return None
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self.mtimes[position]:
+            return None
+
+        blob = int(self.blob_numbers[position])
+        offset = int(self.offsets[position])
+        width, height = self.shapes[position].tolist()
+        pixels = self.get_blob(blob)[offset:offset + width*height]
+
+        return Image.frombuffer("L", (width, height), pixels,
+                                "raw", "L", 0, 1)
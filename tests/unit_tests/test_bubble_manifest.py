@@ -0,0 +1,51 @@
+import os
+from PIL import Image
+
+from preprocesing import bubble_manifest
+from preprocesing.bubble_manifest import (
+    update_bubble_manifest, load_bubble_manifest
+)
+
+
+def test_update_bubble_manifest(tmp_path, monkeypatch):
+    """
+    This tests whether the manifest records bubble sizes and
+    only opens files which are new or have changed
+    """
+    files = []
+    for i, size in enumerate([(100, 80), (60, 40), (30, 20)]):
+        path = str(tmp_path / "bubble_{}.png".format(i))
+        Image.new("L", size, 255).save(path)
+        files.append(path)
+
+    manifest_path = str(tmp_path / "manifest.json")
+    manifest = update_bubble_manifest(files, manifest_path)
+
+    assert manifest == load_bubble_manifest(manifest_path)
+    assert manifest[files[0]]['size'] == [100, 80]
+    assert manifest[files[0]]['default_area'][0]['points'] == [
+        [20.0, 16.0], [80.0, 16.0], [80.0, 64.0], [20.0, 64.0]
+    ]
+
+    opened = []
+    original_open = Image.open
+
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return original_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(bubble_manifest.Image, "open", counting_open)
+
+    # Nothing changed so nothing is opened
+    assert update_bubble_manifest(files, manifest_path) == manifest
+    assert opened == []
+
+    # A replaced file is read again and a dropped one is removed
+    Image.new("L", (10, 50), 255).save(files[1])
+    stat = os.stat(files[1])
+    os.utime(files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    manifest = update_bubble_manifest(files[:2], manifest_path)
+
+    assert opened == [files[1]]
+    assert manifest[files[1]]['size'] == [10, 50]
+    assert files[2] not in load_bubble_manifest(manifest_path)
@@ -0,0 +1,131 @@
+import os
+import csv
+import concurrent.futures
+from PIL import Image
+
+from preprocesing import convert_images
+from preprocesing.convert_images import (
+    convert_images_to_bw, convert_single_image
+)
+
+
+def test_convert_images_to_bw(tmp_path):
+    """
+    This tests whether images in every folder are converted,
+    failures are reported and converted images are skipped
+    when the conversion is run again
+    """
+    image_dir = tmp_path / "images"
+    for folder in ["0000", "0001"]:
+        (image_dir / folder).mkdir(parents=True)
+        for i in range(3):
+            Image.new("RGB", (20, 10), (200, 10, 10)).save(
+                str(image_dir / folder / "{}{}.jpg".format(folder, i)))
+    (image_dir / "0001" / "broken.jpg").write_bytes(b"not an image")
+    (image_dir / "0001" / "notes.txt").write_text("skip me")
+
+    output_dir = str(tmp_path / "bw")
+    errors_file = str(tmp_path / "errors.csv")
+
+    summary = convert_images_to_bw(str(image_dir) + os.sep, output_dir,
+                                   errors_file, chunksize=2)
+    assert (summary['converted'], summary['skipped'],
+            summary['failed']) == (6, 0, 1)
+
+    converted = sorted(os.listdir(output_dir))
+    assert converted == sorted("{}{}.jpg".format(folder, i)
+                               for folder in ["0000", "0001"]
+                               for i in range(3))
+    with Image.open(os.path.join(output_dir, converted[0])) as img:
+        assert img.mode == "L"
+
+    with open(errors_file) as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows[0] == ["image_path", "error"]
+    assert rows[1][0].endswith("broken.jpg")
+
+    summary = convert_images_to_bw(str(image_dir) + os.sep, output_dir,
+                                   errors_file)
+    assert (summary['converted'], summary['skipped'],
+            summary['failed']) == (0, 6, 1)
+
+    # Errors of an earlier run aren't left listed once they're fixed
+    (image_dir / "0001" / "broken.jpg").unlink()
+    summary = convert_images_to_bw(str(image_dir) + os.sep, output_dir,
+                                   errors_file)
+    assert summary['failed'] == 0
+    assert not os.path.exists(errors_file)
+
+
+def test_convert_single_image_caps_resolution(tmp_path):
+    """
+    This tests whether a capped conversion scales the image
+    down to just cover the maximum size
+    """
+    image_path = str(tmp_path / "large.jpg")
+    Image.new("RGB", (800, 400), (10, 200, 10)).save(image_path)
+    output_dir = str(tmp_path / "bw")
+    os.makedirs(output_dir)
+
+    _, status, error = convert_single_image(
+        (image_path, output_dir, (100, 100), True))
+    assert (status, error) == ("converted", None)
+
+    with Image.open(os.path.join(output_dir, "large.jpg")) as img:
+        assert img.mode == "L"
+        assert img.size == (200, 100)
+
+    # Changing the cap converts the image again even though
+    # it is newer than its source
+    assert convert_single_image(
+        (image_path, output_dir, (100, 100), True))[1] == "skipped"
+    assert convert_single_image(
+        (image_path, output_dir, None, True))[1] == "converted"
+    with Image.open(os.path.join(output_dir, "large.jpg")) as img:
+        assert img.size == (800, 400)
+    assert convert_single_image(
+        (image_path, output_dir, None, True))[1] == "skipped"
+
+
+def test_convert_images_to_bw_bounds_chunks_in_flight(tmp_path, monkeypatch):
+    """
+    This tests whether images are only found as chunks of them
+    finish converting rather than all before converting starts
+    """
+    image_dir = tmp_path / "images" / "0000"
+    image_dir.mkdir(parents=True)
+    for i in range(10):
+        Image.new("RGB", (20, 10)).save(str(image_dir / "{}.jpg".format(i)))
+
+    finished = []
+    found = []
+    convert = convert_images.convert_single_image
+    iter_paths = convert_images.iter_image_paths
+
+    def counting_convert(task):
+        result = convert(task)
+        finished.append(task[0])
+        return result
+
+    def counting_iter(image_dir):
+        for image_path in iter_paths(image_dir):
+            found.append(len(finished))
+            yield image_path
+
+    monkeypatch.setattr(convert_images, "convert_single_image",
+                        counting_convert)
+    monkeypatch.setattr(convert_images, "iter_image_paths", counting_iter)
+    monkeypatch.setattr(convert_images.concurrent.futures,
+                        "ProcessPoolExecutor",
+                        concurrent.futures.ThreadPoolExecutor)
+
+    summary = convert_images_to_bw(str(tmp_path / "images") + os.sep,
+                                   str(tmp_path / "bw"),
+                                   str(tmp_path / "errors.csv"),
+                                   chunksize=2, max_in_flight=2)
+    assert summary['converted'] == 10
+
+    # Images of a chunk are only found once all but the last
+    # of the chunks before it have finished
+    assert all(num_finished >= 2*(i//2 - 1)
+               for i, num_finished in enumerate(found))
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+from PIL import Image
+
+from preprocesing.crop_box_index import (
+    build_crop_box_index, load_crop_box_index
+)
+from preprocesing.layout_engine import render_cache
+from preprocesing.layout_engine.helpers import crop_image_only_outside
+from preprocesing import config_file as cfg
+
+
+def test_crop_box_index_matches_scan(tmp_path, monkeypatch):
+    """
+    This tests whether indexed crop boxes are the same as scanning
+    the image and whether rendering uses them
+    """
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+
+    arrays = []
+    for i in range(3):
+        array = np.zeros((50 + i, 40), dtype=np.uint8)
+        array[3+i:40, 2:30+i] = 200
+        Image.fromarray(array).save(str(image_dir / "{}.png".format(i)))
+        arrays.append(array)
+
+    # Unreadable files are left out of the index
+    (image_dir / "broken.png").write_bytes(b"not an image")
+
+    index_path = str(tmp_path / "index.npz")
+    build_crop_box_index(str(image_dir), index_path)
+    index = load_crop_box_index(index_path)
+
+    assert len(index) == 3
+    for i, array in enumerate(arrays):
+        path = os.path.abspath(str(image_dir / "{}.png".format(i)))
+        size, box = index.get(path)
+        left, upper, right, lower = box
+        assert size == (40, 50 + i)
+        assert np.array_equal(array[upper:lower, left:right],
+                              crop_image_only_outside(array))
+
+    assert index.get(os.path.abspath(str(image_dir / "broken.png"))) is None
+    assert index.get(os.path.abspath(str(tmp_path / "0.png"))) is None
+
+    monkeypatch.setattr(cfg, "crop_box_index_path", index_path)
+    monkeypatch.setattr(render_cache, "_crop_box_index", None)
+
+    decoded = render_cache.decode_page_illustration(
+        str(image_dir / "0.png"), (20, 30)
+    )
+    expected = Image.fromarray(crop_image_only_outside(arrays[0]))
+    assert np.array_equal(decoded, np.asarray(expected.resize((20, 30))))
+
+    monkeypatch.setattr(render_cache, "_crop_box_index", None)
@@ -1,6 +1,10 @@
+import os
+import json
 import pytest
 import numpy as np
+import pandas as pd
 from copy import deepcopy
+from PIL import Image
 from preprocesing.layout_engine.page_dataset_creator import (
     draw_n_shifted,
     draw_n,
@@ -8,7 +12,9 @@ from preprocesing.layout_engine.page_dataset_creator import (
     single_slice_panels,
     box_transform_panels,
     box_transform_page,
-    get_base_panels
+    get_base_panels,
+    create_page_metadata_parallel,
+    build_speech_bubble_catalog
 )
 from preprocesing.layout_engine.helpers import invert_for_next, get_leaf_panels
 from preprocesing.layout_engine.page_object_classes import Panel, Page
@@ -1061,3 +1067,89 @@ def test_get_base_panels(num_panels, layout_type, layout_choice):
     # Currently only sees if the orientations are correct
     hiearchy = {}
     assess_hiearchy(page, hiearchy)
+
+
+def test_create_page_metadata_parallel_is_reproducible(tmp_path):
+    """
+    This function tests whether seeded page metadata comes out
+    the same regardless of the number of worker processes
+    """
+    bubble_path = str(tmp_path / "bubble.png")
+    Image.new("L", (100, 80), 255).save(bubble_path)
+
+    image_dir = ["{}.jpg".format(i) for i in range(50)]
+    catalog = build_speech_bubble_catalog([bubble_path], pd.DataFrame())
+
+    outputs = []
+    for workers in [1, 3]:
+        metadata_dir = str(tmp_path / "metadata_{}".format(workers)) + os.sep
+        os.makedirs(metadata_dir)
+        names = create_page_metadata_parallel(12,
+                                              42,
+                                              image_dir,
+                                              "images/",
+                                              [],
+                                              [],
+                                              [bubble_path],
+                                              catalog,
+                                              metadata_dir,
+                                              workers=workers)
+        files = {}
+        for name in names:
+            with open(metadata_dir+name+".json") as json_file:
+                files[name] = json_file.read()
+        outputs.append((names, files))
+
+    assert len(set(outputs[0][0])) == 12
+    assert outputs[0] == outputs[1]
+
+
+def test_build_speech_bubble_catalog(tmp_path):
+    """
+    This function tests whether the speech bubble catalog finds
+    writing areas by full path, then by filename and otherwise
+    falls back to the default area
+    """
+    files = []
+    for i, size in enumerate([(100, 80), (60, 40), (30, 20), (50, 50)]):
+        path = str(tmp_path / "bubble_{}.png".format(i))
+        Image.new("L", size, 255).save(path)
+        files.append(path)
+
+    area = [{"points": [[1, 2], [3, 4]], "shape_type": "polygon"}]
+    tags = pd.DataFrame({
+        'imagename': [files[0], "elsewhere/bubble_1.png", files[2]],
+        'label': [json.dumps(area), json.dumps(area), "not json"]
+    })
+
+    catalog = build_speech_bubble_catalog(files, tags)
+
+    assert catalog[files[0]] == (area, (100, 80))
+    assert catalog[files[1]] == (area, (60, 40))
+
+    default_area = catalog[files[3]][0]
+    assert default_area[0]["points"] == [[10, 10], [90, 10],
+                                         [90, 90], [10, 90]]
+    assert catalog[files[2]] == (default_area, (30, 20))
+
+
+def test_build_speech_bubble_catalog_skips_unreadable(tmp_path, capsys):
+    """
+    This function tests whether a speech bubble template that
+    can't be read is reported and left out of the catalog
+    """
+    readable = str(tmp_path / "bubble.png")
+    Image.new("L", (40, 30), 255).save(readable)
+    broken = str(tmp_path / "broken.png")
+    with open(broken, "wb") as broken_file:
+        broken_file.write(b"not an image")
+    missing = str(tmp_path / "missing.png")
+
+    catalog = build_speech_bubble_catalog([readable, broken, missing],
+                                          pd.DataFrame())
+
+    assert list(catalog) == [readable]
+    assert catalog[readable][1] == (40, 30)
+    output = capsys.readouterr().out
+    assert broken in output
+    assert missing in output
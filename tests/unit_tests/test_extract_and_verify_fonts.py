@@ -0,0 +1,64 @@
+import numpy as np
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+from preprocesing.extract_and_verify_fonts import (
+    init_coverage_worker, get_font_coverage, save_font_coverage,
+    load_font_coverage
+)
+
+
+def build_font(font_path, chars):
+    """
+    Build a tiny TrueType font with an empty glyph for each character
+    """
+    glyph_names = [".notdef"] + ["glyph{}".format(idx)
+                                 for idx in range(len(chars))]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_names)
+    builder.setupCharacterMap({ord(char): name
+                               for char, name in zip(chars, glyph_names[1:])})
+    empty = TTGlyphPen(None).glyph()
+    builder.setupGlyf({name: empty for name in glyph_names})
+    builder.setupHorizontalMetrics({name: (500, 0) for name in glyph_names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Test", "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(font_path)
+
+
+def test_font_coverage_matches_cmap(tmp_path):
+    """
+    This tests whether a font's coverage is exactly the characters
+    in its cmap and whether the coverage matrix is saved and loaded
+    back for a number of characters that isn't a multiple of 8
+    """
+    chars = list("ABCあいう漢字。X")
+    assert len(chars) % 8 != 0
+    covered = set("Aあ漢。")
+
+    font_path = str(tmp_path / "test.ttf")
+    build_font(font_path, sorted(covered))
+    broken_path = str(tmp_path / "broken.ttf")
+    with open(broken_path, "wb") as broken_file:
+        broken_file.write(b"not a font")
+
+    init_coverage_worker(np.array([ord(char) for char in chars],
+                                  dtype=np.int64))
+    font_coverage = get_font_coverage(font_path)
+    assert font_coverage.tolist() == [char in covered for char in chars]
+    assert get_font_coverage(broken_path) is None
+
+    coverage = np.zeros((2, len(chars)), dtype=bool)
+    coverage[0] = font_coverage
+    coverage[1, -1] = True
+    coverage_path = str(tmp_path / "coverage.npz")
+    save_font_coverage(coverage_path, [font_path, broken_path], chars,
+                       coverage)
+
+    font_paths, loaded_chars, loaded = load_font_coverage(coverage_path)
+    assert font_paths == [font_path, broken_path]
+    assert loaded_chars == chars
+    assert loaded.shape == coverage.shape
+    assert np.array_equal(loaded, coverage)
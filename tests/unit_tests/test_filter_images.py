@@ -0,0 +1,247 @@
+import os
+import json
+import cv2
+import numpy as np
+
+import filter_images
+from filter_images import (
+    detect_text_easyocr, new_strategy_stats, prescreen_text_likelihood,
+    parse_args, load_decisions, filter_shard, get_output_names,
+    merge_stats, write_filtered_images, run_filter_chunks
+)
+
+
+class FakeReader(object):
+    """
+    Stands in for an EasyOCR reader, finding text only in images
+    scaled to the given height
+    """
+    def __init__(self, text_height=None):
+        self.text_height = text_height
+        self.calls = []
+
+    def readtext(self, img):
+        self.calls.append(img.shape)
+        if img.shape[0] == self.text_height:
+            return [([(0, 0), (1, 0), (1, 1), (0, 1)], "text", 0.9)]
+        return []
+
+
+def test_detect_text_easyocr_shares_ocr_between_strategies(monkeypatch):
+    """
+    This tests whether each preprocessing profile is built and
+    read once however many strategies use it
+    """
+    built = []
+    preprocess = filter_images.preprocess_image_for_easyocr
+
+    def counting_preprocess(img_gray, scale_factor, gaussian_blur_ksize):
+        built.append((scale_factor, gaussian_blur_ksize))
+        return preprocess(img_gray, scale_factor, gaussian_blur_ksize)
+
+    monkeypatch.setattr(filter_images, "preprocess_image_for_easyocr",
+                        counting_preprocess)
+    img_gray = np.full((20, 30), 255, dtype=np.uint8)
+    reader = FakeReader()
+    strategy_stats = new_strategy_stats()
+
+    contains_text, _, strategy, _, _, _ = detect_text_easyocr(
+        reader, img_gray, "blank.png", strategy_stats)
+
+    assert not contains_text
+    assert strategy == "N/A"
+    assert len(filter_images.STRATEGIES_TO_TRY) == 4
+    assert sorted(reader.calls) == [(20, 30), (40, 60), (50, 75)]
+    assert sorted(built) == [(1.0, 0), (2.0, 0), (2.5, 0)]
+    assert [stats["attempts"] for stats in strategy_stats.values()] == \
+        [1, 1, 1, 1]
+    assert [stats["hits"] for stats in strategy_stats.values()] == \
+        [0, 0, 0, 0]
+
+
+def test_detect_text_easyocr_counts_detecting_strategy():
+    """
+    This tests whether strategies stop at the first to detect
+    text and only that one counts a hit
+    """
+    img_gray = np.full((20, 30), 255, dtype=np.uint8)
+    reader = FakeReader(text_height=40)
+    strategy_stats = new_strategy_stats()
+
+    contains_text, snippet, strategy, _, _, _ = detect_text_easyocr(
+        reader, img_gray, "text.png", strategy_stats)
+
+    assert contains_text
+    assert snippet == "text"
+    assert strategy == "/".join(filter_images.STRATEGIES_TO_TRY[1])
+    assert reader.calls == [(50, 75), (40, 60)]
+    assert [(stats["attempts"], stats["hits"])
+            for stats in strategy_stats.values()] == \
+        [(1, 0), (1, 1), (0, 0), (0, 0)]
+
+
+def test_prescreen_text_likelihood():
+    """
+    This tests whether a blank page is let through as having no
+    text while a page of rendered glyphs is sent to OCR
+    """
+    blank = np.full((1200, 800), 255, dtype=np.uint8)
+    verdict, features = prescreen_text_likelihood(blank)
+    assert verdict == "no_text"
+    assert features["edge_density"] == 0.0
+
+    page = blank.copy()
+    for row in range(12):
+        cv2.putText(page, "THE QUICK BROWN FOX {}".format(row),
+                    (40, 80 + row*90), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 0, 3)
+    verdict, features = prescreen_text_likelihood(page, all_features=True)
+    assert verdict == "ambiguous"
+    assert features["text_components"] > \
+        filter_images.PRESCREEN_THRESHOLDS["max_text_components"]
+
+
+def test_prescreen_is_off_by_default():
+    """
+    This tests whether every image goes to OCR unless the
+    uncalibrated pre-screen is turned on
+    """
+    assert not parse_args([]).prescreen
+    assert parse_args(["--prescreen"]).prescreen
+
+
+def test_filter_shard_resumes_after_truncated_line(tmp_path, monkeypatch):
+    """
+    This tests whether a log line cut short by a crash is dropped
+    without taking the first record appended on resume with it
+    """
+    log_dir = str(tmp_path)
+    log_path = os.path.join(log_dir, "decisions-000.jsonl")
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        log_file.write(json.dumps({"path": "a.jpg", "verdict": "keep"}))
+        log_file.write("\n")
+        log_file.write('{"path": "b.jpg", "verd')
+
+    assert list(load_decisions(log_dir)) == ["a.jpg"]
+
+    def classify(reader, src_path, fname, *args):
+        return {"path": fname, "verdict": "skip", "strategy": "fake",
+                "confidence": 0.9, "snippet": ""}
+
+    monkeypatch.setattr(filter_images, "classify_image", classify)
+    filter_shard(0, ["b.jpg", "c.jpg"], str(tmp_path), log_dir)
+
+    decisions = load_decisions(log_dir)
+    assert sorted(decisions) == ["a.jpg", "b.jpg", "c.jpg"]
+    assert decisions["b.jpg"]["verdict"] == "skip"
+
+
+def test_run_filter_chunks_carries_on_after_failures(tmp_path, monkeypatch):
+    """
+    This tests whether a chunk that raises and a worker that dies
+    only lose their own files, which are left undecided for a
+    resumed run, while every other chunk is still decided
+    """
+    def classify(reader, src_path, fname, *args):
+        if fname == "c.jpg":
+            os._exit(1)
+        if fname == "d.jpg":
+            raise ValueError("unreadable")
+        return {"path": fname, "verdict": "keep", "strategy": "fake",
+                "confidence": 0.9, "snippet": ""}
+
+    monkeypatch.setattr(filter_images, "init_filter_worker",
+                        lambda *args: None)
+    monkeypatch.setattr(filter_images, "classify_image", classify)
+    log_dir = str(tmp_path)
+    fnames = ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg", "f.jpg"]
+
+    _, _, failed = run_filter_chunks(fnames, log_dir, log_dir, 1, False, 1,
+                                     chunk_size=1, max_in_flight=1)
+
+    assert failed == 2
+    assert sorted(load_decisions(log_dir)) == ["a.jpg", "b.jpg",
+                                               "e.jpg", "f.jpg"]
+
+
+def test_get_output_names():
+    """
+    This tests whether kept images are named the same on every
+    run, in name order when numbered
+    """
+    decisions = {
+        "c.png": {"verdict": "keep"},
+        "a.jpg": {"verdict": "keep"},
+        "b.jpg": {"verdict": "skip"}
+    }
+
+    assert get_output_names(decisions) == [("a.jpg", "a.jpg"),
+                                           ("c.png", "c.png")]
+    assert get_output_names(decisions, rename_sequential=True) == [
+        ("a.jpg", "1.jpg"), ("c.png", "2.jpg")]
+
+
+def test_merge_stats():
+    """
+    This tests whether nested and flat worker counters are summed
+    """
+    total = {}
+    merge_stats(total, {"s": {"attempts": 1, "hits": 1}, "no_text": 2})
+    merge_stats(total, {"s": {"attempts": 2, "hits": 0}, "no_text": 3,
+                        "ambiguous": 1})
+
+    assert total == {"s": {"attempts": 3, "hits": 1}, "no_text": 5,
+                     "ambiguous": 1}
+
+
+def test_write_filtered_images_replaces_shifted_names(tmp_path):
+    """
+    This tests whether resuming numbered output after a source
+    image was added replaces files holding a different source
+    and keeps the ones already right
+    """
+    src_dir, dst_dir = tmp_path / "src", tmp_path / "dst"
+    src_dir.mkdir()
+    for name in ["b.jpg", "c.jpg"]:
+        (src_dir / name).write_bytes(name.encode("utf-8"))
+    decisions = {name: {"verdict": "keep"} for name in ["b.jpg", "c.jpg"]}
+
+    assert write_filtered_images(decisions, str(src_dir), str(dst_dir),
+                                 rename_sequential=True) == (2, 0, 0)
+    assert write_filtered_images(decisions, str(src_dir), str(dst_dir),
+                                 rename_sequential=True) == (0, 0, 0)
+
+    (src_dir / "a.jpg").write_bytes(b"a.jpg")
+    decisions["a.jpg"] = {"verdict": "keep"}
+    assert write_filtered_images(decisions, str(src_dir), str(dst_dir),
+                                 rename_sequential=True) == (3, 0, 2)
+    assert [(dst_dir / "{}.jpg".format(k)).read_bytes()
+            for k in [1, 2, 3]] == [b"a.jpg", b"b.jpg", b"c.jpg"]
+
+
+def test_write_filtered_images_copies_when_linking_fails(tmp_path,
+                                                        monkeypatch):
+    """
+    This tests whether images are copied when they can't be
+    hard linked, e.g. across file systems
+    """
+    src_dir, dst_dir = tmp_path / "src", tmp_path / "dst"
+    src_dir.mkdir()
+    for name in ["a.jpg", "b.jpg"]:
+        (src_dir / name).write_bytes(name.encode("utf-8"))
+    decisions = {"a.jpg": {"verdict": "keep"}, "b.jpg": {"verdict": "keep"}}
+
+    def cross_device_link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(filter_images.os, "link", cross_device_link)
+    assert write_filtered_images(decisions, str(src_dir), str(dst_dir),
+                                 mode="hardlink") == (2, 2, 0)
+
+    for name in ["a.jpg", "b.jpg"]:
+        assert (dst_dir / name).read_bytes() == name.encode("utf-8")
+        assert os.stat(str(dst_dir / name)).st_ino != \
+            os.stat(str(src_dir / name)).st_ino
+
+    # The copies are recognized as holding their sources on resume
+    assert write_filtered_images(decisions, str(src_dir), str(dst_dir),
+                                 mode="hardlink") == (0, 0, 0)
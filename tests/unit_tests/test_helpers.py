@@ -4,7 +4,12 @@ from preprocesing.layout_engine.helpers import (
                         get_min_area_panels,
                         move_child_to_line,
                         move_children_to_line,
-                        invert_for_next
+                        invert_for_next,
+                        get_polygon_bbox,
+                        shift_polygon,
+                        find_largest_fitting,
+                        get_draft_size,
+                        scale_box
 )
 
 from preprocesing.layout_engine.page_dataset_creator import (
@@ -216,3 +221,65 @@ def test_move_children_to_line(horizontal_vertical, line_direction, change):
 
         # float comparison
         assert diff < 1e-12
+
+
+def test_get_polygon_bbox():
+    """
+    This function tests whether the bounding box of a polygon
+    is padded, clipped to the image and shifted properly
+    """
+    polygon = ((10.5, 20), (100, 20), (100, 200), (10.5, 200), (10.5, 20))
+
+    assert get_polygon_bbox(polygon, (1700, 2400)) == (9, 19, 102, 202)
+    assert get_polygon_bbox(polygon, (50, 100)) == (9, 19, 50, 100)
+    assert get_polygon_bbox(polygon, (5, 5)) is None
+
+    shifted = shift_polygon(polygon, 9, 19)
+    assert shifted[0] == (1.5, 1)
+    assert len(shifted) == len(polygon)
+
+
+@pytest.mark.parametrize("low, high", [(0, 0), (3, 20), (10, 5)])
+def test_find_largest_fitting(low, high):
+    """
+    This tests whether the binary search finds the same value
+    as trying every value from the largest down
+    """
+    for limit in range(-1, 25):
+        expected = None
+        for value in range(high, low - 1, -1):
+            if value <= limit:
+                expected = value
+                break
+
+        assert find_largest_fitting(low, high,
+                                    lambda value: value <= limit) == expected
+
+
+def test_get_draft_size_covers_target():
+    """
+    This tests whether the requested draft size keeps the
+    box at least as large as the target and never asks
+    for more than the full resolution
+    """
+    image_size = (4000, 3000)
+    box = (500, 300, 3500, 2700)
+    target = (1700, 1200)
+
+    draft_size = get_draft_size(image_size, box, target)
+    scaled = scale_box(box, image_size, draft_size)
+    assert scaled[2] - scaled[0] >= target[0]
+    assert scaled[3] - scaled[1] >= target[1]
+    assert draft_size[0] < image_size[0]
+
+    assert get_draft_size(image_size, box, (3200, 100)) == image_size
+
+
+def test_scale_box_rounds_outwards():
+    """
+    This tests whether a scaled box contains the scaled region
+    and is unchanged when the size is
+    """
+    box = (3, 5, 17, 19)
+    assert scale_box(box, (20, 20), (20, 20)) == box
+    assert scale_box(box, (20, 20), (10, 10)) == (1, 2, 9, 10)
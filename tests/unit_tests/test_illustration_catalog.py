@@ -0,0 +1,174 @@
+import os
+import pickle
+import numpy as np
+from PIL import Image
+
+from preprocesing import illustration_catalog
+from preprocesing.illustration_catalog import (
+    build_illustration_catalog, load_illustration_catalog,
+    write_filtered_manifest, load_filtered_manifest
+)
+from preprocesing.layout_engine.helpers import crop_image_only_outside
+from preprocesing import config_file as cfg
+
+
+def test_illustration_catalog(tmp_path, monkeypatch):
+    """
+    This tests whether the catalog records valid illustrations in
+    name order, leaves out unreadable ones and is updated incrementally
+    """
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+
+    arrays = {}
+    for name, shape in [("b.png", (50, 40)), ("a.png", (30, 60)),
+                        ("c.png", (20, 20))]:
+        array = np.zeros(shape, dtype=np.uint8)
+        array[2:-3, 4:-1] = 100
+        Image.fromarray(array).save(str(image_dir / name))
+        arrays[name] = array
+    (image_dir / "broken.png").write_bytes(b"not an image")
+
+    catalog_path = str(tmp_path / "catalog.npy")
+    assert build_illustration_catalog(str(image_dir), catalog_path) == (3, 1)
+
+    catalog = load_illustration_catalog(catalog_path)
+    assert list(catalog) == ["a.png", "b.png", "c.png"]
+    assert len(catalog) == 3
+    assert catalog[-1] == "c.png"
+
+    record = catalog.records[0]
+    assert (record['width'], record['height']) == (60, 30)
+    left, upper, right, lower = record['crop_box']
+    assert record['aspect_ratio'] == np.float32(55/25)
+    assert np.array_equal(arrays["a.png"][upper:lower, left:right],
+                          crop_image_only_outside(arrays["a.png"]))
+    assert record['mean_intensity'] == np.float32(arrays["a.png"].mean())
+
+    # Workers get a catalog mapping the same file
+    assert list(pickle.loads(pickle.dumps(catalog))) == list(catalog)
+
+    # Only the changed file is read again
+    analyzed = []
+    analyze = illustration_catalog.analyze_illustration
+
+    def counting_analyze(path):
+        analyzed.append(os.path.basename(path))
+        return analyze(path)
+
+    monkeypatch.setattr(illustration_catalog, "analyze_illustration",
+                        counting_analyze)
+    monkeypatch.setattr(illustration_catalog.concurrent.futures,
+                        "ProcessPoolExecutor",
+                        illustration_catalog.concurrent.futures
+                        .ThreadPoolExecutor)
+    os.remove(str(image_dir / "c.png"))
+    Image.fromarray(arrays["b.png"][:, :20]).save(str(image_dir / "b.png"))
+    stat = os.stat(str(image_dir / "b.png"))
+    os.utime(str(image_dir / "b.png"),
+             ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert build_illustration_catalog(str(image_dir), catalog_path) == (2, 1)
+    assert analyzed == ["b.png"]
+
+    catalog = load_illustration_catalog(catalog_path)
+    assert list(catalog) == ["a.png", "b.png"]
+    assert catalog.records[1]['width'] == 20
+
+
+def test_choose_by_aspect(tmp_path, monkeypatch):
+    """
+    This tests whether illustrations are picked from the ones
+    closest to the asked for aspect ratio
+    """
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    widths = [10, 20, 30, 40, 50, 60, 80, 100]
+    for width in widths:
+        Image.new("L", (width, 40), 100).save(
+            str(image_dir / "{:03d}.png".format(width)))
+
+    catalog_path = str(tmp_path / "catalog.npy")
+    build_illustration_catalog(str(image_dir), catalog_path)
+    catalog = load_illustration_catalog(catalog_path)
+
+    ratios = catalog.aspect_index['aspect_ratio']
+    assert np.all(np.diff(ratios) >= 0)
+
+    monkeypatch.setattr(cfg, "illustration_aspect_tolerance", 0.2)
+    monkeypatch.setattr(cfg, "illustration_aspect_min_candidates", 1)
+    rng = np.random.RandomState(0)
+    picked = set(catalog.choose_by_aspect(1.0, rng) for _ in range(50))
+    assert picked == {"040.png"}
+
+    picked = set(catalog.choose_by_aspect(1.4, rng) for _ in range(50))
+    assert picked == {"050.png", "060.png"}
+
+    # Too few within the tolerance so the closest ones are used
+    monkeypatch.setattr(cfg, "illustration_aspect_min_candidates", 3)
+    picked = set(catalog.choose_by_aspect(5.0, rng) for _ in range(50))
+    assert picked == {"060.png", "080.png", "100.png"}
+
+
+def test_filtered_manifest(tmp_path):
+    """
+    This tests whether a manifest of filtered illustrations is read
+    back and only the listed illustrations are cataloged
+    """
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for name in ["a.png", "b.png", "c.png"]:
+        Image.new("L", (20, 10), 100).save(str(image_dir / name))
+
+    manifest_path = str(tmp_path / "filtered.json")
+    assert load_filtered_manifest(manifest_path) is None
+
+    write_filtered_manifest(str(image_dir), ["c.png", "a.png"], manifest_path)
+    manifest_dir, names = load_filtered_manifest(manifest_path)
+    assert manifest_dir == str(image_dir)
+    assert names == ["a.png", "c.png"]
+
+    catalog_path = str(tmp_path / "catalog.npy")
+    assert build_illustration_catalog(manifest_dir, catalog_path,
+                                      names=names) == (2, 0)
+    assert list(load_illustration_catalog(catalog_path)) == names
+
+
+def test_catalog_only_used_with_its_images(tmp_path, capsys):
+    """
+    This tests whether a catalog built from one directory or
+    filtered set isn't used for another and isn't reused when
+    cataloging another directory
+    """
+    dirs = {}
+    for dir_name, width in [("images", 20), ("renamed", 40)]:
+        dirs[dir_name] = tmp_path / dir_name
+        dirs[dir_name].mkdir()
+        for name in ["a.png", "b.png"]:
+            Image.new("L", (width, 10), 100).save(
+                str(dirs[dir_name] / name))
+
+    catalog_path = str(tmp_path / "catalog.npy")
+    build_illustration_catalog(str(dirs["images"]), catalog_path)
+
+    assert list(load_illustration_catalog(
+        catalog_path, image_dir=str(dirs["images"]) + os.sep)) == \
+        ["a.png", "b.png"]
+    assert load_illustration_catalog(
+        catalog_path, image_dir=str(dirs["renamed"])) is None
+    assert load_illustration_catalog(
+        catalog_path, image_dir=str(dirs["images"]),
+        names=["a.png"]) is None
+    assert "--catalog_images" in capsys.readouterr().out
+
+    # Same names and times in another directory are read again
+    for name in ["a.png", "b.png"]:
+        stat = os.stat(str(dirs["images"] / name))
+        os.utime(str(dirs["renamed"] / name),
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    build_illustration_catalog(str(dirs["renamed"]), catalog_path,
+                               names=["a.png"])
+    catalog = load_illustration_catalog(
+        catalog_path, image_dir=str(dirs["renamed"]), names=["a.png"])
+    assert list(catalog) == ["a.png"]
+    assert catalog.records[0]['width'] == 40
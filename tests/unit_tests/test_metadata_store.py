@@ -0,0 +1,100 @@
+import os
+import json
+import gzip
+import pytest
+
+from preprocesing.layout_engine.metadata_store import (
+    MetadataStore, get_shard_paths, iter_metadata_store,
+    load_store_index, read_store_page, count_store_pages,
+    iter_store_records, read_store_record, index_suffix
+)
+from preprocesing.layout_engine.page_dataset_creator import get_base_panels
+from preprocesing.layout_engine.page_object_classes import Page
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_metadata_store_round_trip(tmp_path, compress):
+    """
+    This tests whether pages written to a store are read back
+    in order, by name and across shards and reopened stores
+    """
+    store_dir = str(tmp_path / "store")
+    pages = [get_base_panels(num_panels=n) for n in [1, 2, 3, 4, 5]]
+
+    with MetadataStore(store_dir, shard_size=2, compress=compress) as store:
+        for page in pages[:3]:
+            page.dump_data(store_dir, dry=False, store=store)
+
+    # Reopening starts a new shard rather than touching old ones
+    with MetadataStore(store_dir, shard_size=2, compress=compress) as store:
+        for page in pages[3:]:
+            store.append(page.dump_dict())
+
+    shard_paths = get_shard_paths(store_dir)
+    assert len(shard_paths) == 3
+    assert all(path.endswith(".gz") == compress for path in shard_paths)
+
+    expected = [json.loads(json.dumps(page.dump_dict())) for page in pages]
+    assert list(iter_metadata_store(store_dir)) == expected
+    assert count_store_pages(store_dir) == 5
+
+    index = load_store_index(store_dir)
+    for data in reversed(expected):
+        assert read_store_page(store_dir, data['name'], index) == data
+
+    loaded = Page()
+    loaded.load_data(pages[2].name, store_dir=store_dir)
+    assert json.loads(json.dumps(loaded.dump_dict())) == expected[2]
+
+
+def test_metadata_store_dry(tmp_path):
+    """
+    This tests whether a dry dump doesn't create any shards
+    """
+    store_dir = str(tmp_path / "store")
+    with MetadataStore(store_dir) as store:
+        get_base_panels(num_panels=2).dump_data(store_dir, store=store)
+
+    assert not os.path.exists(store_dir)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_metadata_store_survives_crash_before_indexing(tmp_path, compress):
+    """
+    This tests whether a page written to a shard but not indexed
+    before a crash is skipped by readers and cut off when the
+    store is reopened, so pages and locations stay paired
+    """
+    store_dir = str(tmp_path / "store")
+    pages = [get_base_panels(num_panels=n) for n in [1, 2, 3, 4]]
+    expected = [json.loads(json.dumps(page.dump_dict())) for page in pages]
+
+    with MetadataStore(store_dir, compress=compress) as store:
+        for data in expected[:2]:
+            store.append(data)
+    shard_path = get_shard_paths(store_dir)[0]
+    indexed_size = os.path.getsize(shard_path)
+
+    # The crash left a page without its index line
+    # and half of another page's index line
+    record = json.dumps(expected[2]).encode() + b"\n"
+    if compress:
+        record = gzip.compress(record)
+    with open(shard_path, "ab") as shard_file:
+        shard_file.write(record)
+    with open(shard_path+index_suffix, "a") as index_file:
+        index_file.write(expected[3]['name']+"\t12")
+
+    records = list(iter_store_records(store_dir))
+    assert [data for _, data in records] == expected[:2]
+    for location, data in records:
+        assert read_store_record(*location) == data
+    assert count_store_pages(store_dir) == 2
+    assert sorted(load_store_index(store_dir)) == \
+        sorted(data['name'] for data in expected[:2])
+
+    with MetadataStore(store_dir, compress=compress) as store:
+        store.append(expected[3])
+    assert os.path.getsize(shard_path) == indexed_size
+    assert list(iter_metadata_store(store_dir)) == [expected[0], expected[1],
+                                                    expected[3]]
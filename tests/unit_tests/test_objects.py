@@ -1,15 +1,23 @@
 import pytest
 import json
 import pandas as pd
+import numpy as np
 import os
+from PIL import Image, ImageDraw
 
+from preprocesing.layout_engine import page_object_classes
 from preprocesing.layout_engine.page_object_classes import (
                                 Page, Panel, SpeechBubble
                                 )
+from preprocesing.layout_engine.render_cache import wrap_text
 from preprocesing.layout_engine.page_dataset_creator import (
-                                get_base_panels, populate_panels
+                                get_base_panels, populate_panels,
+                                add_transforms, shrink_panels
                                 )
-from preprocesing.layout_engine.helpers import get_leaf_panels
+from preprocesing.layout_engine.helpers import (
+                                get_leaf_panels, crop_image_only_outside
+                                )
+from preprocesing import config_file as cfg
 
 
 @pytest.fixture(scope="module")
@@ -276,3 +284,87 @@ def test_page_rendering(num_panels, speech_bubbles, data_files):
         page = populate_panels(page, *data_files)
 
     page.render(show=False)
+
+
+@pytest.mark.parametrize("num_panels", [2, 5, 8])
+def test_page_rendering_matches_full_page_masks(num_panels, tmp_path):
+    """
+    This tests whether compositing panels within their bounding
+    boxes renders the same page as pasting each illustration
+    through a full page mask
+
+    :param num_panels: Number of panels to render
+
+    :type num_panels: int
+    """
+    illustration = np.zeros((300, 200), dtype=np.uint8)
+    illustration[5:-5, 5:-5] = np.random.randint(1, 255, (290, 190))
+    image_path = str(tmp_path / "illustration.png")
+    Image.fromarray(illustration).save(image_path)
+
+    page = get_base_panels(num_panels=num_panels)
+    page = add_transforms(page)
+    page = shrink_panels(page)
+    for panel in page.leaf_children:
+        panel.image = image_path
+
+    W, H = cfg.page_size
+    expected = Image.new(size=(W, H), mode="L", color="white")
+    draw_rect = ImageDraw.Draw(expected)
+    crop = crop_image_only_outside(illustration)
+    img = Image.fromarray(crop).resize((W, H))
+    for panel in page.leaf_children:
+        rect = panel.get_polygon()
+        mask = Image.new("L", cfg.page_size, 0)
+        ImageDraw.Draw(mask).polygon(rect, fill=255)
+        draw_rect.line(rect, fill="black", width=cfg.boundary_width)
+        expected.paste(img, (0, 0), mask)
+
+    rendered = page.render(show=False)
+
+    assert np.array_equal(np.asarray(rendered), np.asarray(expected))
+
+
+@pytest.mark.parametrize("max_extent", [20, 150, 400, 900, 5000])
+def test_speech_bubble_fit_text(max_extent, monkeypatch):
+    """
+    This tests whether fitting text with a binary search over font
+    sizes gives the same lines and font size as reducing the font
+    size one at a time
+    """
+    def get_text_size(font, font_size, text):
+        return (len(text)*font_size, font_size + 4)
+
+    monkeypatch.setattr(page_object_classes, "get_text_size", get_text_size)
+
+    text = "吾輩は猫である。名前はまだ無い。"*5
+    bubble = SpeechBubble(texts=[{}], text_indices=[0], font="font.ttf",
+                          speech_bubble="bubble.png", writing_areas=[],
+                          resize_to=5000, location=[0, 0],
+                          width=100, height=100,
+                          transforms=[], transform_metadata={})
+    bubble.font_size = cfg.max_font_size
+
+    size = get_text_size(None, bubble.font_size, text)
+    text_segments, size = bubble.fit_text(text, size, 600, 580, max_extent)
+
+    # The one by one search
+    font_size = cfg.max_font_size
+    expected_size = get_text_size(None, font_size, text)
+    expected_segments = [text]
+    max_chars = int(600//(expected_size[0]/len(text)))
+    if expected_size[0] > 600 and max_chars > 1:
+        expected_segments = list(wrap_text(text, max_chars))
+    while len(expected_segments)*expected_size[1] > max_extent:
+        if font_size > cfg.min_font_size:
+            font_size -= 1
+            expected_size = get_text_size(None, font_size, text)
+            max_chars = int(580//(expected_size[0]/len(text)))
+            if max_chars > 1:
+                expected_segments = list(wrap_text(text, max_chars))
+        else:
+            expected_segments.pop()
+
+    assert bubble.font_size == font_size
+    assert size == expected_size
+    assert text_segments == expected_segments
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+from PIL import Image
+
+from preprocesing.packed_store import (
+    build_packed_store, PackedIllustrationStore, get_blob_path
+)
+from preprocesing.layout_engine import render_cache
+from preprocesing.layout_engine.helpers import crop_image_only_outside
+from preprocesing import config_file as cfg
+
+
+def make_illustrations(image_dir, count):
+    """
+    Write grayscale PNG illustrations with black borders
+    of different sizes
+    """
+    os.makedirs(image_dir)
+    rng = np.random.RandomState(3)
+    paths = []
+    for i in range(count):
+        array = np.zeros((30 + i, 20 + 2*i), dtype=np.uint8)
+        array[3:25, 2:18] = rng.randint(1, 255, (22, 16))
+        path = os.path.join(image_dir, "{}.png".format(i))
+        Image.fromarray(array).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_packed_store_matches_cropped_images(tmp_path):
+    """
+    This tests whether every readable illustration is packed
+    cropped across several blobs and unreadable ones are left out
+    """
+    image_dir = str(tmp_path / "images")
+    paths = make_illustrations(image_dir, 5)
+    with open(os.path.join(image_dir, "broken.png"), "wb") as broken:
+        broken.write(b"not an image")
+
+    store_dir = str(tmp_path / "packed")
+    packed, blobs = build_packed_store(image_dir, store_dir,
+                                       max_size=(1000, 1000),
+                                       blob_max_bytes=800)
+    assert packed == 5
+    assert blobs > 1
+    assert os.path.isfile(get_blob_path(store_dir, blobs - 1))
+
+    store = PackedIllustrationStore(store_dir)
+    assert len(store) == 5
+    for path in paths:
+        with Image.open(path) as img:
+            expected = crop_image_only_outside(np.asarray(img.convert("L")))
+        assert np.array_equal(np.asarray(store.get(os.path.abspath(path))),
+                              expected)
+
+    assert store.get(os.path.abspath(os.path.join(image_dir,
+                                                  "broken.png"))) is None
+
+
+def test_packed_rendering_matches_decoding(tmp_path, monkeypatch):
+    """
+    This tests whether an illustration read from an uncapped
+    packed store is the same as one decoded from its file
+    """
+    image_dir = str(tmp_path / "images")
+    paths = make_illustrations(image_dir, 2)
+    store_dir = str(tmp_path / "packed")
+    monkeypatch.setattr(cfg, "packed_max_size", None)
+    build_packed_store(image_dir, store_dir)
+
+    size = (170, 240)
+    monkeypatch.setattr(cfg, "packed_rendering", False)
+    decoded = render_cache.decode_page_illustration(paths[1], size)
+
+    monkeypatch.setattr(cfg, "packed_rendering", True)
+    monkeypatch.setattr(cfg, "packed_store_dir", store_dir)
+    monkeypatch.setattr(render_cache, "_packed_store", None)
+    packed = render_cache.decode_page_illustration(paths[1], size)
+
+    assert np.array_equal(packed, decoded)
+
+
+def test_packed_store_skips_changed_images(tmp_path):
+    """
+    This tests whether an illustration changed after it was packed
+    is left to be decoded instead of read from the stale blob, and
+    whether a bounded build packs every illustration
+    """
+    image_dir = str(tmp_path / "images")
+    paths = make_illustrations(image_dir, 6)
+    store_dir = str(tmp_path / "packed")
+    packed, _ = build_packed_store(image_dir, store_dir,
+                                   max_size=(1000, 1000), chunksize=1,
+                                   max_in_flight=2)
+    assert packed == 6
+
+    store = PackedIllustrationStore(store_dir)
+    assert list(store.names) == sorted(os.listdir(image_dir))
+    assert store.get(os.path.abspath(paths[0])) is not None
+
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.get(os.path.abspath(paths[0])) is None
+    assert store.get(os.path.abspath(paths[1])) is not None
+
+    os.remove(paths[1])
+    assert store.get(os.path.abspath(paths[1])) is None
@@ -0,0 +1,396 @@
+import os
+import json
+import tarfile
+import pytest
+import numpy as np
+from PIL import Image
+
+from preprocesing.layout_engine import page_creator, render_cache
+from preprocesing.layout_engine.page_creator import (
+    create_single_page, stream_render_pages, render_pages
+)
+from preprocesing.layout_engine.metadata_store import MetadataStore
+from preprocesing import config_file as cfg
+from preprocesing.layout_engine.tar_shard_sink import (
+    get_tar_shard_paths, load_tar_shard_index, get_completed_pages
+)
+from preprocesing.layout_engine.page_dataset_creator import get_base_panels
+from preprocesing.layout_engine.helpers import get_leaf_panels
+
+
+@pytest.fixture
+def pages(tmp_path):
+    """
+    A few pages whose panels are filled with a small illustration
+    """
+    illustration = np.zeros((120, 80), dtype=np.uint8)
+    illustration[4:-4, 4:-4] = 128
+    image_path = str(tmp_path / "illustration.png")
+    Image.fromarray(illustration).save(image_path)
+
+    pages = []
+    for num_panels in [1, 3, 5]:
+        page = get_base_panels(num_panels=num_panels)
+        leaf_panels = []
+        get_leaf_panels(page, leaf_panels)
+        for panel in leaf_panels:
+            panel.image = image_path
+        pages.append(page)
+
+    return pages
+
+
+def test_stream_render_pages(pages, tmp_path):
+    """
+    This tests whether streamed pages are rendered and their
+    metadata is still written and renders the same page
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(metadata_dir)
+    os.makedirs(images_dir)
+
+    stream_render_pages(iter(pages), metadata_dir, images_dir,
+                        max_in_flight=2)
+
+    for page in pages:
+        metadata_file = metadata_dir+page.name+".json"
+        image_file = images_dir+page.name+".png"
+        assert os.path.isfile(image_file)
+
+        with open(metadata_file) as json_file:
+            assert json.load(json_file)['name'] == page.name
+
+        # Rendering from the written file gives the same image
+        streamed = np.asarray(Image.open(image_file))
+        os.remove(image_file)
+        create_single_page((metadata_file, images_dir, False))
+        assert np.array_equal(streamed, np.asarray(Image.open(image_file)))
+
+
+def test_stream_render_pages_dry(pages, tmp_path):
+    """
+    This tests whether a dry streaming run doesn't write anything
+    """
+    stream_render_pages(iter(pages), str(tmp_path)+os.sep,
+                        str(tmp_path)+os.sep, dry=True)
+
+    assert sorted(os.listdir(str(tmp_path))) == ["illustration.png"]
+
+
+def test_stream_render_pages_metadata_error(pages, tmp_path):
+    """
+    This tests whether an error writing the metadata is raised
+    after rendering rather than stopping the writer and leaving
+    the pages waiting to be written blocked
+    """
+    class BrokenStore(object):
+        def append(self, data):
+            raise TypeError("not serializable")
+
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(images_dir)
+
+    with pytest.raises(TypeError):
+        stream_render_pages(iter(pages*2), str(tmp_path)+os.sep,
+                            images_dir, max_in_flight=1,
+                            store=BrokenStore())
+
+    assert len(os.listdir(images_dir)) == len(pages)
+
+
+@pytest.mark.parametrize("scheduling,window", [
+    (True, 4096), (True, 1), (False, 4096)
+])
+def test_render_pages_from_store(pages, tmp_path, monkeypatch, scheduling,
+                                 window):
+    """
+    This tests whether pages in a metadata store and JSON files
+    in the same directory are all rendered, with or without
+    scheduling them by cost and however many pages are planned
+    together
+    """
+    monkeypatch.setattr(cfg, "render_cost_scheduling", scheduling)
+    monkeypatch.setattr(cfg, "render_schedule_window", window)
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(images_dir)
+
+    with MetadataStore(metadata_dir, shard_size=2, compress=True) as store:
+        for page in pages[:2]:
+            page.dump_data(metadata_dir, dry=False, store=store)
+    pages[2].dump_data(metadata_dir, dry=False)
+
+    render_pages(metadata_dir, images_dir)
+
+    assert sorted(os.listdir(images_dir)) == sorted(
+        page.name+".png" for page in pages
+    )
+
+
+def test_render_pages_to_tar_shards(pages, tmp_path):
+    """
+    This tests whether pages rendered into tar shards can be read
+    back through the shard indices and whether reruns skip them
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    shard_dir = str(tmp_path / "shards") + os.sep
+    os.makedirs(metadata_dir)
+    os.makedirs(shard_dir)
+    for page in pages:
+        page.dump_data(metadata_dir, dry=False)
+
+    # A shard left behind by an interrupted run
+    open(shard_dir+"pages-stale-00000.tar.tmp", "w").close()
+
+    render_pages(metadata_dir, shard_dir, output="tar")
+
+    assert not any(name.endswith(".tmp") for name in os.listdir(shard_dir))
+    assert get_completed_pages(shard_dir) == set(page.name for page in pages)
+
+    for shard_path in get_tar_shard_paths(shard_dir):
+        index = load_tar_shard_index(shard_path)
+        with open(shard_path, "rb") as shard_file, \
+                tarfile.open(shard_path) as tar:
+            for name, offset, size in index['members']:
+                shard_file.seek(offset)
+                assert shard_file.read(size) == tar.extractfile(name).read()
+
+            for name in index['pages']:
+                data = json.loads(tar.extractfile(name+".json").read())
+                assert data['name'] == name
+                img = Image.open(tar.extractfile(name+".png"))
+                assert img.size == (1700, 2400)
+
+    # Everything is already rendered so nothing new is written
+    shards = get_tar_shard_paths(shard_dir)
+    render_pages(metadata_dir, shard_dir, output="tar")
+    assert get_tar_shard_paths(shard_dir) == shards
+
+
+def test_render_pages_timing_report(pages, tmp_path, monkeypatch):
+    """
+    This tests whether render timing reports the stages of
+    every rendered page and leaves skipped pages out of them
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(metadata_dir)
+    os.makedirs(images_dir)
+    for page in pages:
+        page.dump_data(metadata_dir, dry=False)
+
+    report_path = str(tmp_path / "timing.json")
+    monkeypatch.setattr(cfg, "render_timing", True)
+    monkeypatch.setattr(cfg, "render_timing_path", report_path)
+    render_pages(metadata_dir, images_dir)
+
+    with open(report_path) as json_file:
+        report = json.load(json_file)
+
+    assert report["pages"] == len(pages)
+    assert report["skipped"] == 0
+    assert report["stages"]["total"]["count"] == len(pages)
+    for stage in ["load_metadata", "mask", "paste", "encode_save"]:
+        assert stage in report["stages"]
+
+    # Pages already rendered are counted apart from rendered ones
+    os.remove(images_dir+pages[0].name+".png")
+    render_pages(metadata_dir, images_dir)
+
+    with open(report_path) as json_file:
+        report = json.load(json_file)
+
+    assert report["pages"] == 1
+    assert report["skipped"] == len(pages) - 1
+    assert report["stages"]["total"]["count"] == 1
+    assert "skipped" not in report["stages"]
+
+
+def test_render_pages_with_shared_cache(pages, tmp_path, monkeypatch):
+    """
+    This tests whether pages rendered with the workers sharing
+    an illustration cache are the same as without
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    os.makedirs(metadata_dir)
+    for page in pages:
+        page.dump_data(metadata_dir, dry=False)
+
+    rendered = {}
+    for budget in [0, 64*1024*1024]:
+        images_dir = str(tmp_path / "images{}".format(budget)) + os.sep
+        os.makedirs(images_dir)
+        monkeypatch.setattr(cfg, "shared_illustration_cache_bytes", budget)
+        stats = render_pages(metadata_dir, images_dir)
+        rendered[budget] = [np.asarray(Image.open(images_dir+name))
+                            for name in sorted(os.listdir(images_dir))]
+
+    assert stats["entries"] == stats["misses"] > 0
+    assert len(rendered[0]) == len(pages)
+    for local, shared in zip(rendered[0], rendered[64*1024*1024]):
+        assert np.array_equal(local, shared)
+
+
+def test_render_pages_quarantines_failures(pages, tmp_path):
+    """
+    This tests whether a page with a corrupt illustration is
+    quarantined with its error while the other pages render
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(metadata_dir)
+    os.makedirs(images_dir)
+
+    corrupt_path = str(tmp_path / "corrupt.png")
+    with open(corrupt_path, "wb") as corrupt_file:
+        corrupt_file.write(b"not an image")
+    leaf_panels = []
+    get_leaf_panels(pages[1], leaf_panels)
+    leaf_panels[0].image = corrupt_path
+
+    for page in pages:
+        page.dump_data(metadata_dir, dry=False)
+
+    render_pages(metadata_dir, images_dir)
+
+    rendered = sorted(name for name in os.listdir(images_dir)
+                      if name.endswith(".png"))
+    assert rendered == sorted(page.name+".png"
+                              for page in [pages[0], pages[2]])
+
+    with open(images_dir+cfg.render_quarantine_file) as quarantine_file:
+        records = [json.loads(line) for line in quarantine_file]
+    assert len(records) == 1
+    assert records[0]["page"] == metadata_dir+pages[1].name+".json"
+    assert "Traceback" in records[0]["error"]
+
+
+def test_render_pages_recycles_workers(pages, tmp_path, monkeypatch):
+    """
+    This tests whether pages still render the same when
+    workers are replaced after every page
+    """
+    metadata_dir = str(tmp_path / "metadata") + os.sep
+    os.makedirs(metadata_dir)
+    for page in pages:
+        page.dump_data(metadata_dir, dry=False)
+
+    rendered = []
+    for max_tasks_per_child in [None, 1]:
+        images_dir = str(tmp_path / "images{}".format(
+            max_tasks_per_child)) + os.sep
+        os.makedirs(images_dir)
+        monkeypatch.setattr(cfg, "render_max_tasks_per_child",
+                            max_tasks_per_child)
+        render_pages(metadata_dir, images_dir)
+        rendered.append([np.asarray(Image.open(images_dir+name))
+                         for name in sorted(os.listdir(images_dir))])
+
+    assert len(rendered[1]) == len(pages)
+    for forked, recycled in zip(*rendered):
+        assert np.array_equal(forked, recycled)
+
+
+def test_render_pages_quarantines_only_crashing_page(pages, tmp_path,
+                                                     monkeypatch):
+    """
+    This tests whether a page that kills its worker is the only
+    one quarantined although the pages rendering alongside it
+    were lost with the worker too
+    """
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(images_dir)
+    tasks = [(page.dump_dict(), images_dir, False) for page in pages]
+    poison = pages[0].name
+    render_single_page = page_creator.create_single_page
+
+    def crash_on_poison(data):
+        if data[0]['name'] == poison:
+            # Die like a worker killed for running out of memory
+            os._exit(1)
+        return render_single_page(data)
+
+    # The forked workers see the patched function
+    monkeypatch.setattr(page_creator, "create_single_page", crash_on_poison)
+    quarantine = []
+    page_creator.render_page_tasks(tasks, max_in_flight=len(tasks),
+                                   quarantine=quarantine)
+
+    assert sorted(os.listdir(images_dir)) == sorted(
+        page.name+".png" for page in pages[1:])
+    assert [page_creator.describe_task(task)
+            for task, _ in quarantine] == [poison]
+
+
+def test_render_pages_survive_crash_holding_shared_cache_lock(
+        pages, tmp_path, monkeypatch):
+    """
+    This tests whether pages still render after a worker dies
+    holding the shared illustration cache's lock since the
+    pool replacing it gets a cache of its own
+    """
+    images_dir = str(tmp_path / "images") + os.sep
+    os.makedirs(images_dir)
+    tasks = [(page.dump_dict(), images_dir, False) for page in pages]
+    poison = pages[0].name
+    render_single_page = page_creator.create_single_page
+
+    def crash_holding_lock(data):
+        if data[0]['name'] == poison:
+            render_cache._shared_cache.lock.acquire()
+            os._exit(1)
+        return render_single_page(data)
+
+    monkeypatch.setattr(cfg, "shared_illustration_cache_bytes",
+                        64*1024*1024)
+    monkeypatch.setattr(page_creator, "create_single_page",
+                        crash_holding_lock)
+    quarantine = []
+    page_creator.render_page_tasks(tasks, max_in_flight=len(tasks),
+                                   quarantine=quarantine)
+
+    assert sorted(os.listdir(images_dir)) == sorted(
+        page.name+".png" for page in pages[1:])
+    assert [page_creator.describe_task(task)
+            for task, _ in quarantine] == [poison]
+
+
+def test_render_pages_to_tar_shards_survive_crash(pages, tmp_path,
+                                                  monkeypatch):
+    """
+    This tests whether pages a killed worker already wrote into
+    a tar shard it never finished are rendered again so every
+    page ends up in a complete shard exactly once
+    """
+    shard_dir = str(tmp_path / "shards") + os.sep
+    os.makedirs(shard_dir)
+    tasks = []
+    for copy in range(3):
+        for page in pages:
+            data = page.dump_dict()
+            data['name'] = "{}-{}".format(page.name, copy)
+            tasks.append((data, shard_dir, False, "tar"))
+    crash_page = tasks[4][0]['name']
+    crashed_marker = str(tmp_path / "crashed")
+    render_single_page = page_creator.create_single_page
+
+    def crash_once(data):
+        if data[0]['name'] == crash_page and \
+                not os.path.exists(crashed_marker):
+            open(crashed_marker, "w").close()
+            os._exit(1)
+        return render_single_page(data)
+
+    monkeypatch.setattr(page_creator, "create_single_page", crash_once)
+    quarantine = []
+    page_creator.render_page_tasks(tasks, max_in_flight=2,
+                                   quarantine=quarantine)
+
+    assert os.path.exists(crashed_marker)
+    assert quarantine == []
+    assert not any(name.endswith(".tmp") for name in os.listdir(shard_dir))
+    shard_pages = [name for shard_path in get_tar_shard_paths(shard_dir)
+                   for name in load_tar_shard_index(shard_path)['pages']]
+    assert len(shard_pages) == len(tasks)
+    assert set(shard_pages) == set(task[0]['name'] for task in tasks)
@@ -0,0 +1,132 @@
+import pytest
+import numpy as np
+from PIL import Image
+
+from preprocesing.layout_engine.render_cache import (
+    IllustrationCache, load_page_illustration, get_illustration_cache,
+    load_bubble_template
+)
+from preprocesing.layout_engine.page_object_classes import SpeechBubble
+from preprocesing.layout_engine import render_cache
+from preprocesing import config_file as cfg
+from preprocesing.layout_engine.helpers import crop_image_only_outside
+
+
+@pytest.fixture
+def illustration(tmp_path):
+    """
+    A small grayscale illustration with a black border
+    """
+    array = np.zeros((60, 40), dtype=np.uint8)
+    array[10:50, 5:35] = np.random.randint(1, 255, (40, 30))
+    path = str(tmp_path / "illustration.jpg")
+    Image.fromarray(array).save(path)
+    return path
+
+
+def test_cache_evicts_by_bytes():
+    """
+    This tests whether the cache evicts the least recently used
+    arrays once the byte budget is exceeded
+    """
+    cache = IllustrationCache(max_bytes=300)
+
+    cache.put("a", np.zeros(100, dtype=np.uint8))
+    cache.put("b", np.zeros(100, dtype=np.uint8))
+    cache.put("c", np.zeros(100, dtype=np.uint8))
+
+    # Touch a so that b is the least recently used
+    assert cache.get("a") is not None
+    cache.put("d", np.zeros(100, dtype=np.uint8))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["bytes"] <= 300
+
+    # Arrays bigger than the whole budget are never stored
+    cache.put("e", np.zeros(301, dtype=np.uint8))
+    assert cache.get("e") is None
+
+
+def test_load_page_illustration_matches_direct_decode(illustration):
+    """
+    This tests whether a cached illustration is the same as
+    one decoded, cropped and resized directly
+    """
+    size = (170, 240)
+    cache = get_illustration_cache()
+    cache.clear()
+
+    img = Image.open(illustration)
+    crop = Image.fromarray(crop_image_only_outside(np.asarray(img)))
+    expected = np.asarray(crop.resize(size))
+
+    first = np.asarray(load_page_illustration(illustration, size))
+    second = np.asarray(load_page_illustration(illustration, size))
+
+    assert np.array_equal(first, expected)
+    assert np.array_equal(second, expected)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_draft_decode_is_close_to_full_decode(tmp_path, monkeypatch):
+    """
+    This tests whether decoding a large JPEG at a reduced DCT
+    scale gives nearly the same page illustration
+    """
+    y, x = np.mgrid[0:800, 0:600]
+    array = np.zeros((800, 600, 3), dtype=np.uint8)
+    array[..., 0] = 20 + (x*200)//600
+    array[..., 1] = 20 + (y*200)//800
+    array[..., 2] = 120
+    path = str(tmp_path / "large.jpg")
+    Image.fromarray(array).save(path)
+    size = (170, 240)
+
+    monkeypatch.setattr(cfg, "draft_decode", False)
+    full = render_cache.decode_page_illustration(path, size)
+    monkeypatch.setattr(cfg, "draft_decode", True)
+    draft = render_cache.decode_page_illustration(path, size)
+
+    assert draft.shape == full.shape
+    difference = np.abs(draft.astype(int) - full.astype(int))
+    assert difference.mean() < 3
+
+
+def test_bubble_template_is_shared_and_unchanged(tmp_path):
+    """
+    This tests whether bubbles rendered from a cached template
+    come out the same each time and leave the template as it was
+    """
+    array = np.zeros((90, 120), dtype=np.uint8)
+    array[10:80, 10:110] = 255
+    path = str(tmp_path / "bubble.png")
+    Image.fromarray(array).save(path)
+
+    template = load_bubble_template(path)
+    assert load_bubble_template(path) is template
+
+    transforms = ["invert", "flip vertical", "stretch x", "rotate"]
+    metadata = {"stretch_x_factor": 0.2, "rotation_amount": 15}
+    renders = []
+    for _ in range(2):
+        bubble = SpeechBubble(texts=[{}], text_indices=[0], font="",
+                              speech_bubble=path, writing_areas=[],
+                              resize_to=5000, location=[0, 0],
+                              width=120, height=90,
+                              transforms=list(transforms),
+                              transform_metadata=metadata)
+        states, img, mask, location = bubble.render()
+        renders.append((np.asarray(img), np.asarray(mask)))
+
+    assert np.array_equal(renders[0][0], renders[1][0])
+    assert np.array_equal(renders[0][1], renders[1][1])
+    # Only the bubble is inverted
+    assert not np.array_equal(renders[0][0], renders[0][1])
+    assert np.array_equal(np.asarray(template), array)
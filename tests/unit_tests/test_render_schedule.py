@@ -0,0 +1,94 @@
+import pytest
+
+from preprocesing.layout_engine.render_schedule import (
+    estimate_page_cost, chunk_by_cost,
+    simulate_makespan, plan_render_schedule, measure_tail,
+    schedule_in_windows, merge_schedule_estimates
+)
+
+
+def test_estimate_page_cost():
+    """
+    This tests whether panels, bubbles and a background
+    all add to a page's cost
+    """
+    weights = dict(page=1.0, panel=2.0, bubble=0.5, background=3.0)
+    plain = dict(num_panels=1, speech_bubbles=[], background=None)
+    busy = dict(num_panels=4, speech_bubbles=[{}, {}],
+                background="bg.jpg")
+
+    assert estimate_page_cost(plain, weights) == 3.0
+    assert estimate_page_cost(busy, weights) == 1.0 + 8.0 + 1.0 + 3.0
+
+
+def test_chunk_by_cost_covers_pages_and_shrinks():
+    """
+    This tests whether the chunks cover every page once
+    and end in single pages
+    """
+    costs = sorted([1, 2, 3, 5, 8]*40, reverse=True)
+    chunk_sizes = chunk_by_cost(costs, workers=4)
+
+    assert sum(chunk_sizes) == len(costs)
+    assert all(size >= 1 for size in chunk_sizes)
+    assert chunk_sizes[-1] == 1
+    assert chunk_sizes[0] >= chunk_sizes[-1]
+
+
+@pytest.mark.parametrize("workers", [2, 4, 8])
+def test_longest_first_shortens_tail(workers):
+    """
+    This tests whether the planned schedule's tail is
+    shorter than rendering pages in their listed order when
+    an expensive page comes last
+    """
+    costs = [1.0]*60 + [20.0]
+    order, chunk_sizes, estimate = plan_render_schedule(costs, workers)
+
+    assert sorted(order) == list(range(len(costs)))
+    assert order[0] == len(costs) - 1
+    assert estimate["scheduled_tail"] < estimate["listed_tail"]
+
+    scheduled_costs = [costs[idx] for idx in order]
+    balanced = sum(costs)/workers
+    assert simulate_makespan(scheduled_costs, workers, chunk_sizes) == \
+        pytest.approx(balanced + estimate["scheduled_tail"])
+
+
+def test_measure_tail():
+    """
+    This tests whether the tail runs from when fewer pages
+    than workers are left until the last page finishes
+    """
+    assert measure_tail([5.0, 1.0, 2.0, 3.0, 9.0], workers=2) == 4.0
+    assert measure_tail([1.0, 2.0], workers=4) == 0.0
+
+
+def test_schedule_in_windows():
+    """
+    This tests whether pages are planned a window at a time,
+    longest first within each window, and read lazily
+    """
+    read = []
+
+    def get_costed_tasks():
+        for idx, cost in enumerate([1.0, 5.0, 2.0, 3.0, 9.0]):
+            read.append(idx)
+            yield idx, cost
+
+    estimates = []
+    chunks = schedule_in_windows(get_costed_tasks(), workers=2, window=2,
+                                 estimates=estimates)
+
+    first = next(chunks)
+    assert read == [0, 1]
+    assert first[0] == 1
+
+    scheduled = first + [task for chunk in chunks for task in chunk]
+    assert scheduled == [1, 0, 3, 2, 4]
+    assert [estimate["pages"] for estimate in estimates] == [2, 2, 1]
+
+    merged = merge_schedule_estimates(estimates, workers=2)
+    assert merged["pages"] == 5
+    assert merged["windows"] == 3
+    assert merged["scheduled_tail"] == estimates[-1]["scheduled_tail"]
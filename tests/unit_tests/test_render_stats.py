@@ -0,0 +1,67 @@
+import pytest
+
+from preprocesing.layout_engine.render_stats import (
+    RenderStats, stage_timer, pop_page_timings, report_render_stats
+)
+from preprocesing import config_file as cfg
+
+
+def test_stage_timer_is_opt_in(monkeypatch):
+    """
+    This tests whether stages are only timed when
+    render timing is enabled
+    """
+    monkeypatch.setattr(cfg, "render_timing", False)
+    with stage_timer("open"):
+        pass
+    assert pop_page_timings() == {}
+
+    monkeypatch.setattr(cfg, "render_timing", True)
+    for _ in range(2):
+        with stage_timer("open"):
+            pass
+    timings = pop_page_timings()
+    assert list(timings) == ["open"]
+    assert timings["open"] >= 0
+    assert pop_page_timings() == {}
+
+
+def test_render_stats_summary(tmp_path):
+    """
+    This tests whether page timings are summarized
+    per stage and per worker
+    """
+    render_stats = RenderStats()
+    for i in range(1, 101):
+        render_stats.add(i % 2, {"open": i/1000, "total": i/100})
+
+    report_path = str(tmp_path / "timing.json")
+    summary = report_render_stats(render_stats, report_path)
+
+    assert summary["pages"] == 100
+    assert summary["stages"]["open"]["count"] == 100
+    assert summary["stages"]["open"]["p50"] == pytest.approx(0.0505)
+    assert summary["stages"]["open"]["p95"] == pytest.approx(0.09505)
+    assert summary["workers"]["0"]["pages"] == 50
+    assert summary["workers"]["1"]["seconds"] == pytest.approx(25)
+    assert (tmp_path / "timing.json").exists()
+
+
+def test_render_stats_counts_skipped_apart():
+    """
+    This tests whether skipped pages are counted without adding
+    to the rendered pages, their stages or the throughput
+    """
+    render_stats = RenderStats()
+    render_stats.add(0, {"open": 0.01, "total": 0.1})
+    render_stats.add(0, {"load_metadata": 0.01, "skipped": 0.01})
+    render_stats.skip(3)
+
+    summary = render_stats.summary()
+
+    assert summary["pages"] == 1
+    assert summary["skipped"] == 4
+    assert sorted(summary["stages"]) == ["open", "total"]
+    assert summary["workers"]["0"]["pages"] == 1
+    assert summary["pages_per_sec"] == \
+        pytest.approx(1/summary["seconds"])
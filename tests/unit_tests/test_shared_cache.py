@@ -0,0 +1,72 @@
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+from preprocesing.layout_engine.shared_cache import SharedIllustrationCache
+
+
+def publish_in_worker(args):
+    """
+    Publish an illustration from another process
+    """
+    arena_name, index_name, lock, key, value = args
+    cache = SharedIllustrationCache.attach(arena_name, index_name, lock)
+    published = cache.put(key, np.full((4, 5), value, dtype=np.uint8))
+    return published is not None
+
+
+def test_shared_cache_publishes_and_bounds_memory():
+    """
+    This tests whether published illustrations can be read back
+    through another handle without copying and whether ones that
+    don't fit the budget aren't published
+    """
+    cache = SharedIllustrationCache.create(100, 16, multiprocessing.Lock())
+    try:
+        other = SharedIllustrationCache.attach(*cache.get_attach_args())
+
+        array = np.arange(40, dtype=np.uint8).reshape(5, 8)
+        assert other.get(("a.png", (8, 5))) is None
+        published = cache.put(("a.png", (8, 5)), array)
+        assert np.array_equal(published, array)
+
+        found = other.get(("a.png", (8, 5)))
+        assert np.array_equal(found, array)
+        assert not found.flags.writeable
+
+        # Publishing again hands back the existing entry
+        assert cache.put(("a.png", (8, 5)), array) is not None
+        assert cache.stats()["entries"] == 1
+
+        # 40 of the 100 bytes are used so this doesn't fit
+        assert cache.put(("b.png", (8, 8)),
+                         np.zeros((8, 8), dtype=np.uint8)) is None
+        assert other.stats() == dict(hits=1, misses=1, entries=0, bytes=0)
+
+        del published, found
+        other.close()
+    finally:
+        cache.close()
+
+
+def test_shared_cache_across_processes():
+    """
+    This tests whether illustrations published by worker
+    processes can be read in the process that created the cache
+    """
+    lock = multiprocessing.Manager().Lock()
+    cache = SharedIllustrationCache.create(1000, 64, lock)
+    try:
+        arena_name, index_name, _ = cache.get_attach_args()
+        tasks = [(arena_name, index_name, lock, "{}.png".format(i), i)
+                 for i in range(5)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as ex:
+            assert all(ex.map(publish_in_worker, tasks))
+
+        for i in range(5):
+            found = cache.get("{}.png".format(i))
+            assert found.shape == (4, 5)
+            assert (found == i).all()
+        del found
+    finally:
+        cache.close()